@@ -0,0 +1,422 @@
+"""Offline load test for MusicPlayer.
+
+Simulates many guilds issuing play/skip/queue/playlist commands against a fake
+extractor (standing in for YoutubeDL) and fake voice clients, then reports
+time-to-first-audio, inter-track gaps, extraction throughput, event-loop lag
+and memory use as JSON so runs can be compared across changes.
+
+    python benchmarks/load_test.py --guilds 200 --duration 60 --output results.json
+"""
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+# Add the src directory to the path so we can import main
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from main import MusicPlayer, TrackIndex, YouTubeCache
+
+class FakeExtractionBackend:
+    """Extraction backend with configurable latency and error rate instead of YoutubeDL"""
+    def __init__(self, latency, jitter, error_rate, track_seconds, rng):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.track_seconds = track_seconds
+        self.rng = rng
+        self.completed = 0
+        self.failed = 0
+
+    async def _delay(self):
+        await asyncio.sleep(max(0.0, self.rng.gauss(self.latency, self.jitter)))
+        if self.rng.random() < self.error_rate:
+            self.failed += 1
+            raise RuntimeError("Simulated extraction failure")
+        self.completed += 1
+
+    def _video(self, video_id):
+        return {
+            'id': video_id,
+            'url': f'https://fake.googlevideo.test/{video_id}',
+            'title': f'Track {video_id}',
+            'duration': self.track_seconds,
+            'uploader': 'Load Test',
+            'webpage_url': f'https://www.youtube.com/watch?v={video_id}',
+        }
+
+    async def extract(self, opts, url):
+        await self._delay()
+        if url.startswith('ytsearch:'):
+            video_id = f"search-{abs(hash(url)) % 100000}"
+            return {'entries': [{'id': video_id, 'url': f'https://www.youtube.com/watch?v={video_id}', 'title': url[9:]}]}
+        return self._video(url.rsplit('=', 1)[-1])
+
+    def iter_playlist(self, opts, url):
+        playlist_id, size = url.rsplit('=', 1)[-1].split(':')
+        return iter([
+            {'id': f'{playlist_id}-{i}', 'url': f'https://www.youtube.com/watch?v={playlist_id}-{i}'}
+            for i in range(int(size))
+        ])
+
+    async def take_page(self, entries, size):
+        await self._delay()
+        return list(itertools.islice(entries, size))
+
+class FakeSource:
+    """Stands in for the FFmpeg-backed source; spawning and warming just take time"""
+    def __init__(self, track, spawn_delay):
+        self.track = track
+        self.spawn_delay = spawn_delay
+
+    def warm(self):
+        time.sleep(self.spawn_delay)
+
+    def cleanup(self):
+        pass
+
+class Recorder:
+    """Collects raw samples for the report"""
+    def __init__(self):
+        self.first_audio = []
+        self.gaps = []
+        self.loop_lag = []
+        self.command_latency = {}
+        self.command_errors = {}
+        self.background_errors = {}  # Exceptions no task retrieved, by type
+        self.tracks_started = 0
+
+    def command(self, name, seconds, error=None):
+        self.command_latency.setdefault(name, []).append(seconds)
+        if error is not None:
+            self.command_errors.setdefault(name, {})
+            key = type(error).__name__
+            self.command_errors[name][key] = self.command_errors[name].get(key, 0) + 1
+
+    def background_error(self, loop, context):
+        """Loop exception handler: count what background tasks raised instead of only logging it."""
+        error = context.get('exception')
+        key = type(error).__name__ if error else context.get('message', 'unknown')
+        self.background_errors[key] = self.background_errors.get(key, 0) + 1
+        loop.default_exception_handler(context)
+
+class FakeVoiceClient:
+    """Voice client that 'plays' a source for the track's duration, then calls `after`"""
+    def __init__(self, guild, recorder, time_scale):
+        self.guild = guild
+        self.recorder = recorder
+        self.time_scale = time_scale
+        self.source = None
+        self.after = None
+        self.handle = None
+        self.paused = False
+        self.connected = True
+
+    def is_playing(self):
+        return self.source is not None and not self.paused
+
+    def is_paused(self):
+        return self.source is not None and self.paused
+
+    def play(self, source, after=None):
+        now = time.perf_counter()
+        self.recorder.tracks_started += 1
+        if self.guild.waiting_since is not None:
+            self.recorder.first_audio.append(now - self.guild.waiting_since)
+            self.guild.waiting_since = None
+        elif self.guild.ended_at is not None:
+            self.recorder.gaps.append(now - self.guild.ended_at)
+        self.guild.ended_at = None
+
+        self.source = source
+        self.after = after
+        duration = (getattr(source, 'track', None) or {}).get('duration') or 1
+        self.handle = asyncio.get_running_loop().call_later(duration * self.time_scale, self._finish)
+
+    def _finish(self):
+        if self.handle:
+            self.handle.cancel()
+            self.handle = None
+        source, after = self.source, self.after
+        self.source = self.after = None
+        if source is None:
+            return
+        # Only count a gap when the player still has something lined up
+        state = self.guild.player.guild_states.get(self.guild.id)
+        self.guild.ended_at = time.perf_counter() if state and state.queue else None
+        if after:
+            after(None)
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+
+    def stop(self):
+        self._finish()
+
+    async def disconnect(self):
+        self._finish()
+        self.connected = False
+        self.guild.voice_client = None
+
+class FakeMessage:
+    ids = itertools.count(1)
+
+    def __init__(self):
+        self.id = next(self.ids)
+        self.edits = []
+
+    async def edit(self, **kwargs):
+        self.edits.append(kwargs)
+
+class FakeChannel:
+    def __init__(self, guild):
+        self.id = guild.id
+        self.guild = guild
+
+    async def connect(self):
+        self.guild.voice_client = FakeVoiceClient(self.guild, self.guild.recorder, self.guild.time_scale)
+        return self.guild.voice_client
+
+class FakeVoiceState:
+    def __init__(self, channel):
+        self.channel = channel
+
+class FakeAuthor:
+    def __init__(self, guild):
+        self.voice = FakeVoiceState(FakeChannel(guild))
+        self.mention = f'<@{guild.id}>'
+
+class FakeGuild:
+    """One simulated guild with a single member issuing commands"""
+    def __init__(self, guild_id, player, recorder, time_scale):
+        self.id = guild_id
+        self.player = player
+        self.recorder = recorder
+        self.time_scale = time_scale
+        self.voice_client = None
+        self.waiting_since = None
+        self.ended_at = None
+
+class FakeContext:
+    """Mimics the parts of commands.Context the player uses"""
+    def __init__(self, guild):
+        self.guild = guild
+        self.author = FakeAuthor(guild)
+        self.channel = FakeChannel(guild)
+
+    @property
+    def voice_client(self):
+        return self.guild.voice_client
+
+    async def send(self, *args, **kwargs):
+        return FakeMessage()
+
+class FakeBot:
+    def __init__(self, loop):
+        self.loop = loop
+
+async def monitor_loop_lag(recorder, interval, stop):
+    """Measure how late the event loop wakes a sleeping task."""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        recorder.loop_lag.append(max(0.0, time.perf_counter() - started - interval))
+
+async def run_guild(guild, args, rng, deadline, stop):
+    """Issue a random stream of commands until the deadline."""
+    ctx = FakeContext(guild)
+    player = guild.player
+    first = True
+    song_ids = itertools.count()
+
+    while time.perf_counter() < deadline and not stop.is_set():
+        roll = rng.random()
+        if first or roll < args.play_ratio:
+            name = 'play'
+            video = f'{guild.id}-{next(song_ids)}'
+            search = rng.choice([f'https://www.youtube.com/watch?v={video}', f'popular song {rng.randrange(args.catalog)}'])
+        elif roll < args.play_ratio + args.playlist_ratio:
+            name = 'playlist'
+            search = f'https://www.youtube.com/playlist?list={guild.id}-pl{next(song_ids)}:{args.playlist_size}'
+        elif roll < args.play_ratio + args.playlist_ratio + args.skip_ratio:
+            name = 'skip'
+        else:
+            name = 'queue'
+        first = False
+
+        state = player.guild_states.get(guild.id)
+        idle = guild.voice_client is None or (not guild.voice_client.is_playing() and not (state and state.queue))
+        if name in ('play', 'playlist') and idle and guild.waiting_since is None:
+            guild.waiting_since = time.perf_counter()
+
+        started = time.perf_counter()
+        error = None
+        try:
+            if name in ('play', 'playlist'):
+                await player.play(ctx, search)
+            elif name == 'skip':
+                await player.skip(ctx)
+            else:
+                await player.queue(ctx)
+        except Exception as e:
+            error = e
+        guild.recorder.command(name, time.perf_counter() - started, error)
+
+        await asyncio.sleep(rng.expovariate(1.0 / args.think_time))
+
+def summarize(samples):
+    """Percentile summary of a list of seconds."""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(p / 100.0 * len(ordered)))]
+
+    return {
+        'count': len(ordered),
+        'mean': statistics.fmean(ordered),
+        'p50': pct(50),
+        'p95': pct(95),
+        'p99': pct(99),
+        'max': ordered[-1],
+    }
+
+def current_rss_bytes():
+    """Resident set size from /proc, or None where that is unavailable."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(__file__),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run(args):
+    rng = random.Random(args.seed)
+    recorder = Recorder()
+    loop = asyncio.get_running_loop()
+    loop.set_exception_handler(recorder.background_error)
+
+    player = MusicPlayer(FakeBot(loop))
+    backend = FakeExtractionBackend(args.latency, args.jitter, args.error_rate, args.track_seconds, rng)
+    player.youtube_service.backend = backend
+    # Keep the run hermetic: nothing is read from or written to the real cache database
+    player.youtube_service.cache = YouTubeCache()
+    player.youtube_service.index = TrackIndex()
+    player.loudness.store = None
+    player.transcode_cache = None
+    player.snapshots = None
+    player.create_source = lambda track, guild_id=None, pipeline=None: FakeSource(track, args.spawn_delay)
+
+    guilds = [FakeGuild(guild_id, player, recorder, args.time_scale) for guild_id in range(1, args.guilds + 1)]
+    stop = asyncio.Event()
+    monitor = loop.create_task(monitor_loop_lag(recorder, args.lag_interval, stop))
+
+    rss_before = current_rss_bytes()
+    started = time.perf_counter()
+    deadline = started + args.duration
+    await asyncio.gather(*[run_guild(guild, args, random.Random(rng.random()), deadline, stop) for guild in guilds])
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await monitor
+
+    limiter_stats = player.youtube_service.limiter.stats()
+    # Tear down everything the player left running
+    for state in player.guild_states.values():
+        state.reset()
+        if state.player_task and not state.player_task.done():
+            state.player_task.cancel()
+    for guild in guilds:
+        if guild.voice_client:
+            await guild.voice_client.disconnect()
+    await asyncio.sleep(0)
+    gc.collect()  # Report failed tasks nobody awaited before the loop goes away
+
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'config': vars(args),
+        'results': {
+            'elapsed_seconds': elapsed,
+            'time_to_first_audio': summarize(recorder.first_audio),
+            'inter_track_gap': summarize(recorder.gaps),
+            'event_loop_lag': summarize(recorder.loop_lag),
+            'extraction': {
+                'completed': backend.completed,
+                'failed': backend.failed,
+                'throughput_per_second': backend.completed / elapsed if elapsed else 0.0,
+                'limiter': limiter_stats,
+            },
+            'tracks_started': recorder.tracks_started,
+            'commands': {name: summarize(samples) for name, samples in recorder.command_latency.items()},
+            'command_errors': recorder.command_errors,
+            'background_errors': recorder.background_errors,
+            'memory': {
+                'rss_before_bytes': rss_before,
+                'rss_after_bytes': current_rss_bytes(),
+                # ru_maxrss is in kilobytes on Linux and bytes on macOS
+                'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024),
+            },
+        },
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--guilds', type=int, default=50, help='number of simulated guilds')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds to keep issuing commands')
+    parser.add_argument('--latency', type=float, default=0.3, help='mean fake extraction latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.1, help='standard deviation of the extraction latency')
+    parser.add_argument('--error-rate', type=float, default=0.02, help='fraction of extractions that fail')
+    parser.add_argument('--spawn-delay', type=float, default=0.05, help='seconds a fake FFmpeg source takes to warm up')
+    parser.add_argument('--track-seconds', type=int, default=20, help='duration of every fake track')
+    parser.add_argument('--time-scale', type=float, default=0.1, help='real seconds per simulated track second')
+    parser.add_argument('--think-time', type=float, default=2.0, help='mean seconds between commands of a guild')
+    parser.add_argument('--play-ratio', type=float, default=0.45)
+    parser.add_argument('--playlist-ratio', type=float, default=0.05)
+    parser.add_argument('--skip-ratio', type=float, default=0.2)
+    parser.add_argument('--playlist-size', type=int, default=200)
+    parser.add_argument('--catalog', type=int, default=50, help='distinct search queries shared by all guilds')
+    parser.add_argument('--lag-interval', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2, default=str)
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, 'w') as f:
+            f.write(text)
+        print(f"Report written to {args.output}")
+    else:
+        print(text)
+    return report
+
+if __name__ == "__main__":
+    main()
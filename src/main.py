@@ -1,23 +1,107 @@
 import discord
 import os
+import io
+import sys
+import subprocess
 import asyncio
 import functools
 import time
-from collections import deque
+import json
+import re
+import sqlite3
+import threading
+import unicodedata
+import heapq
+import zlib
+import multiprocessing
+import itertools
+import random
+import math
+from collections import deque, OrderedDict, Counter, defaultdict
 from discord.ext import commands
 from yt_dlp import YoutubeDL
 from functools import partial, lru_cache
 from dotenv import load_dotenv
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from aiohttp import web
+
+try:
+    import numpy as np
+except ImportError:  # Soundboard clips then interrupt the music instead of mixing over it
+    np = None
 
 load_dotenv()
 
 # Constants
 TIMEOUT_DELAY = 240
-QUEUE_LOAD_LIMIT = 20
 QUEUE_EMBEDDING_SONG_LIMIT = 10
-MAX_CONCURRENT_EXTRACTIONS = 5  # Limit to avoid rate limiting
+PLAYLIST_PAGE_SIZE = 50  # Playlist entries pulled from yt-dlp per scheduler slot
+MAX_CONCURRENT_EXTRACTIONS = 5  # Starting concurrency, adapted at runtime by AdaptiveLimiter
+MIN_CONCURRENT_EXTRACTIONS = 1
+MAX_EXTRACTION_CONCURRENCY = 16
+EXTRACTION_RATE = 5.0  # Starting extraction starts per second (token bucket)
+MIN_EXTRACTION_RATE = 0.5
+MAX_EXTRACTION_RATE = 20.0
+THROTTLE_BACKOFF = 0.5  # Multiplicative decrease on HTTP 429 / throttling
+LATENCY_BACKOFF = 0.8  # Multiplicative decrease when latency climbs
+LATENCY_BACKOFF_FACTOR = 2.0  # Recent latency this many times the baseline counts as climbing
+BACKOFF_COOLDOWN = 2.0  # Seconds between two decreases so one burst of failures counts once
+PRIORITY_INTERACTIVE = 0  # A user is waiting on the result (/play of a single song, next track)
+PRIORITY_BACKGROUND = 1  # Playlist backfill
+INTERACTIVE_BURST = 8  # Interactive grants in a row before one waiting background job is let through
+SCHEDULER_QUANTUM = 1.0  # Deficit round-robin credit per guild visit
 CACHE_TTL = 3600  # 1 hour cache for YouTube data
+CACHE_MEMORY_ENTRIES = 512  # Hot entries kept in process memory
+CACHE_DISK_MAX_ENTRIES = 20000
+CACHE_DISK_MAX_BYTES = 256 * 1024 * 1024  # 256 MB of compressed metadata on disk
+CACHE_SWEEP_INTERVAL = 300  # Seconds between deletions of expired rows from the disk tier
+GUILD_STATE_TTL = 900  # Idle guild states (not playing, empty queue) are dropped after 15 minutes
+TIMER_TICK = 1.0  # Resolution of the timer wheel, in seconds
+TIMER_SLOTS = 4096  # Wheel size: deadlines within TIMER_TICK * TIMER_SLOTS are visited once
+PREFETCH_LEAD_TIME = 20  # Seconds before the end of a track to prepare the next one
+PREFETCH_BUFFER_FRAMES = 50  # 20 ms Opus frames buffered ahead (1 second)
+OPUS_FRAME_SECONDS = 0.02
+REWIND_BUFFER_FRAMES = 1500  # Played frames kept per track for rewinds (30 seconds, about 300 KB)
+STATION_BUFFER_FRAMES = 250  # Opus frames a radio station keeps for its listeners (5 seconds)
+STATION_JOIN_FRAMES = 10  # Listeners start this far behind the live edge to absorb jitter (200 ms)
+STATION_READ_TIMEOUT = 0.06  # Seconds a listener waits for a late frame before sending silence
+OPUS_SILENCE = b'\xf8\xff\xfe'  # One 20 ms Opus frame of silence
+STREAM_URL_MIN_TTL = 600  # Re-extract stream URLs that expire within 10 minutes
+EXTRACTION_BACKEND = os.getenv("EXTRACTION_BACKEND", "thread")  # "thread" or "process"
+EXTRACTION_WORKERS = os.cpu_count() or 2
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT") or 0)  # 0 disables the HTTP metrics endpoint
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TRANSCODE_CACHE_DIR = os.getenv("TRANSCODE_CACHE_DIR", os.path.join(os.path.dirname(__file__), "..", "cache", "opus"))
+TRANSCODE_CACHE_MAX_BYTES = int(os.getenv("TRANSCODE_CACHE_MAX_BYTES") or 2 * 1024 ** 3)  # 2 GB of Opus renditions
+TRANSCODE_MIN_PLAYS = 2  # Plays before a track is worth a local rendition
+MAX_CONCURRENT_TRANSCODES = 2
+TRANSCODE_TIMEOUT = 600
+LOUDNESS_TARGET_LUFS = -14.0  # Integrated loudness every track is brought to
+MAX_LOUDNESS_BOOST = 6.0  # dB, more would clip quiet-but-peaky tracks
+MAX_LOUDNESS_CUT = 20.0  # dB
+MAX_CONCURRENT_ANALYSES = 1  # Loudness scans run in the background, one at a time
+LOUDNESS_TTL = 90 * 24 * 3600  # Measurements do not go stale like stream URLs
+SOUNDBOARD_DIR = os.getenv("SOUNDBOARD_DIR", os.path.join(os.path.dirname(__file__), "..", "local"))
+SOUNDBOARD_MAX_SECONDS = 30  # Longer clips are cut, they stay in memory as raw PCM (~190 KB/s)
+OKUL_CLIP = os.path.splitext(os.path.basename(os.getenv("OKUL_MEME_PATH") or "okul"))[0]
+PCM_FRAME_SAMPLES = 1920  # 20 ms of 48 kHz stereo, interleaved 16-bit samples
+SHARD_COUNT = int(os.getenv("SHARD_COUNT") or 0)  # 0 runs a single unsharded bot
+SHARD_PROCESSES = int(os.getenv("SHARD_PROCESSES") or os.cpu_count() or 1)
+SHARD_IDS = os.getenv("SHARD_IDS")  # Set by the supervisor for each worker process
+SHARD_RESTART_DELAY = 5  # Seconds before a crashed worker is started again
+QUEUE_SNAPSHOT_INTERVAL = 15  # Seconds between snapshots of changed guild queues
+QUEUE_SNAPSHOT_TTL = 24 * 3600  # Older queues are not restored
+QUEUE_SNAPSHOT_LOG_LIMIT = 40  # Change logs kept per guild before its queue is written whole again
+QUEUE_JOURNAL_LIMIT = 1000  # Queue changes journaled between snapshots before a full copy is cheaper
+SEARCH_INDEX_MAX_TRACKS = 50000  # Resolved tracks kept in the local search index
+SEARCH_INDEX_TTL = 180 * 24 * 3600
+SEARCH_MATCH_COVERAGE = 0.6  # Share of a title's trigrams a query must contain to be answered locally
+AUTOCOMPLETE_LIMIT = 10  # Discord allows up to 25 choices
+PLAYER_MESSAGE_DEBOUNCE = 1.5  # Seconds player message updates are coalesced before one REST call
+SEARCH_POSTING_SCAN = 1000  # Longer trigram postings only rescore candidates found through rarer ones
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", os.path.join(os.path.dirname(__file__), "..", "cache", "metadata.sqlite3"))
 
 # FFmpeg options - optimized for better performance
 FFMPEG_OPTIONS = {
@@ -25,9 +109,258 @@ FFMPEG_OPTIONS = {
     'options': '-vn -af dynaudnorm=f=200:g=3:n=0:p=0.95'  # Added dynamic audio normalization
 }
 
+# "normalize" runs every stream through dynaudnorm; "passthrough" remuxes Opus sources untouched
+PLAYBACK_MODE = os.getenv("PLAYBACK_MODE", "normalize")
+PASSTHROUGH_GAIN_TOLERANCE = 2.0  # dB of known gain correction worth skipping to avoid a re-encode
+
+# Live FFmpeg playback processes are admitted against a budget in PIPELINE_COSTS units (one dynaudnorm stream each)
+FFMPEG_BUDGET = float(os.getenv("FFMPEG_BUDGET") or (os.cpu_count() or 1) * 16)
+FFMPEG_CPU_LIMIT = float(os.getenv("FFMPEG_CPU_LIMIT") or 0.85)  # Share of all cores FFmpeg may use before starts degrade
+FFMPEG_ADMISSION_TIMEOUT = 10  # Seconds a start waits for budget before it runs on the cheapest pipeline anyway
+FFMPEG_SAMPLE_INTERVAL = 5  # Seconds between CPU/RSS samples of live processes
+PIPELINE_COSTS = {'dynaudnorm': 1.0, 'gain': 0.6, 'encode': 0.5, 'copy': 0.05}
+RATIO_BUCKETS = (0.1, 0.25, 0.5, 0.75, 0.9, 1.0, 1.1, 1.5, 2.0, 5.0, 10.0)
+
 # Thread pool for CPU-bound tasks
 thread_pool = ThreadPoolExecutor(max_workers=4)
 
+class Histogram:
+    """Cumulative-bucket latency histogram"""
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+    
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile."""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return self.buckets[i] if i < len(self.buckets) else float('inf')
+        return float('inf')
+
+class MetricTimer:
+    """Context manager observing the duration of a block into a histogram"""
+    def __init__(self, registry, name, guild_id, labels):
+        self.registry = registry
+        self.name = name
+        self.guild_id = guild_id
+        self.labels = labels
+        self.started = None
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.observe(self.name, time.perf_counter() - self.started, self.guild_id, **self.labels)
+
+class Metrics:
+    """Counters, gauges and latency histograms, recorded globally and per guild (per guild for /stats only)"""
+    BUCKETS = {'ffmpeg_speed': RATIO_BUCKETS, 'ffmpeg_cpu_per_audio_second': RATIO_BUCKETS}  # Histograms that are not latencies
+    
+    def __init__(self):
+        self.counters = {}  # (name, labels) -> value
+        self.gauges = {}  # (name, labels) -> last value set
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.lock = threading.Lock()  # Voice threads record too
+        self.server = None
+    
+    @staticmethod
+    def _keys(name, guild_id, labels):
+        base = tuple(sorted(labels.items()))
+        keys = [(name, base)]
+        if guild_id is not None:
+            keys.append((name, base + (('guild', str(guild_id)),)))
+        return keys
+    
+    def inc(self, name, guild_id=None, amount=1, **labels):
+        with self.lock:
+            for key in self._keys(name, guild_id, labels):
+                self.counters[key] = self.counters.get(key, 0) + amount
+    
+    def set(self, name, value, guild_id=None, **labels):
+        with self.lock:
+            for key in self._keys(name, guild_id, labels):
+                self.gauges[key] = value
+    
+    def observe(self, name, seconds, guild_id=None, **labels):
+        with self.lock:
+            for key in self._keys(name, guild_id, labels):
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(self.BUCKETS.get(name, LATENCY_BUCKETS))
+                histogram.observe(seconds)
+    
+    def timer(self, name, guild_id=None, **labels):
+        return MetricTimer(self, name, guild_id, labels)
+    
+    def forget_guild(self, guild_id):
+        """Drop every series of a guild that went idle."""
+        label = ('guild', str(guild_id))
+        with self.lock:
+            for series in (self.counters, self.gauges, self.histograms):
+                for key in [key for key in series if label in key[1]]:
+                    del series[key]
+    
+    @staticmethod
+    def _escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    
+    @classmethod
+    def _format_labels(cls, labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{k}="{cls._escape(v)}"' for k, v in pairs) + '}'
+    
+    @staticmethod
+    def _exported(items):
+        """Global series only: one series per guild ever seen would grow without bound."""
+        return sorted((key, value) for key, value in items if not any(k == 'guild' for k, _ in key[1]))
+    
+    def render(self):
+        """Prometheus text exposition of every global metric."""
+        lines = []
+        with self.lock:
+            for (name, labels), value in self._exported(self.counters.items()):
+                lines.append(f"jonkler_{name}{self._format_labels(labels)} {value}")
+            for (name, labels), value in self._exported(self.gauges.items()):
+                lines.append(f"jonkler_{name}{self._format_labels(labels)} {value}")
+            for (name, labels), histogram in self._exported(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(list(histogram.buckets) + ['+Inf'], histogram.counts):
+                    cumulative += count
+                    lines.append(f"jonkler_{name}_bucket{self._format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"jonkler_{name}_sum{self._format_labels(labels)} {histogram.sum}")
+                lines.append(f"jonkler_{name}_count{self._format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+    
+    def summary(self, guild_id=None):
+        """p50/p95 and counts of every histogram, for one guild or globally."""
+        result = {}
+        with self.lock:
+            for (name, labels), histogram in self.histograms.items():
+                guild_label = dict(labels).get('guild')
+                if guild_label != (str(guild_id) if guild_id is not None else None):
+                    continue
+                other = ','.join(f'{k}={v}' for k, v in labels if k != 'guild')
+                key = f"{name}[{other}]" if other else name
+                result[key] = {'count': histogram.count, 'p50': histogram.quantile(0.5), 'p95': histogram.quantile(0.95)}
+        return result
+    
+    def counter(self, name, guild_id=None, **labels):
+        key = self._keys(name, guild_id, labels)[-1]
+        return self.counters.get(key, 0)
+    
+    async def start_server(self, host=METRICS_HOST, port=METRICS_PORT):
+        """Serve /metrics over HTTP for a local Prometheus scraper."""
+        async def handle(request):
+            return web.Response(text=self.render(), content_type='text/plain')
+        
+        app = web.Application()
+        app.router.add_get('/metrics', handle)
+        self.server = web.AppRunner(app)
+        await self.server.setup()
+        await web.TCPSite(self.server, host, port).start()
+        print(f"Metrics available on http://{host}:{port}/metrics")
+
+metrics = Metrics()
+
+class TimerWheel:
+    """Hashed timing wheel of keyed deadlines (cache TTLs, idle disconnects, eviction), fired on the event loop"""
+    def __init__(self, tick=TIMER_TICK, slots=TIMER_SLOTS):
+        self.tick = tick
+        self.size = slots
+        self.slots = {}  # slot index -> {key: (due tick, callback)}
+        self.timers = {}  # key -> due tick
+        self.current = self._now()  # Last tick processed
+        self.task = None
+    
+    def _now(self):
+        return int(time.monotonic() / self.tick)
+    
+    def __contains__(self, key):
+        return key in self.timers
+    
+    def __len__(self):
+        return len(self.timers)
+    
+    def schedule(self, key, delay, callback):
+        """Run `callback()` after `delay` seconds, replacing any timer with the same key."""
+        self.cancel(key)
+        if not self.timers:
+            self.current = self._now()
+        due = max(math.ceil((time.monotonic() + max(delay, 0)) / self.tick), self.current + 1)
+        self.slots.setdefault(due % self.size, {})[key] = (due, callback)
+        self.timers[key] = due
+        self._ensure_running()
+        return key
+    
+    def cancel(self, key):
+        due = self.timers.pop(key, None)
+        if due is not None:
+            slot = self.slots[due % self.size]
+            del slot[key]
+            if not slot:
+                del self.slots[due % self.size]
+    
+    def advance(self, now=None):
+        """Fire every timer due by tick `now` and return how many fired."""
+        now = self._now() if now is None else now
+        if now - self.current >= self.size:
+            ticks = list(self.slots)  # Fell a whole turn behind: every slot may hold due timers
+        else:
+            ticks = range(self.current + 1, now + 1)
+        self.current = max(self.current, now)
+        
+        fired = 0
+        for tick in ticks:
+            slot = self.slots.get(tick % self.size)
+            if not slot:
+                continue
+            for key, (due, callback) in list(slot.items()):
+                if due > now or self.timers.get(key) != due:
+                    continue
+                self.cancel(key)
+                fired += 1
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"Timer {key} failed: {e}")
+        if fired:
+            metrics.inc('timers_fired_total', amount=fired)
+        return fired
+    
+    def _ensure_running(self):
+        if self.task is None or self.task.done():
+            try:
+                self.task = asyncio.get_running_loop().create_task(self._run())
+            except RuntimeError:
+                self.task = None  # No loop yet: the first schedule inside one starts the wheel
+    
+    async def _run(self):
+        while self.timers:
+            await asyncio.sleep(self.tick - time.monotonic() % self.tick)
+            self.advance()
+
+timers = TimerWheel()
+
 class LoggerOutputs:
     @staticmethod
     def error(msg):
@@ -41,33 +374,1723 @@ class LoggerOutputs:
     def debug(msg):
         pass
 
+# Fields kept from yt-dlp info dicts, everything else (formats, thumbnails, ...) is dropped
+SLIM_INFO_KEYS = ('id', 'url', 'title', 'duration', 'thumbnail', 'uploader', 'webpage_url', 'acodec', 'asr')
+SLIM_ENTRY_KEYS = ('id', 'url', 'title', 'duration', 'uploader')
+
+def slim_info(info):
+    """Reduce a yt-dlp info dict to the fields the bot actually uses."""
+    if not info:
+        return None
+    
+    result = {key: info[key] for key in SLIM_INFO_KEYS if info.get(key) is not None}
+    if info.get('entries') is not None:
+        result['entries'] = [
+            {key: entry[key] for key in SLIM_ENTRY_KEYS if entry.get(key) is not None} if entry else None
+            for entry in info['entries']
+        ]
+    return result
+
+def extract_with_new_ydl(opts, url):
+    """Run one extraction with a throwaway YoutubeDL (safe to call from any thread)."""
+    with YoutubeDL(opts) as ydl:
+        return slim_info(ydl.extract_info(url, download=False))
+
+# Long-lived YoutubeDL instances of an extraction worker process, keyed by their options
+_worker_ydls = {}
+
+def extract_in_worker(opts, url):
+    """Run one extraction inside a worker process, reusing its YoutubeDL instance."""
+    key = json.dumps(opts, sort_keys=True, default=str)
+    ydl = _worker_ydls.get(key)
+    if ydl is None:
+        ydl = _worker_ydls[key] = YoutubeDL(opts)
+    try:
+        return slim_info(ydl.extract_info(url, download=False))
+    except Exception as e:
+        # yt-dlp errors carry loggers and tracebacks that cannot be pickled back to the bot
+        raise RuntimeError(str(e)) from None
+
+def playlist_entries(opts, url):
+    """Lazily yield a playlist's flat entries; yt-dlp fetches pages as the generator advances."""
+    opts = {**opts, 'lazy_playlist': True}
+    with YoutubeDL(opts) as ydl:
+        info = ydl.extract_info(url, download=False, process=False)
+        # watch?v=...&list=... resolves to a redirect to the playlist tab first
+        for _ in range(3):
+            if not info or info.get('_type') not in ('url', 'url_transparent'):
+                break
+            info = ydl.extract_info(info['url'], download=False, process=False, ie_key=info.get('ie_key'))
+        
+        for entry in (info or {}).get('entries') or ():
+            if entry:
+                yield {key: entry[key] for key in SLIM_ENTRY_KEYS if entry.get(key) is not None}
+
+class ThreadExtractionBackend:
+    """Runs yt-dlp on the shared thread pool"""
+    async def extract(self, opts, url):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(thread_pool, partial(extract_with_new_ydl, opts, url))
+    
+    def iter_playlist(self, opts, url):
+        return playlist_entries(opts, url)
+    
+    async def take_page(self, entries, size):
+        """Advance a playlist iterator by up to `size` entries."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(thread_pool, lambda: list(itertools.islice(entries, size)))
+
+class ProcessExtractionBackend:
+    """Runs yt-dlp in worker processes so extraction does not compete for the bot's GIL"""
+    def __init__(self, workers=EXTRACTION_WORKERS):
+        self.workers = workers
+        self.pool = None
+        self.fallback = ThreadExtractionBackend()
+    
+    def _get_pool(self):
+        if self.pool is None:
+            # spawn avoids forking a process that already runs the voice threads
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self.pool
+    
+    async def extract(self, opts, url):
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._get_pool(), partial(extract_in_worker, opts, url))
+        except BrokenProcessPool as e:
+            print(f"Extraction worker pool broke, falling back to threads: {e}")
+            self.pool = None
+            return await self.fallback.extract(opts, url)
+    
+    # A lazy playlist iterator cannot cross a process boundary, so streaming stays on threads
+    def iter_playlist(self, opts, url):
+        return self.fallback.iter_playlist(opts, url)
+    
+    async def take_page(self, entries, size):
+        return await self.fallback.take_page(entries, size)
+
+THROTTLING_MARKERS = ('429', 'too many requests', 'rate limit', 'rate-limit', "confirm you're not a bot", 'confirm you’re not a bot')
+
+def is_throttling_error(error):
+    """Tell whether an extraction error means YouTube is throttling us."""
+    message = str(error).lower()
+    return any(marker in message for marker in THROTTLING_MARKERS)
+
+class LimiterSlot:
+    """One admitted extraction, reports its outcome back to the limiter"""
+    guild_id = None
+    
+    def __init__(self, limiter, kind='extract'):
+        self.limiter = limiter
+        self.kind = kind
+        self.error = None
+        self.started = None
+    
+    def failed(self, error):
+        self.error = error
+    
+    async def _admit(self):
+        await self.limiter.acquire()
+    
+    async def __aenter__(self):
+        with metrics.timer('extraction_wait_seconds', self.guild_id, kind=self.kind):
+            await self._admit()
+        self.started = time.monotonic()
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        latency = time.monotonic() - self.started
+        if exc_type is not None:
+            outcome = 'cancelled' if issubclass(exc_type, asyncio.CancelledError) else 'error'
+            self.error = self.error or exc
+        elif self.error is None:
+            outcome = 'success'
+        else:
+            outcome = 'throttled' if is_throttling_error(self.error) else 'error'
+        self.limiter.release(outcome, latency)
+        metrics.observe('extraction_duration_seconds', latency, self.guild_id, kind=self.kind, outcome=outcome)
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit plus a token bucket on extraction starts"""
+    def __init__(self, limit=MAX_CONCURRENT_EXTRACTIONS, min_limit=MIN_CONCURRENT_EXTRACTIONS,
+                 max_limit=MAX_EXTRACTION_CONCURRENCY, rate=EXTRACTION_RATE,
+                 min_rate=MIN_EXTRACTION_RATE, max_rate=MAX_EXTRACTION_RATE):
+        self.limit = float(limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.rate = float(rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.tokens = 1.0
+        self.last_refill = time.monotonic()
+        self.in_flight = 0
+        self.waiters = deque()
+        self.latency_baseline = None  # Slow EWMA of successful extraction latency
+        self.latency_recent = None  # Fast EWMA, compared against the baseline
+        self.last_backoff = 0.0
+        self.counts = {'success': 0, 'throttled': 0, 'error': 0, 'cancelled': 0}
+    
+    def slot(self, kind='extract'):
+        """Async context manager admitting one extraction."""
+        return LimiterSlot(self, kind)
+    
+    async def acquire(self):
+        if self.in_flight < int(self.limit) and not self.waiters:
+            self.in_flight += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # Admitted and cancelled in the same tick, give the slot back
+                    self.give_back()
+                raise
+        
+        try:
+            await self._take_token()
+        except asyncio.CancelledError:
+            self.give_back()
+            raise
+    
+    async def _take_token(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return
+            await asyncio.sleep((1.0 - self.tokens) / self.rate)
+    
+    def release(self, outcome, latency):
+        self.in_flight -= 1
+        self.counts[outcome] += 1
+        
+        if outcome == 'success':
+            self._observe_latency(latency)
+            if self.latency_recent > self.latency_baseline * LATENCY_BACKOFF_FACTOR:
+                self._back_off(LATENCY_BACKOFF)
+            else:
+                # Additive increase: about +1 concurrency per window of `limit` successes
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+                self.rate = min(self.max_rate, self.rate + 0.1)
+        elif outcome == 'throttled':
+            self._back_off(THROTTLE_BACKOFF)
+        
+        self._wake()
+    
+    def _observe_latency(self, latency):
+        if self.latency_baseline is None:
+            self.latency_baseline = self.latency_recent = latency
+        else:
+            self.latency_baseline += 0.02 * (latency - self.latency_baseline)
+            self.latency_recent += 0.3 * (latency - self.latency_recent)
+    
+    def _back_off(self, factor):
+        now = time.monotonic()
+        if now - self.last_backoff < BACKOFF_COOLDOWN:
+            return
+        self.last_backoff = now
+        self.limit = max(self.min_limit, self.limit * factor)
+        self.rate = max(self.min_rate, self.rate * factor)
+        if self.latency_recent is not None:
+            # Start judging latency afresh at the new, lower load
+            self.latency_baseline = self.latency_recent
+    
+    def give_back(self):
+        """Return a slot that was acquired but never used."""
+        self.in_flight -= 1
+        self._wake()
+    
+    def _wake(self):
+        while self.waiters and self.in_flight < int(self.limit):
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+    
+    def stats(self):
+        """Current limits and counters, for diagnostics."""
+        return {
+            'limit': round(self.limit, 2),
+            'rate': round(self.rate, 2),
+            'in_flight': self.in_flight,
+            'waiting': len(self.waiters),
+            'latency_baseline': self.latency_baseline,
+            'latency_recent': self.latency_recent,
+            **self.counts,
+        }
+
+class ScheduledSlot(LimiterSlot):
+    """Limiter slot granted by the ExtractionScheduler instead of first come, first served"""
+    def __init__(self, scheduler, guild_id, priority, cost, kind):
+        super().__init__(scheduler.limiter, kind)
+        self.scheduler = scheduler
+        self.guild_id = guild_id
+        self.priority = priority
+        self.cost = cost
+    
+    async def _admit(self):
+        waiter = self.scheduler.enqueue(self.guild_id, self.priority, self.cost)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.limiter.give_back()
+            raise
+
+class ExtractionScheduler:
+    """Hands out extraction slots fairly across guilds
+
+    Interactive requests are served round-robin before background work; background
+    work is served with deficit round-robin so one huge playlist cannot starve others.
+    """
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.queues = {PRIORITY_INTERACTIVE: OrderedDict(), PRIORITY_BACKGROUND: OrderedDict()}
+        self.deficits = {}
+        self.interactive_streak = 0
+        self.pending = 0
+        self.loop = None
+        self.wakeup = None
+        self.dispatcher = None
+    
+    def slot(self, guild_id=None, priority=PRIORITY_INTERACTIVE, cost=1.0, kind='extract'):
+        """Async context manager admitting one extraction for a guild."""
+        return ScheduledSlot(self, guild_id, priority, cost, kind)
+    
+    def enqueue(self, guild_id, priority, cost):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.wakeup = asyncio.Event()
+            self.dispatcher = None
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = loop.create_task(self._dispatch())
+        
+        waiter = loop.create_future()
+        waiter.cost = cost
+        self.queues[priority].setdefault(guild_id, deque()).append(waiter)
+        self.pending += 1
+        self.wakeup.set()
+        return waiter
+    
+    async def _dispatch(self):
+        while True:
+            if not self.pending:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            
+            await self.limiter.acquire()
+            waiter = self._next_waiter()
+            if waiter is None:
+                self.limiter.give_back()  # Every waiter was cancelled meanwhile
+            else:
+                waiter.set_result(None)
+    
+    def _next_waiter(self):
+        background_waiting = bool(self.queues[PRIORITY_BACKGROUND])
+        if self.interactive_streak >= INTERACTIVE_BURST and background_waiting:
+            self.interactive_streak = 0
+            waiter = self._next_background()
+            if waiter:
+                return waiter
+        
+        waiter = self._next_interactive()
+        if waiter:
+            self.interactive_streak += 1
+            return waiter
+        
+        self.interactive_streak = 0
+        return self._next_background()
+    
+    def _pop_live(self, queue):
+        """Pop the first waiter whose caller has not given up."""
+        while queue:
+            waiter = queue.popleft()
+            self.pending -= 1
+            if not waiter.done():
+                return waiter
+        return None
+    
+    def _next_interactive(self):
+        queues = self.queues[PRIORITY_INTERACTIVE]
+        while queues:
+            guild_id, queue = next(iter(queues.items()))
+            waiter = self._pop_live(queue)
+            if queue:
+                queues.move_to_end(guild_id)
+            else:
+                del queues[guild_id]
+            if waiter:
+                return waiter
+        return None
+    
+    def _next_background(self):
+        queues = self.queues[PRIORITY_BACKGROUND]
+        while queues:
+            guild_id, queue = next(iter(queues.items()))
+            while queue and queue[0].done():
+                queue.popleft()
+                self.pending -= 1
+            if not queue:
+                del queues[guild_id]
+                self.deficits.pop(guild_id, None)
+                continue
+            
+            deficit = self.deficits.get(guild_id, 0.0)
+            if deficit < queue[0].cost:
+                deficit += SCHEDULER_QUANTUM
+            if deficit < queue[0].cost:
+                # Not enough credit for this job yet, let the next guild go
+                self.deficits[guild_id] = deficit
+                queues.move_to_end(guild_id)
+                continue
+            
+            waiter = queue.popleft()
+            self.pending -= 1
+            self.deficits[guild_id] = deficit - waiter.cost
+            if not queue:
+                del queues[guild_id]
+                self.deficits.pop(guild_id, None)
+            elif self.deficits[guild_id] < queue[0].cost:
+                queues.move_to_end(guild_id)
+            return waiter
+        return None
+    
+    def stats(self):
+        """Queued requests per priority class, for diagnostics."""
+        return {
+            'interactive_waiting': sum(len(q) for q in self.queues[PRIORITY_INTERACTIVE].values()),
+            'background_waiting': sum(len(q) for q in self.queues[PRIORITY_BACKGROUND].values()),
+            'guilds_waiting': len(set(self.queues[PRIORITY_INTERACTIVE]) | set(self.queues[PRIORITY_BACKGROUND])),
+        }
+
+def ffmpeg_pipeline(track, mode=PLAYBACK_MODE):
+    """Pick the cheapest FFmpeg pipeline for a track: (name, FFmpegOpusAudio kwargs).
+
+    Tracks with a measured loudness get a static volume gain; dynaudnorm is only the
+    fallback for a first play before the LoudnessAnalyzer has measured the track.
+    In passthrough mode Opus sources are remuxed without decoding, and the gain (which
+    needs a re-encode) is only applied when it exceeds PASSTHROUGH_GAIN_TOLERANCE.
+    """
+    gain = track.get('gain_db')
+    if mode != "passthrough":
+        if gain is None:
+            return 'dynaudnorm', dict(FFMPEG_OPTIONS)
+        return 'gain', {'before_options': FFMPEG_OPTIONS['before_options'], 'options': f'-vn -af volume={gain:.2f}dB'}
+    
+    needs_gain = gain is not None and abs(gain) >= PASSTHROUGH_GAIN_TOLERANCE
+    if is_opus_source(track) and not needs_gain:
+        return 'copy', {'before_options': FFMPEG_OPTIONS['before_options'], 'options': '-vn', 'codec': 'copy'}
+    if needs_gain:
+        return 'gain', {'before_options': FFMPEG_OPTIONS['before_options'], 'options': f'-vn -af volume={gain:.2f}dB'}
+    return 'encode', {'before_options': FFMPEG_OPTIONS['before_options'], 'options': '-vn'}
+
+def is_opus_source(track):
+    return track.get('acodec') == 'opus' and track.get('asr') in (None, 48000)
+
+def fallback_pipelines(track):
+    """Pipelines for a track from the configured one down to the cheapest, for FFmpegBudget.
+    
+    Each step gives up some loudness processing: dynaudnorm or the measured gain first,
+    then, for Opus sources, the re-encode itself.
+    """
+    plain = {'before_options': FFMPEG_OPTIONS['before_options'], 'options': '-vn'}
+    pipelines = [ffmpeg_pipeline(track), ('encode', plain)]
+    if is_opus_source(track):
+        pipelines.append(('copy', dict(plain, codec='copy')))
+    
+    seen = set()
+    return [(name, options) for name, options in pipelines if not (name in seen or seen.add(name))]
+
+def process_usage(pid):
+    """(CPU seconds, RSS bytes) of a process from /proc, or None where that is unavailable."""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{pid}/statm') as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')  # utime + stime
+    return cpu, resident_pages * os.sysconf('SC_PAGE_SIZE')
+
+def is_page_url(url):
+    """Whether a URL points at a YouTube watch page rather than a media stream."""
+    return bool(url) and re.search(r'(youtube\.com/watch|youtu\.be/)', url) is not None
+
+def stream_cache_ttl(info):
+    """Seconds extracted info stays usable: until shortly before its stream URL expires."""
+    expires = stream_url_expires(info.get('url'))
+    if expires is None:
+        return None
+    return expires - time.time() - STREAM_URL_MIN_TTL
+
+def stream_url_expires(url):
+    """Return the expiry timestamp embedded in a googlevideo stream URL, if any."""
+    match = re.search(r'[?&/]expire[=/](\d+)', url or '')
+    return int(match.group(1)) if match else None
+
+class FFmpegLog:
+    """stderr sink for an FFmpeg source that notices when the CDN refuses the stream URL"""
+    FORBIDDEN_MARKERS = (b'403 Forbidden', b'HTTP error 403')
+    
+    def __init__(self, limit=4096):
+        self.tail = b''
+        self.limit = limit
+        self.forbidden = False
+    
+    def write(self, data):
+        # Called from discord.py's stderr reader thread
+        self.tail = (self.tail + data)[-self.limit:]
+        if not self.forbidden:
+            self.forbidden = any(marker in self.tail for marker in self.FORBIDDEN_MARKERS)
+        return len(data)
+
+class WarmOpusSource(discord.AudioSource):
+    """Opus source that reads ahead, keeps recently played frames and can be interjected.
+    
+    `read` runs on the voice thread while `interject` and `seek_back` are called from
+    the event loop, so the buffers are guarded by a lock.
+    """
+    def __init__(self, source, guild_id=None, history_frames=REWIND_BUFFER_FRAMES, log=None, offset=0):
+        self.source = source
+        self.guild_id = guild_id
+        self.log = log  # FFmpegLog of a remote stream
+        self.offset = offset  # Seconds into the track FFmpeg was started at
+        self.buffer = deque()  # Frames read ahead, not yet played
+        self.history = deque(maxlen=history_frames)  # Ring of frames already played
+        self.position = 0  # Frames of this track played so far
+        self.interjection = None  # (source, after) played before the track resumes
+        self.mixer = None  # PCMMixer, created by the first overlay
+        self.pcm = False  # Whether the last packet returned is PCM rather than Opus
+        self.lock = threading.Lock()
+        self.spawned_at = time.perf_counter()
+        self.first_packet = False
+        self.packets_read = 0  # Packets FFmpeg has produced, for its encoder speed
+        self.lease = None  # FFmpegLease of the process, released on cleanup
+    
+    def _read_source(self):
+        packet = self.source.read()
+        if packet:
+            self.packets_read += 1
+        if packet and not self.first_packet:
+            self.first_packet = True
+            metrics.observe('ffmpeg_first_packet_seconds', time.perf_counter() - self.spawned_at, self.guild_id)
+        return packet
+    
+    @property
+    def forbidden(self):
+        """Whether the CDN refused the stream URL while this source was playing."""
+        return bool(self.log and self.log.forbidden)
+    
+    @property
+    def elapsed(self):
+        """Seconds into the track, counted from its start even when FFmpeg was seeked."""
+        return self.offset + self.position * OPUS_FRAME_SECONDS
+    
+    def warm(self, frames=PREFETCH_BUFFER_FRAMES):
+        """Block until `frames` packets are buffered (run this in an executor)."""
+        while len(self.buffer) < frames:
+            packet = self._read_source()
+            if not packet:
+                break
+            with self.lock:
+                self.buffer.append(packet)
+    
+    def read(self):
+        with self.lock:
+            if self.interjection:
+                source = self.interjection[0]
+                packet = self._read_interjection()
+                if packet:
+                    self.pcm = not source.is_opus()
+                    return packet
+            packet = self.buffer.popleft() if self.buffer else None
+        if packet is None:
+            packet = self._read_source()
+        with self.lock:
+            if packet:
+                self.history.append(packet)
+                self.position += 1
+            # Frames are only decoded while a clip is mixed in, otherwise Opus passes through
+            self.pcm = bool(self.mixer and self.mixer.active)
+            if self.pcm:
+                return self.mixer.mix(self.mixer.decode(packet) if packet else None)
+        return packet
+    
+    def _read_interjection(self):
+        packet = self.interjection[0].read()
+        if not packet:
+            self._finish_interjection()
+        return packet
+    
+    def interject(self, source, after=None):
+        """Play `source` in place of the track, then resume it from the same frame.
+        
+        `after` is called from the voice thread once the interjection is done.
+        """
+        with self.lock:
+            if self.interjection:
+                self._finish_interjection()
+            self.interjection = (source, after)
+    
+    def _finish_interjection(self):
+        source, after = self.interjection
+        self.interjection = None
+        source.cleanup()
+        if after:
+            after()
+    
+    def overlay(self, samples, after=None):
+        """Mix in-memory PCM `samples` over the track without pausing it."""
+        with self.lock:
+            if self.mixer is None:
+                self.mixer = PCMMixer()
+            self.mixer.add(samples, after)
+    
+    def seek_back(self, seconds):
+        """Replay up to `seconds` of already played audio from memory; return the seconds rewound."""
+        with self.lock:
+            frames = min(int(seconds / OPUS_FRAME_SECONDS), len(self.history))
+            for _ in range(frames):
+                self.buffer.appendleft(self.history.pop())
+            self.position -= frames
+        return frames * OPUS_FRAME_SECONDS
+    
+    def is_opus(self):
+        return not self.pcm
+    
+    def cleanup(self):
+        with self.lock:
+            if self.interjection:
+                self._finish_interjection()
+            if self.mixer:
+                self.mixer.clear()
+            self.buffer.clear()
+            self.history.clear()
+        self.source.cleanup()
+        if self.lease:
+            self.lease.release()
+
+class FFmpegLease:
+    """Budget held by one live FFmpeg process"""
+    def __init__(self, budget, pipeline, guild_id, loop):
+        self.budget = budget
+        self.pipeline = pipeline
+        self.cost = PIPELINE_COSTS[pipeline]
+        self.guild_id = guild_id
+        self.loop = loop
+        self.process = None
+        self.source = None  # WarmOpusSource reading from the process, for its speed
+        self.sample = None  # (wall time, CPU seconds, packets read) at the last sample
+    
+    def attach(self, source):
+        """Follow the process behind a WarmOpusSource (or a bare discord FFmpeg source)."""
+        if isinstance(source, WarmOpusSource):
+            self.source = source
+            source.lease = self
+            source = source.source
+        self.process = getattr(source, '_process', None)
+        if self.process is None and self.source is None:
+            self.release()  # Nothing running that could be followed
+    
+    def release(self):
+        self.budget.release(self)
+
+class FFmpegBudget:
+    """Admission control for FFmpeg playback processes, with CPU/RSS accounting"""
+    def __init__(self, budget=FFMPEG_BUDGET, cpu_limit=FFMPEG_CPU_LIMIT, timeout=FFMPEG_ADMISSION_TIMEOUT,
+                 sample_interval=FFMPEG_SAMPLE_INTERVAL):
+        self.budget = budget
+        self.cpu_limit = cpu_limit * (os.cpu_count() or 1)  # In cores
+        self.timeout = timeout
+        self.sample_interval = sample_interval
+        self.leases = set()
+        self.used = 0.0  # Sum of lease costs
+        self.cpu = 0.0  # Cores used by FFmpeg at the last sample
+        self.waiters = deque()  # Futures of starts waiting for budget, first come first served
+        self.lock = threading.Lock()
+    
+    def fits(self, cost):
+        return self.used + cost <= self.budget
+    
+    async def admit(self, pipelines, guild_id=None):
+        """Reserve budget for one of `pipelines` (best first); return (lease, name, options)."""
+        started = time.perf_counter()
+        deadline = started + self.timeout
+        while True:
+            # Waiting cannot bring the CPU down, only starting cheaper processes can
+            candidates = pipelines[-1:] if self.cpu > self.cpu_limit else pipelines
+            choice = next(((name, options) for name, options in candidates if self.fits(PIPELINE_COSTS[name])), None)
+            remaining = deadline - time.perf_counter()
+            if choice is not None or remaining <= 0:
+                break
+            await self._wait(remaining)
+        
+        waited = time.perf_counter() - started
+        if choice is None:
+            choice, outcome = pipelines[-1], 'overflow'
+        elif choice[0] != pipelines[0][0]:
+            outcome = 'degraded'
+        else:
+            outcome = 'queued' if waited > 0.001 else 'admitted'
+        metrics.inc('ffmpeg_admissions_total', guild_id, outcome=outcome, pipeline=choice[0])
+        metrics.observe('ffmpeg_admission_wait_seconds', waited, guild_id)
+        return (self.reserve(choice[0], guild_id),) + choice
+    
+    def reserve(self, pipeline, guild_id=None):
+        """Take a lease without waiting (short soundboard clips, and admitted starts)."""
+        lease = FFmpegLease(self, pipeline, guild_id, asyncio.get_running_loop())
+        with self.lock:
+            self.leases.add(lease)
+            self.used += lease.cost
+        if (self, 'sample') not in timers:
+            timers.schedule((self, 'sample'), self.sample_interval, self.sample)
+        return lease
+    
+    def release(self, lease):
+        with self.lock:
+            if lease not in self.leases:
+                return
+            self.leases.discard(lease)
+            self.used -= lease.cost
+        try:
+            lease.loop.call_soon_threadsafe(self._wake)
+        except RuntimeError:
+            pass  # Loop already closed
+    
+    async def _wait(self, timeout):
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+    
+    def _wake(self):
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+    
+    def sample(self):
+        """Measure CPU, RSS and encoder speed of every live process and drop exited ones."""
+        now = time.perf_counter()
+        cores = rss = 0
+        for lease in list(self.leases):
+            if lease.process is None:
+                continue
+            if lease.process.poll() is not None:
+                lease.release()  # Exited without a cleanup we saw (soundboard clips)
+                continue
+            usage = process_usage(lease.process.pid)
+            if usage is None:
+                continue
+            cpu, lease_rss = usage
+            rss += lease_rss
+            packets = lease.source.packets_read if lease.source else 0
+            if lease.sample:
+                wall = now - lease.sample[0]
+                cpu_used = cpu - lease.sample[1]
+                audio = (packets - lease.sample[2]) * OPUS_FRAME_SECONDS
+                cores += cpu_used / wall
+                if lease.source and wall > 0:
+                    metrics.observe('ffmpeg_speed', audio / wall, lease.guild_id, pipeline=lease.pipeline)
+                if audio > 0:
+                    metrics.observe('ffmpeg_cpu_per_audio_second', cpu_used / audio, lease.guild_id, pipeline=lease.pipeline)
+            lease.sample = (now, cpu, packets)
+        
+        self.cpu = cores
+        metrics.set('ffmpeg_processes', len(self.leases))
+        metrics.set('ffmpeg_budget_used', round(self.used, 2))
+        metrics.set('ffmpeg_cpu_cores', round(cores, 3))
+        metrics.set('ffmpeg_rss_bytes', rss)
+        if self.leases:
+            timers.schedule((self, 'sample'), self.sample_interval, self.sample)
+
+class Station:
+    """One playback pipeline whose packets every voice channel tuned to it shares ("radio mode")"""
+    def __init__(self, name, buffer_frames=STATION_BUFFER_FRAMES, idle_timeout=TIMEOUT_DELAY):
+        self.name = name
+        self.queue = TrackQueue()
+        self.queued = asyncio.Event()  # Set when a track is queued or the station closes
+        self.idle_timeout = idle_timeout  # Seconds a drained station waits for tracks
+        self.loop = None
+        self.ring = deque(maxlen=buffer_frames)
+        self.head = 0  # Sequence number of the next packet pumped
+        self.cond = threading.Condition()
+        self.listeners = set()
+        self.currently_playing = None
+        self.closed = False
+        self.task = None
+    
+    def subscribe(self):
+        listener = StationListener(self)
+        with self.cond:
+            self.listeners.add(listener)
+        metrics.set('station_listeners', len(self.listeners), station=self.name)
+        return listener
+    
+    def unsubscribe(self, listener):
+        with self.cond:
+            self.listeners.discard(listener)
+            if not self.listeners:
+                self.closed = True  # Nobody listens: stop pumping
+            self.cond.notify_all()
+        metrics.set('station_listeners', len(self.listeners), station=self.name)
+        if self.closed:
+            self._wake()
+    
+    def enqueue(self, track):
+        self.queue.append(track)
+        self._wake()
+    
+    def _wake(self):
+        """Wake a drained run() (may be called from the voice thread)."""
+        if self.loop is not None:
+            try:
+                self.loop.call_soon_threadsafe(self.queued.set)
+            except RuntimeError:
+                pass  # Loop already closed
+    
+    def start(self, prepare_source, on_close=None):
+        """Feed the station's queue through `prepare_source` unless that is already running."""
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run(prepare_source, on_close))
+        return self.task
+    
+    async def run(self, prepare_source, on_close=None):
+        loop = self.loop = asyncio.get_running_loop()
+        try:
+            while not self.closed:
+                if not self.queue:
+                    # Drained: listeners hear silence while more tracks may still be queued
+                    self.queued.clear()
+                    try:
+                        await asyncio.wait_for(self.queued.wait(), self.idle_timeout)
+                    except asyncio.TimeoutError:
+                        break
+                    continue
+                track = self.queue.popleft()
+                try:
+                    source = await prepare_source(track)
+                except Exception as e:
+                    print(f"Station {self.name} could not play a track: {e}")
+                    continue
+                self.currently_playing = track
+                finished = asyncio.Event()
+                # A thread of its own: a pump runs for the whole track and would starve a shared executor
+                threading.Thread(
+                    target=self.pump, args=(source, lambda: loop.call_soon_threadsafe(finished.set)),
+                    name=f'station-{self.name}', daemon=True
+                ).start()
+                await finished.wait()
+        finally:
+            self.close()
+            if on_close:
+                on_close(self)
+    
+    def pump(self, source, on_end):
+        """Copy packets from `source` into the ring every 20 ms until it ends (runs in a thread)."""
+        try:
+            self._pump(source)
+        finally:
+            source.cleanup()
+            on_end()
+    
+    def _pump(self, source):
+        deadline = time.perf_counter()
+        while not self.closed:
+            packet = source.read()
+            if not packet:
+                return
+            with self.cond:
+                self.ring.append(packet)
+                self.head += 1
+                self.cond.notify_all()
+            deadline += OPUS_FRAME_SECONDS
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -1:
+                deadline = time.perf_counter()  # Do not burst a whole second to catch up
+    
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+class StationListener(discord.AudioSource):
+    """Voice client source reading a Station's ring from its own cursor.
+    
+    Soundboard clips are mixed in per listener, so only this guild hears them.
+    """
+    def __init__(self, station):
+        self.station = station
+        self.cursor = max(0, station.head - STATION_JOIN_FRAMES)
+        self.dropped = 0
+        self.mixer = None  # PCMMixer, created by the first overlay
+        self.pcm = False  # Whether the last packet returned is PCM rather than Opus
+        self.lock = threading.Lock()
+    
+    def read(self):
+        packet = self._read_ring()
+        with self.lock:
+            self.pcm = bool(packet and self.mixer and self.mixer.active)
+            if self.pcm:
+                return self.mixer.mix(self.mixer.decode(packet))
+        return packet
+    
+    def overlay(self, samples, after=None):
+        """Mix in-memory PCM `samples` over the station without holding anyone else up."""
+        with self.lock:
+            if self.mixer is None:
+                self.mixer = PCMMixer()
+            self.mixer.add(samples, after)
+    
+    def _read_ring(self):
+        station = self.station
+        with station.cond:
+            if self.cursor >= station.head and not station.closed:
+                station.cond.wait(STATION_READ_TIMEOUT)
+            oldest = station.head - len(station.ring)
+            if self.cursor < oldest:
+                # Fell out of the ring: rejoin near the live edge instead of holding the pump back
+                skip_to = max(oldest, station.head - STATION_JOIN_FRAMES)
+                self.dropped += skip_to - self.cursor
+                metrics.inc('station_frames_skipped_total', amount=skip_to - self.cursor, station=station.name)
+                self.cursor = skip_to
+            if self.cursor >= station.head:
+                return b'' if station.closed else OPUS_SILENCE  # Between tracks the channel hears silence
+            packet = station.ring[self.cursor - oldest]
+            self.cursor += 1
+            return packet
+    
+    def is_opus(self):
+        return not self.pcm
+    
+    def cleanup(self):
+        with self.lock:
+            if self.mixer:
+                self.mixer.clear()
+        self.station.unsubscribe(self)
+
+class PCMMixer:
+    """Sums in-memory PCM clips onto 20 ms frames of 48 kHz stereo audio"""
+    def __init__(self, decoder=None):
+        self.decoder = decoder  # Opus decoder for the music, created on first use
+        self.overlays = []  # [samples, offset, after]
+    
+    @property
+    def active(self):
+        return bool(self.overlays)
+    
+    def add(self, samples, after=None):
+        self.overlays.append([samples, 0, after])
+    
+    def decode(self, packet):
+        if self.decoder is None:
+            self.decoder = discord.opus.Decoder()
+        return self.decoder.decode(packet)
+    
+    def mix(self, frame=None):
+        """Return `frame` (PCM bytes, silence if None) with the next slice of every clip added."""
+        if frame is None:
+            mixed = np.zeros(PCM_FRAME_SAMPLES, dtype=np.int32)
+        else:
+            mixed = np.frombuffer(frame, dtype=np.int16).astype(np.int32)
+        
+        for overlay in list(self.overlays):
+            samples, offset, after = overlay
+            chunk = samples[offset:offset + len(mixed)]
+            mixed[:len(chunk)] += chunk
+            overlay[1] += len(chunk)
+            if overlay[1] >= len(samples):
+                self.overlays.remove(overlay)
+                if after:
+                    after()
+        
+        np.clip(mixed, -32768, 32767, out=mixed)
+        return mixed.astype(np.int16).tobytes()
+    
+    def clear(self):
+        """Drop every clip, reporting each one as finished."""
+        overlays, self.overlays = self.overlays, []
+        for _, _, after in overlays:
+            if after:
+                after()
+
+class TranscodeCache:
+    """On-disk LRU cache of normalized Ogg/Opus renditions keyed by video ID"""
+    def __init__(self, directory, max_bytes=TRANSCODE_CACHE_MAX_BYTES, min_plays=TRANSCODE_MIN_PLAYS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.min_plays = min_plays
+        self.index = None  # video_id -> size, least recently used first
+        self.total_bytes = 0
+        self.play_counts = {}
+        self.pending = set()
+        self.semaphore = asyncio.Semaphore(MAX_CONCURRENT_TRANSCODES)
+    
+    @staticmethod
+    def valid_id(video_id):
+        return bool(video_id) and re.fullmatch(r'[A-Za-z0-9_-]{1,64}', video_id) is not None
+    
+    def path(self, video_id):
+        return os.path.join(self.directory, f"{video_id}.ogg")
+    
+    async def load(self):
+        """Scan the cache directory once, off the event loop; lookups miss until then."""
+        if self.index is None:
+            index = await asyncio.get_running_loop().run_in_executor(thread_pool, self._scan)
+            if self.index is None:
+                self.index = index
+                self.total_bytes = sum(index.values())
+    
+    def _scan(self):
+        """Renditions on disk, oldest access first."""
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.directory):
+            full_path = os.path.join(self.directory, name)
+            if name.endswith('.part'):
+                # Left over from an interrupted transcode, unless another shard is still writing it
+                if time.time() - os.path.getmtime(full_path) > TRANSCODE_TIMEOUT:
+                    os.remove(full_path)
+            elif name.endswith('.ogg'):
+                stat = os.stat(full_path)
+                entries.append((stat.st_mtime, name[:-4], stat.st_size))
+        return OrderedDict((video_id, size) for _, video_id, size in sorted(entries))
+    
+    def contains(self, video_id):
+        return self.valid_id(video_id) and self.index is not None and video_id in self.index
+    
+    def lookup(self, video_id):
+        """Return the local rendition of a video, or None."""
+        if not self.contains(video_id):
+            metrics.inc('transcode_cache_requests_total', result='miss')
+            return None
+        
+        path = self.path(video_id)
+        # mtime doubles as the LRU clock across restarts
+        thread_pool.submit(self._touch, path, video_id, asyncio.get_running_loop())
+        self.index.move_to_end(video_id)
+        metrics.inc('transcode_cache_requests_total', result='hit')
+        return path
+    
+    def _touch(self, path, video_id, loop):
+        try:
+            os.utime(path)
+        except OSError:
+            loop.call_soon_threadsafe(self._forget, video_id)  # Evicted by another shard
+    
+    def _forget(self, video_id):
+        size = self.index.pop(video_id, None)
+        if size is not None:
+            self.total_bytes -= size
+    
+    def record_play(self, video_id, stream_url, options=FFMPEG_OPTIONS['options']):
+        """Count a network play and start a transcode once the track proves popular."""
+        if not self.valid_id(video_id) or not stream_url or self.index is None:
+            return None
+        if video_id in self.index or video_id in self.pending:
+            return None
+        
+        plays = self.play_counts.get(video_id, 0) + 1
+        if plays < self.min_plays:
+            if len(self.play_counts) > 100000:
+                self.play_counts.clear()  # Keep the popularity counter bounded
+            self.play_counts[video_id] = plays
+            return None
+        
+        self.play_counts.pop(video_id, None)
+        self.pending.add(video_id)
+        return asyncio.get_running_loop().create_task(self.transcode(video_id, stream_url, options))
+    
+    async def transcode(self, video_id, stream_url, options=FFMPEG_OPTIONS['options']):
+        """Download, normalize and encode a track to Ogg/Opus next to the cache."""
+        await self.load()
+        final_path = self.path(video_id)
+        temp_path = final_path + '.part'
+        try:
+            async with self.semaphore:
+                args = ['ffmpeg', '-nostdin', '-loglevel', 'error', '-y']
+                args += FFMPEG_OPTIONS['before_options'].split()
+                args += ['-i', stream_url] + options.split()
+                args += ['-c:a', 'libopus', '-b:a', '128k', '-ar', '48000', '-ac', '2', '-f', 'ogg', temp_path]
+                with metrics.timer('transcode_duration_seconds'):
+                    ok = await self._run_ffmpeg(args)
+            
+            if not ok or not os.path.exists(temp_path):
+                metrics.inc('transcodes_total', outcome='error')
+                return None
+            
+            os.replace(temp_path, final_path)
+            size = os.path.getsize(final_path)
+            self.index[video_id] = size
+            self.total_bytes += size
+            await self._evict()
+            metrics.inc('transcodes_total', outcome='ok')
+            return final_path
+        finally:
+            self.pending.discard(video_id)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    
+    async def _run_ffmpeg(self, args):
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *args, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+            )
+        except OSError as e:
+            print(f"Failed to start transcode: {e}")
+            return False
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(), TRANSCODE_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            process.kill()
+            await process.wait()
+            raise
+        if process.returncode != 0:
+            print(f"Transcode failed: {stderr.decode(errors='ignore')[:200]}")
+        return process.returncode == 0
+    
+    async def _evict(self):
+        """Delete least recently played renditions until under the disk budget."""
+        paths = []
+        while self.total_bytes > self.max_bytes and self.index:
+            video_id, size = self.index.popitem(last=False)
+            self.total_bytes -= size
+            paths.append(self.path(video_id))
+        if paths:
+            await asyncio.get_running_loop().run_in_executor(thread_pool, self._remove, paths)
+    
+    @staticmethod
+    def _remove(paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # Already evicted by another shard
+
+def gain_for_loudness(integrated_lufs):
+    """Static gain in dB that brings a track to LOUDNESS_TARGET_LUFS."""
+    return max(-MAX_LOUDNESS_CUT, min(MAX_LOUDNESS_BOOST, LOUDNESS_TARGET_LUFS - integrated_lufs))
+
+class LoudnessAnalyzer:
+    """Measures EBU R128 integrated loudness once per track and remembers the gain"""
+    def __init__(self, store=None):
+        self.store = store  # Optional PersistentCache, shares the metadata database
+        self.gains = {}
+        self.pending = set()
+        self.semaphore = asyncio.Semaphore(MAX_CONCURRENT_ANALYSES)
+    
+    def gain_for(self, key):
+        """Return the stored gain for a track, or None if it was never measured."""
+        if not key:
+            return None
+        if key in self.gains:
+            return self.gains[key]
+        if self.store:
+            try:
+                entry = self.store.get(key)
+            except sqlite3.Error as e:
+                print(f"Loudness store read error: {e}")
+                entry = None
+            if entry:
+                self.gains[key] = entry[0]
+                return entry[0]
+        return None
+    
+    def schedule(self, key, source):
+        """Measure a track in the background unless it is known or already queued."""
+        if not key or key in self.pending or self.gain_for(key) is not None:
+            return None
+        self.pending.add(key)
+        return asyncio.get_running_loop().create_task(self.analyze(key, source))
+    
+    async def analyze(self, key, source):
+        """Measure `source` (URL or file) and store the resulting gain under `key`."""
+        try:
+            async with self.semaphore:
+                with metrics.timer('loudness_analysis_seconds'):
+                    loudness = await self.measure(source)
+            if loudness is None:
+                metrics.inc('loudness_analyses_total', outcome='error')
+                return None
+            
+            gain = gain_for_loudness(loudness)
+            self.gains[key] = gain
+            if self.store:
+                try:
+                    self.store.set(key, gain)
+                except sqlite3.Error as e:
+                    print(f"Loudness store write error: {e}")
+            metrics.inc('loudness_analyses_total', outcome='ok')
+            return gain
+        finally:
+            self.pending.discard(key)
+    
+    async def measure(self, source):
+        """Run FFmpeg's ebur128 filter over a source and return its integrated loudness."""
+        args = ['ffmpeg', '-nostdin', '-hide_banner', '-nostats']
+        if '://' in source:
+            args += FFMPEG_OPTIONS['before_options'].split()
+        args += ['-i', source, '-vn', '-af', 'ebur128=framelog=quiet', '-f', 'null', '-']
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *args, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+            )
+        except OSError as e:
+            print(f"Failed to start loudness analysis: {e}")
+            return None
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(), TRANSCODE_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            process.kill()
+            await process.wait()
+            raise
+        return parse_integrated_loudness(stderr.decode(errors='ignore'))
+    
+    async def gain_for_file(self, path):
+        """Gain of a local file, measured once per file version."""
+        key = f"file:{os.path.basename(path)}:{int(os.path.getmtime(path))}"
+        gain = self.gain_for(key)
+        if gain is None:
+            gain = await self.analyze(key, path)
+        return gain
+
+def parse_integrated_loudness(output):
+    """Pull the integrated loudness (LUFS) out of the ebur128 filter summary."""
+    matches = re.findall(r'I:\s+(-?[\d.]+) LUFS', output)
+    if not matches:
+        return None
+    value = float(matches[-1])
+    return value if value > -70 else None  # -70 LUFS is the gate floor: silence
+
+class Soundboard:
+    """Short clips from a directory, decoded once to PCM and kept in memory"""
+    def __init__(self, directory=SOUNDBOARD_DIR, loudness=None):
+        self.directory = directory
+        self.loudness = loudness  # LoudnessAnalyzer, brings clips to the music's level
+        self.paths = {}  # clip name -> file
+        self.clips = {}  # clip name -> interleaved int16 samples
+    
+    async def load(self):
+        """Scan the directory and decode every clip (run once at startup)."""
+        if not self.directory or not os.path.isdir(self.directory):
+            return
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if os.path.isfile(path):
+                self.paths[os.path.splitext(name)[0]] = path
+        if np is None:
+            return
+        for name, path in self.paths.items():
+            samples = await self.decode(path, await self.gain_for(path))
+            if samples is not None and len(samples):
+                self.clips[name] = samples
+        print(f"Loaded {len(self.clips)} soundboard clip(s)")
+    
+    async def gain_for(self, path):
+        return await self.loudness.gain_for_file(path) if self.loudness else None
+    
+    async def decode(self, path, gain=None):
+        """Decode a file to 48 kHz stereo 16-bit PCM with FFmpeg."""
+        args = ['ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-i', path, '-vn', '-t', str(SOUNDBOARD_MAX_SECONDS)]
+        if gain is not None:
+            args += ['-af', f'volume={gain:.2f}dB']
+        args += ['-f', 's16le', '-ar', '48000', '-ac', '2', 'pipe:1']
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+            )
+        except OSError as e:
+            print(f"Failed to decode soundboard clip {path}: {e}")
+            return None
+        stdout, _ = await process.communicate()
+        if process.returncode != 0:
+            print(f"Failed to decode soundboard clip {path}")
+            return None
+        return np.frombuffer(stdout[:len(stdout) // 2 * 2], dtype=np.int16)
+    
+    def names(self):
+        return sorted(self.paths)
+    
+    async def source(self, name):
+        """A standalone source for a clip: PCM from memory, or FFmpeg if it was not decoded."""
+        if name in self.clips:
+            return discord.PCMAudio(io.BytesIO(self.clips[name].tobytes()))
+        _, options = ffmpeg_pipeline({'gain_db': await self.gain_for(self.paths[name])}, 'normalize')
+        return discord.FFmpegOpusAudio(self.paths[name], options=options['options'])
+
+class PersistentCache:
+    """SQLite-backed LRU cache with TTL, bounded by entry count and bytes"""
+    def __init__(self, path, ttl=CACHE_TTL, max_entries=CACHE_DISK_MAX_ENTRIES, max_bytes=CACHE_DISK_MAX_BYTES, table='entries'):
+        self.path = path
+        self.table = table  # Several caches can share one database file
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.conn = None
+        self.lock = threading.Lock()
+        self.total_entries = 0
+        self.total_bytes = 0
+    
+    def _connect(self):
+        """Open the database lazily so importing the bot never touches the disk."""
+        if self.conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_accessed ON {self.table} (accessed)")
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_created ON {self.table} (created)")
+            self._refresh_totals()
+        return self.conn
+    
+    def _refresh_totals(self):
+        count, size = self.conn.execute(f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table}").fetchone()
+        self.total_entries, self.total_bytes = count, size
+    
+    def _delete_where(self, condition, params):
+        """Delete matching rows and take them off the totals without rescanning the table."""
+        count, size = self.conn.execute(
+            f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table} WHERE {condition}", params
+        ).fetchone()
+        if count:
+            self.conn.execute(f"DELETE FROM {self.table} WHERE {condition}", params)
+            self.total_entries -= count
+            self.total_bytes -= size
+    
+    def get(self, key):
+        """Return (value, timestamp) for a live entry, or None."""
+        with self.lock:
+            conn = self._connect()
+            row = conn.execute(f"SELECT value, created FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            
+            blob, created = row
+            now = time.time()
+            if now - created >= self.ttl:
+                self._delete_where("key = ?", (key,))
+                return None
+            
+            conn.execute(f"UPDATE {self.table} SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(zlib.decompress(blob)), created
+    
+    def set(self, key, value, timestamp=None):
+        blob = zlib.compress(json.dumps(value, default=str).encode(), 1)
+        timestamp = timestamp or time.time()
+        with self.lock:
+            conn = self._connect()
+            replaced = conn.execute(f"SELECT size FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob), timestamp, time.time())
+            )
+            if replaced:
+                self.total_bytes -= replaced[0]
+            else:
+                self.total_entries += 1
+            self.total_bytes += len(blob)
+            if self.total_entries > self.max_entries or self.total_bytes > self.max_bytes:
+                self._evict()
+    
+    def _evict(self):
+        """Drop least recently used entries until both limits are met."""
+        while self.total_entries > self.max_entries or self.total_bytes > self.max_bytes:
+            # Evict in chunks to keep the number of statements low
+            batch = max(1, self.total_entries - self.max_entries, self.total_entries // 20)
+            rows = self.conn.execute(f"SELECT key, size FROM {self.table} ORDER BY accessed LIMIT ?", (batch,)).fetchall()
+            if not rows:
+                self._refresh_totals()  # Totals drifted (another process shares the file)
+                break
+            self.conn.executemany(f"DELETE FROM {self.table} WHERE key = ?", [(key,) for key, _ in rows])
+            self.total_entries -= len(rows)
+            self.total_bytes -= sum(size for _, size in rows)
+    
+    def delete(self, key):
+        with self.lock:
+            self._connect()
+            self._delete_where("key = ?", (key,))
+    
+    def delete_prefix(self, prefix):
+        """Delete every entry whose key starts with `prefix` (a key range, so the primary key index is used)."""
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        with self.lock:
+            self._connect()
+            self._delete_where("key >= ? AND key < ?", (prefix, upper))
+    
+    def items(self):
+        """Return [(key, value)] for every live entry."""
+        with self.lock:
+            conn = self._connect()
+            rows = conn.execute(f"SELECT key, value FROM {self.table} WHERE created > ?", (time.time() - self.ttl,)).fetchall()
+        return [(key, json.loads(zlib.decompress(blob))) for key, blob in rows]
+    
+    def clear_expired(self):
+        """Clear expired cache entries"""
+        with self.lock:
+            self._connect()
+            self._delete_where("created <= ?", (time.time() - self.ttl,))
+
+class QueueSnapshots:
+    """Guild queues on disk as a head, a base copy and a log of changes, restored after a restart"""
+    def __init__(self, store):
+        self.store = store  # PersistentCache, shares the metadata database
+        self.saved = {}  # guild_id -> what is on disk: queue, head summary, log length, base time
+    
+    @staticmethod
+    def summary(guild_state):
+        """What a guild's head depends on, cheap to compare; None when there is nothing to restore."""
+        current = guild_state.currently_playing if guild_state.is_playing_audio else None
+        if guild_state.voice_channel_id is None or not (current or guild_state.queue):
+            return None
+        
+        source = guild_state.current_source
+        position = round(source.elapsed, 1) if current and isinstance(source, WarmOpusSource) else None
+        return guild_state.voice_channel_id, guild_state.text_channel_id, current, position
+    
+    @staticmethod
+    def head(summary):
+        """Plain-data view of a guild's channels and current track."""
+        voice_channel, text_channel, current, position = summary
+        if current:
+            current = dict(current)
+            if position is not None:
+                current['resume_at'] = position
+        return {'voice_channel': voice_channel, 'text_channel': text_channel, 'current': current}
+    
+    @staticmethod
+    def _encode(change):
+        kind, *args = change
+        if kind == 'extend':
+            return ['extend', [dict(track) for track in args[0]]]
+        if kind == 'insert':
+            return ['insert', args[0], dict(args[1])]
+        return [kind, *args]
+    
+    @staticmethod
+    def _replay(queue, log):
+        for kind, *args in log:
+            if kind == 'extend':
+                queue.extend(args[0])
+            elif kind == 'insert':
+                queue.insert(*args)
+            elif kind == 'pop':
+                del queue[args[0]]
+    
+    def collect(self, guild_states):
+        """Return {guild_id: [(store method, *args)]} for the guilds that changed since the last call.
+        
+        Runs on the event loop; the values are plain data, so `write` can serialize them elsewhere.
+        """
+        changes = {}
+        for guild_id, guild_state in list(guild_states.items()):
+            summary = self.summary(guild_state)
+            if summary is None:
+                if self.saved.pop(guild_id, None) is not None:
+                    changes[guild_id] = self._discard_writes(guild_id)
+                continue
+            
+            queue = guild_state.queue
+            saved = self.saved.get(guild_id)
+            journal = queue.take_journal()
+            writes = []
+            if (saved is None or saved['queue'] is not queue or journal[:1] == [('reset',)]
+                    or saved['log'] >= QUEUE_SNAPSHOT_LOG_LIMIT or time.time() - saved['based'] > QUEUE_SNAPSHOT_TTL / 2):
+                writes += [('delete_prefix', f"{guild_id}:"), ('set', f"{guild_id}:queue", [dict(track) for track in queue])]
+                saved = self.saved[guild_id] = {'queue': queue, 'head': None, 'log': 0, 'based': time.time()}
+            elif journal:
+                writes.append(('set', f"{guild_id}:log:{saved['log']:06d}", [self._encode(change) for change in journal]))
+                saved['log'] += 1
+            
+            if summary != saved['head']:
+                writes.append(('set', str(guild_id), self.head(summary)))
+                saved['head'] = summary
+            if writes:
+                changes[guild_id] = writes
+        
+        for guild_id in set(self.saved) - set(guild_states):
+            del self.saved[guild_id]
+            changes[guild_id] = self._discard_writes(guild_id)
+        return changes
+    
+    @staticmethod
+    def _discard_writes(guild_id):
+        return [('delete', str(guild_id)), ('delete_prefix', f"{guild_id}:")]
+    
+    def write(self, changes):
+        """Apply what `collect` returned (run this in an executor); return the number of guilds written."""
+        try:
+            for writes in changes.values():
+                for method, *args in writes:
+                    getattr(self.store, method)(*args)
+        except Exception:
+            self.saved.clear()  # A missing log entry would corrupt the queue, write everything afresh
+            raise
+        return len(changes)
+    
+    def save(self, guild_states):
+        """Write changed snapshots, drop the ones of idle guilds; return the number of guilds written."""
+        return self.write(self.collect(guild_states))
+    
+    def load(self):
+        """Return {guild_id: snapshot} for every queue saved by the last run."""
+        heads, bases, logs = {}, {}, defaultdict(list)
+        for key, data in self.store.items():
+            guild_id, _, part = key.partition(':')
+            if not part:
+                heads[int(guild_id)] = data
+            elif part == 'queue':
+                bases[int(guild_id)] = data
+            else:
+                logs[int(guild_id)].append((part, data))
+        
+        snapshots = {}
+        for guild_id, head in heads.items():
+            queue = bases.get(guild_id)
+            if queue is None:
+                queue = []  # Expired, the log alone cannot rebuild it
+            else:
+                try:
+                    for _, log in sorted(logs[guild_id], key=lambda entry: entry[0]):
+                        self._replay(queue, log)
+                except (IndexError, TypeError, ValueError) as e:
+                    print(f"Queue snapshot log of guild {guild_id} is inconsistent: {e}")
+            snapshots[guild_id] = dict(head, queue=queue)
+        return snapshots
+    
+    def discard(self, guild_id):
+        self.saved.pop(guild_id, None)
+        for method, *args in self._discard_writes(guild_id):
+            getattr(self.store, method)(*args)
+
 class YouTubeCache:
-    """Cache for YouTube data with TTL"""
-    def __init__(self, ttl=CACHE_TTL):
-        self.cache = {}
+    """Cache for YouTube data with TTL, backed by an optional persistent tier"""
+    def __init__(self, ttl=CACHE_TTL, max_entries=CACHE_MEMORY_ENTRIES, persistent=None):
+        self.cache = OrderedDict()
         self.ttl = ttl
+        self.max_entries = max_entries
+        self.persistent = persistent
     
     def get(self, key):
         if key in self.cache:
             data, timestamp = self.cache[key]
             if time.time() - timestamp < self.ttl:
+                self.cache.move_to_end(key)
+                metrics.inc('cache_requests_total', result='memory_hit')
                 return data
             else:
                 del self.cache[key]
+        
+        if self.persistent:
+            try:
+                entry = self.persistent.get(key)
+            except sqlite3.Error as e:
+                print(f"Persistent cache read error: {e}")
+                entry = None
+            if entry:
+                data, timestamp = entry
+                self._remember(key, data, timestamp)
+                metrics.inc('cache_requests_total', result='disk_hit')
+                return data
+        metrics.inc('cache_requests_total', result='miss')
         return None
     
-    def set(self, key, value):
-        self.cache[key] = (value, time.time())
+    def set(self, key, value, ttl=None):
+        timestamp = time.time()
+        if ttl is not None:
+            # Entries with their own lifetime are back-dated so both tiers expire them on time
+            timestamp -= self.ttl - ttl
+        self._remember(key, value, timestamp)
+        if self.persistent:
+            try:
+                self.persistent.set(key, value, timestamp)
+            except (sqlite3.Error, TypeError, ValueError) as e:
+                print(f"Persistent cache write error: {e}")
+            if (self, 'sweep') not in timers:
+                timers.schedule((self, 'sweep'), CACHE_SWEEP_INTERVAL, self._sweep)
     
-    def clear_expired(self):
-        """Clear expired cache entries"""
-        current_time = time.time()
-        expired_keys = [k for k, (_, t) in self.cache.items() if current_time - t >= self.ttl]
-        for key in expired_keys:
+    def _remember(self, key, value, timestamp):
+        """Insert into the in-memory LRU layer, evicting the oldest entries."""
+        self.cache[key] = (value, timestamp)
+        self.cache.move_to_end(key)
+        timers.schedule((self, 'entry', key), timestamp + self.ttl - time.time(), partial(self._expire, key, timestamp))
+        while len(self.cache) > self.max_entries:
+            evicted, _ = self.cache.popitem(last=False)
+            timers.cancel((self, 'entry', evicted))
+    
+    def _expire(self, key, timestamp):
+        entry = self.cache.get(key)
+        if entry is not None and entry[1] == timestamp:
             del self.cache[key]
+    
+    def _sweep(self):
+        """Delete expired rows of the disk tier, then check again after CACHE_SWEEP_INTERVAL."""
+        try:
+            self.persistent.clear_expired()
+        except sqlite3.Error as e:
+            print(f"Persistent cache cleanup error: {e}")
+        if self.persistent.total_entries:
+            timers.schedule((self, 'sweep'), CACHE_SWEEP_INTERVAL, self._sweep)
+
+INDEX_KEYS = ('id', 'title', 'uploader', 'duration', 'thumbnail', 'webpage_url')
+
+def normalize_query(text):
+    """Casefold, strip accents and punctuation, collapse whitespace."""
+    text = unicodedata.normalize('NFKD', (text or '').casefold())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(re.findall(r'\w+', text))
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class TrackIndex:
+    """Trigram index over every track the bot has resolved.
+    
+    Answers repeat searches without asking YouTube and backs /play autocomplete.
+    Tracks and the normalized queries that found them are kept in an optional
+    PersistentCache and loaded back into memory on first use.
+    """
+    def __init__(self, store=None, max_tracks=SEARCH_INDEX_MAX_TRACKS):
+        self.store = store
+        self.max_tracks = max_tracks
+        self.tracks = OrderedDict()  # video_id -> metadata, oldest first
+        self.texts = {}  # video_id -> normalized title and uploader
+        self.sizes = {}  # video_id -> number of trigrams in its text
+        self.postings = {}  # trigram -> set of video_ids
+        self.queries = {}  # normalized query -> video_id
+        self.loaded = False
+    
+    def load(self):
+        """Rebuild the in-memory index from the store (once)."""
+        if self.loaded:
+            return
+        self.loaded = True
+        if not self.store:
+            return
+        try:
+            items = self.store.items()
+        except sqlite3.Error as e:
+            print(f"Search index read error: {e}")
+            return
+        for key, value in items:
+            kind, _, name = key.partition(':')
+            if kind == 'track':
+                self._add(value)
+            elif kind == 'query':
+                self.queries[name] = value
+    
+    def add(self, info, query=None):
+        """Index a resolved track, and the normalized query that found it."""
+        self.load()
+        track = {key: info.get(key) for key in INDEX_KEYS}
+        if not track['id'] or not track['title']:
+            return
+        track['webpage_url'] = track['webpage_url'] or f"https://www.youtube.com/watch?v={track['id']}"
+        
+        is_new = track['id'] not in self.tracks
+        self._add(track)
+        if query:
+            self.queries[query] = track['id']
+        if self.store:
+            try:
+                if is_new:
+                    self.store.set(f"track:{track['id']}", track)
+                if query:
+                    self.store.set(f"query:{query}", track['id'])
+            except (sqlite3.Error, TypeError, ValueError) as e:
+                print(f"Search index write error: {e}")
+    
+    def _add(self, track):
+        video_id = track['id']
+        if video_id in self.tracks:
+            self.tracks[video_id] = track
+            return
+        text = normalize_query(f"{track['title']} {track.get('uploader') or ''}")
+        grams = trigrams(text)
+        self.tracks[video_id] = track
+        self.texts[video_id] = text
+        self.sizes[video_id] = len(grams)
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(video_id)
+        while len(self.tracks) > self.max_tracks:
+            self._remove(next(iter(self.tracks)))
+    
+    def _remove(self, video_id):
+        del self.tracks[video_id]
+        del self.sizes[video_id]
+        for gram in trigrams(self.texts.pop(video_id)):
+            ids = self.postings.get(gram)
+            if ids is not None:
+                ids.discard(video_id)
+                if not ids:
+                    del self.postings[gram]
+    
+    def search(self, query, limit=AUTOCOMPLETE_LIMIT):
+        """Best matching tracks for a (partial) query, by trigram similarity."""
+        self.load()
+        if query.strip() in self.tracks:
+            return [self.tracks[query.strip()]]  # Exact video ID
+        text = normalize_query(query)
+        if not text:
+            return []
+        
+        grams = trigrams(text)
+        hits = Counter()
+        # Rare trigrams pick the candidates; common ones only add to their scores
+        for gram in sorted(grams, key=lambda gram: len(self.postings.get(gram, ()))):
+            ids = self.postings.get(gram, ())
+            if len(ids) > len(hits) > 0 and len(ids) > SEARCH_POSTING_SCAN:
+                for video_id in hits:
+                    if video_id in ids:
+                        hits[video_id] += 1
+            else:
+                hits.update(ids)
+        # Jaccard similarity of the trigram sets
+        best = heapq.nlargest(limit, hits.items(), key=lambda item: item[1] / (len(grams) + self.sizes[item[0]] - item[1]))
+        return [self.tracks[video_id] for video_id, _ in best]
+    
+    def lookup(self, query):
+        """A confident local answer to a search, or None to ask YouTube."""
+        self.load()
+        text = normalize_query(query)
+        video_id = self.queries.get(text)
+        if video_id not in self.tracks:
+            candidates = self.search(text, 1)
+            if not candidates:
+                return None
+            video_id = candidates[0]['id']
+            title = self.texts[video_id]
+            title_grams = trigrams(title)
+            # Every word must appear and the query must cover most of the title
+            if not all(word in title for word in text.split()) or len(title_grams & trigrams(text)) < SEARCH_MATCH_COVERAGE * len(title_grams):
+                return None
+        track = self.tracks[video_id]
+        return dict(track, url=track['webpage_url'])
 
 class YouTubeService:
-    def __init__(self):
+    def __init__(self, backend=None):
         self.ydl_opts = {
             'format': 'bestaudio/best',
             'quiet': True,
@@ -81,219 +2104,1015 @@ class YouTubeService:
             'socket_timeout': 10,  # Reduce timeout for faster failure response
             'retries': 2,          # Limit retries for faster response
         }
-        self.cache = YouTubeCache()
-        self.extraction_semaphore = asyncio.Semaphore(MAX_CONCURRENT_EXTRACTIONS)
+        self.cache = YouTubeCache(persistent=PersistentCache(CACHE_DB_PATH) if CACHE_DB_PATH else None)
+        self.limiter = AdaptiveLimiter()
+        self.scheduler = ExtractionScheduler(self.limiter)
+        if backend is None:
+            backend = ProcessExtractionBackend() if EXTRACTION_BACKEND == "process" else ThreadExtractionBackend()
+        self.backend = backend
+        self.inflight = {}  # cache key -> task shared by concurrent identical requests
+        self.index = TrackIndex(
+            PersistentCache(CACHE_DB_PATH, ttl=SEARCH_INDEX_TTL, max_entries=SEARCH_INDEX_MAX_TRACKS * 2, table='tracks')
+            if CACHE_DB_PATH else None
+        )
     
-    async def search_youtube(self, query: str) -> dict:
+    async def search_youtube(self, query: str, guild_id: int = None, priority: int = PRIORITY_INTERACTIVE) -> dict:
         """Asynchronously search YouTube for a single song and return its info."""
-        cache_key = f"search:{query}"
+        normalized = normalize_query(query)
+        local = self.index.lookup(normalized)
+        if local:
+            metrics.inc('search_requests_total', result='local')
+            return local
+        
+        cache_key = f"search:{normalized}"
         cached_result = self.cache.get(cache_key)
         if cached_result:
             return cached_result
-            
-        async with self.extraction_semaphore:
-            loop = asyncio.get_running_loop()
-            with YoutubeDL(self.ydl_opts) as ydl:
-                try:
-                    info = await loop.run_in_executor(thread_pool, 
-                                                     partial(ydl.extract_info, f"ytsearch:{query}", download=False))
-                    if not info or not info.get('entries'):
-                        return None
-                    result = info['entries'][0]
-                    self.cache.set(cache_key, result)
-                    return result
-                except Exception as e:
-                    print(f"Search error: {e}")
+        
+        metrics.inc('search_requests_total', result='youtube')
+        return await self.single_flight(cache_key, partial(self._search, query, cache_key, guild_id, priority))
+    
+    async def _search(self, query, cache_key, guild_id, priority):
+        async with self.scheduler.slot(guild_id, priority, kind='search') as slot:
+            try:
+                info = await self.backend.extract(self.ydl_opts, f"ytsearch:{query}")
+                if not info or not info.get('entries'):
                     return None
+                result = info['entries'][0]
+                self.cache.set(cache_key, result)
+                self.index.add(result, query=cache_key[len("search:"):])
+                return result
+            except Exception as e:
+                slot.failed(e)
+                print(f"Search error: {e}")
+                return None
+    
+    async def extract_info(self, url: str, playlist: bool = False, refresh: bool = False,
+                           guild_id: int = None, priority: int = PRIORITY_INTERACTIVE) -> dict:
+        """Asynchronously extract info from a URL with caching."""
+        cache_key = f"info:{url}:{playlist}"
+        cached_result = None if refresh else self.cache.get(cache_key)
+        if cached_result:
+            return cached_result
+        
+        return await self.single_flight(cache_key, partial(self._extract, url, playlist, cache_key, guild_id, priority))
+    
+    async def _extract(self, url, playlist, cache_key, guild_id, priority):
+        async with self.scheduler.slot(guild_id, priority, kind='playlist' if playlist else 'info') as slot:
+            opts = self.ydl_opts.copy()
+            opts['noplaylist'] = not playlist
+            try:
+                result = await self.backend.extract(opts, url)
+                if result:
+                    ttl = None if playlist else stream_cache_ttl(result)
+                    if ttl is None or ttl > 0:
+                        self.cache.set(cache_key, result, ttl)
+                    if not playlist:
+                        self.index.add(result)
+                return result
+            except Exception as e:
+                slot.failed(e)
+                print(f"Extraction error: {e}")
+                return None
+    
+    async def single_flight(self, key, factory):
+        """Run factory() once per key, sharing its outcome with every concurrent caller."""
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(factory())
+            self.inflight[key] = task
+            task.add_done_callback(partial(self._finish_flight, key))
+        
+        # A cancelled caller must not cancel the extraction other callers are waiting on
+        return await asyncio.shield(task)
+    
+    def _finish_flight(self, key, task):
+        if self.inflight.get(key) is task:
+            del self.inflight[key]
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved even if every caller went away
+    
+    async def iter_playlist(self, url: str, guild_id: int = None, page_size: int = PLAYLIST_PAGE_SIZE):
+        """Yield a playlist's flat entries page by page while yt-dlp pages through it.
+
+        The first page is scheduled as interactive work, the rest as background backfill.
+        Pages are not cached: large playlists are never held in memory as a whole.
+        """
+        opts = self.ydl_opts.copy()
+        opts['noplaylist'] = False
+        entries = self.backend.iter_playlist(opts, url)
+        priority = PRIORITY_INTERACTIVE
+        fetch = None
+        
+        def close_entries(task=None):
+            if task is not None and not task.cancelled():
+                task.exception()  # Nobody awaits this page any more
+            close = getattr(entries, 'close', None)
+            if close:
+                close()
+        
+        try:
+            while True:
+                async with self.scheduler.slot(guild_id, priority, kind='playlist_page') as slot:
+                    try:
+                        # Shielded: a cancelled backfill must not lose track of the page still running on a worker thread
+                        fetch = asyncio.ensure_future(self.backend.take_page(entries, page_size))
+                        page = await asyncio.shield(fetch)
+                    except Exception as e:
+                        slot.failed(e)
+                        print(f"Playlist extraction error: {e}")
+                        return
+                
+                if page:
+                    yield page
+                if len(page) < page_size:
+                    return
+                priority = PRIORITY_BACKGROUND
+        finally:
+            # Closing a generator another thread is advancing raises, so wait for its page first
+            if fetch is not None and not fetch.done():
+                fetch.add_done_callback(close_entries)
+            else:
+                close_entries()
+    
+    def format_track_data(self, info):
+        """Build a queue entry from a full extraction or a flat (playlist/search) entry.
+        
+        Flat entries only point at the watch page: the track then waits for
+        resolve_stream_url to give it a stream URL just before it plays.
+        """
+        if not info:
+            return None
+        
+        url = info['url']
+        webpage_url = info.get('webpage_url')
+        if is_page_url(url):
+            url, webpage_url = None, webpage_url or url
+        return Track(
+            url,
+            title=info.get('title', 'Unknown Title'),
+            duration=info.get('duration', 0),
+            thumbnail=info.get('thumbnail', None),
+            uploader=info.get('uploader', 'Unknown Uploader'),
+            webpage_url=webpage_url,
+            id=info.get('id'),
+            acodec=info.get('acodec'),
+            asr=info.get('asr')
+        )
+    
+    async def resolve_stream_url(self, track, guild_id=None, refresh=False):
+        """Give a track a stream URL that stays valid for a while, extracting it just in time.
+        
+        Cached extractions expire with their stream URL, so a cache hit is always usable;
+        `refresh` bypasses the cache for a URL the CDN already refused.
+        """
+        expires = stream_url_expires(track['url'])
+        fresh = track['url'] and (expires is None or expires - time.time() > STREAM_URL_MIN_TTL)
+        if (fresh and not refresh) or not track.get('webpage_url'):
+            return track['url']
+        
+        info = await self.extract_info(track['webpage_url'], refresh=refresh, guild_id=guild_id)
+        if info and info.get('url'):
+            track.resolve(info)
+        return track['url']
+
+def timed_command(name):
+    """Count a MusicPlayer command and time how long handling it takes."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, ctx, *args, **kwargs):
+            metrics.inc('commands_total', ctx.guild.id, command=name)
+            with metrics.timer('command_duration_seconds', ctx.guild.id, command=name):
+                return await func(self, ctx, *args, **kwargs)
+        return wrapper
+    return decorator
+
+class Track:
+    """Compact queue entry that reads like the track dicts it replaced.
+    
+    Unset fields are None and count as missing keys, so `track.get('gain_db')`,
+    `'title' in track` and `dict(track)` behave as they did for dicts. Queued tracks
+    carry metadata and `webpage_url`; `url` (the stream) is filled in shortly before
+    playback by YouTubeService.resolve_stream_url.
+    """
+    __slots__ = ('url', 'title', 'duration', 'thumbnail', 'uploader', 'webpage_url', 'id',
+                 'acodec', 'asr', 'gain_db', 'timestamp', 'resume_at', 'refreshed')
+    
+    def __init__(self, url=None, **fields):
+        for key in self.__slots__:
+            setattr(self, key, None)
+        self.url = url
+        for key, value in fields.items():
+            self[key] = value
+    
+    @classmethod
+    def from_dict(cls, data):
+        """Build a record from a dict, ignoring keys the record has no field for."""
+        return cls(**{key: value for key, value in data.items() if key in cls.__slots__})
+    
+    def resolve(self, info):
+        """Take the stream URL and any missing metadata from a full extraction."""
+        self.url = info['url']
+        for key in ('title', 'duration', 'thumbnail', 'uploader', 'webpage_url', 'id', 'acodec', 'asr'):
+            if info.get(key) is not None:
+                setattr(self, key, info[key])
+    
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+    
+    def __contains__(self, key):
+        return key in self.__slots__ and getattr(self, key) is not None
+    
+    def get(self, key, default=None):
+        value = getattr(self, key, None) if key in self.__slots__ else None
+        return default if value is None else value
+    
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        if key in self.__slots__:
+            setattr(self, key, None)
+        return value
+    
+    def keys(self):
+        return [key for key in self.__slots__ if getattr(self, key) is not None]
+    
+    def __repr__(self):
+        return f"Track({self.title or self.url!r})"
+
+class _QueueNode:
+    __slots__ = ('item', 'priority', 'size', 'left', 'right')
+    
+    def __init__(self, item):
+        self.item = item
+        self.priority = random.random()
+        self.size = 1
+        self.left = self.right = None
+
+def _node_size(node):
+    return node.size if node else 0
+
+def _update_node(node):
+    node.size = 1 + _node_size(node.left) + _node_size(node.right)
+    return node
+
+class TrackQueue:
+    """Sequence backed by an implicit treap: O(log n) indexed access, insert, remove and move.
+    
+    Supports the deque operations the player uses (append, appendleft, extend, popleft,
+    clear, iteration), plus slicing and cheap page views for large queues.
+    """
+    def __init__(self, items=()):
+        self._root = None
+        self.journal = []  # Changes since the last take_journal(), for incremental snapshots
+        self.extend(items)
+    
+    @staticmethod
+    def _merge(left, right):
+        if left is None or right is None:
+            return left or right
+        if left.priority > right.priority:
+            left.right = TrackQueue._merge(left.right, right)
+            return _update_node(left)
+        right.left = TrackQueue._merge(left, right.left)
+        return _update_node(right)
+    
+    @staticmethod
+    def _split(node, count):
+        """Split a subtree into its first `count` items and the rest."""
+        if node is None:
+            return None, None
+        if _node_size(node.left) >= count:
+            left, node.left = TrackQueue._split(node.left, count)
+            return left, _update_node(node)
+        node.right, right = TrackQueue._split(node.right, count - _node_size(node.left) - 1)
+        return _update_node(node), right
+    
+    @staticmethod
+    def _build(items):
+        """Balanced treap over `items` in O(n)."""
+        nodes = [_QueueNode(item) for item in items]
+        
+        def link(low, high):
+            if low >= high:
+                return None
+            middle = (low + high) // 2
+            node = nodes[middle]
+            node.left = link(low, middle)
+            node.right = link(middle + 1, high)
+            return _update_node(node)
+        
+        root = link(0, len(nodes))
+        # Hand out random priorities top-down so the heap order of the treap holds
+        priorities = iter(sorted((random.random() for _ in nodes), reverse=True))
+        level = [root] if root else []
+        while level:
+            children = []
+            for node in level:
+                node.priority = next(priorities)
+                children.extend(child for child in (node.left, node.right) if child)
+            level = children
+        return root
+    
+    def _index(self, index):
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("queue index out of range")
+        return index
+    
+    def __len__(self):
+        return _node_size(self._root)
+    
+    def __bool__(self):
+        return self._root is not None
+    
+    def __iter__(self):
+        return self.iter_from(0)
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            return self.page(start, max(0, stop - start))[::step]
+        index = self._index(index)
+        node = self._root
+        while True:
+            left = _node_size(node.left)
+            if index == left:
+                return node.item
+            if index < left:
+                node = node.left
+            else:
+                index -= left + 1
+                node = node.right
+    
+    def __delitem__(self, index):
+        self.pop(index)
+    
+    def iter_from(self, start):
+        """Iterate from position `start` without walking the items before it."""
+        stack = []
+        node = self._root
+        while node:
+            left = _node_size(node.left)
+            if start <= left:
+                stack.append(node)
+                node = node.left
+            else:
+                start -= left + 1
+                node = node.right
+        while stack:
+            node = stack.pop()
+            yield node.item
+            node = node.right
+            while node:
+                stack.append(node)
+                node = node.left
+    
+    def page(self, start, count):
+        return list(itertools.islice(self.iter_from(start), count))
+    
+    def _record(self, change):
+        """Journal a change; ('reset',) stands for changes only a full copy of the queue captures."""
+        if self.journal[:1] == [('reset',)]:
+            return
+        if change == ('reset',) or len(self.journal) >= QUEUE_JOURNAL_LIMIT:
+            self.journal = [('reset',)]
+        else:
+            self.journal.append(change)
+    
+    def take_journal(self):
+        """Return the changes journaled so far and start a new journal."""
+        journal, self.journal = self.journal, []
+        return journal
+    
+    def append(self, item):
+        self._root = self._merge(self._root, _QueueNode(item))
+        self._record(('extend', [item]))
+    
+    def appendleft(self, item):
+        self._root = self._merge(_QueueNode(item), self._root)
+        self._record(('insert', 0, item))
+    
+    def extend(self, items):
+        items = list(items)
+        if items:
+            self._root = self._merge(self._root, self._build(items))
+            self._record(('extend', items))
+    
+    def insert(self, index, item):
+        index = max(0, min(len(self), index if index >= 0 else index + len(self)))
+        left, right = self._split(self._root, index)
+        self._root = self._merge(self._merge(left, _QueueNode(item)), right)
+        self._record(('insert', index, item))
+    
+    def pop(self, index=-1):
+        index = self._index(index)
+        left, rest = self._split(self._root, index)
+        node, right = self._split(rest, 1)
+        self._root = self._merge(left, right)
+        self._record(('pop', index))
+        return node.item
     
-    async def extract_info(self, url: str, playlist: bool = False) -> dict:
-        """Asynchronously extract info from a URL with caching."""
-        cache_key = f"info:{url}:{playlist}"
-        cached_result = self.cache.get(cache_key)
-        if cached_result:
-            return cached_result
-            
-        async with self.extraction_semaphore:
-            loop = asyncio.get_running_loop()
-            opts = self.ydl_opts.copy()
-            opts['noplaylist'] = not playlist
-            with YoutubeDL(opts) as ydl:
-                try:
-                    result = await loop.run_in_executor(thread_pool, 
-                                                      partial(ydl.extract_info, url, download=False))
-                    if result:
-                        self.cache.set(cache_key, result)
-                    return result
-                except Exception as e:
-                    print(f"Extraction error: {e}")
-                    return None
+    def popleft(self):
+        if self._root is None:
+            raise IndexError("pop from an empty queue")
+        return self.pop(0)
     
-    async def extract_multiple_urls(self, urls, playlist=False):
-        """Extract info from multiple URLs concurrently."""
-        tasks = []
-        for url in urls:
-            tasks.append(self.extract_info(url, playlist))
-        
-        return await asyncio.gather(*tasks, return_exceptions=True)
+    def move(self, source, target):
+        """Move the item at `source` so that it ends up at position `target`."""
+        self.insert(target, self.pop(source))
     
-    def format_track_data(self, info):
-        """Format track data from YouTube info."""
-        if not info:
-            return None
-            
-        return {
-            'url': info['url'],
-            'title': info.get('title', 'Unknown Title'),
-            'duration': info.get('duration', 0),
-            'thumbnail': info.get('thumbnail', None),
-            'uploader': info.get('uploader', 'Unknown Uploader')
-        }
+    def shuffle(self):
+        items = list(self)
+        random.shuffle(items)
+        self._root = self._build(items)
+        self._record(('reset',))
+    
+    def clear(self):
+        self._root = None
+        self._record(('reset',))
+    
+    def __repr__(self):
+        return f"TrackQueue({len(self)} items)"
+
+class PlayerMessages:
+    """Debounced messages, one per key (a guild's player, a playlist's progress), edited in place"""
+    def __init__(self, debounce=PLAYER_MESSAGE_DEBOUNCE):
+        self.debounce = debounce
+        self.pending = {}  # key -> (destination, embed, last) not written yet
+        self.messages = {}  # key -> discord.Message being edited
+        self.tasks = {}  # key -> dispatcher task
+    
+    def update(self, key, destination, embed, message=None, last=False):
+        """Queue an embed for `key`; `message` adopts an existing message, `last` forgets it once written."""
+        if message is not None:
+            self.messages.setdefault(key, message)
+        self.pending[key] = (destination, embed, last)
+        metrics.inc('player_message_updates_total')
+        if key not in self.tasks:
+            self.tasks[key] = asyncio.get_running_loop().create_task(self._dispatch(key))
+    
+    def forget(self, key):
+        """Drop pending updates; the next update posts a new message."""
+        self.pending.pop(key, None)
+        self.messages.pop(key, None)
+        task = self.tasks.pop(key, None)
+        if task and task is not asyncio.current_task():
+            task.cancel()
+    
+    async def _dispatch(self, key):
+        try:
+            while key in self.pending:
+                await asyncio.sleep(self.debounce)
+                destination, embed, last = self.pending.pop(key)
+                await self._write(key, destination, embed)
+                if last and key not in self.pending:
+                    self.messages.pop(key, None)
+        finally:
+            if self.tasks.get(key) is asyncio.current_task():
+                del self.tasks[key]
+    
+    async def _write(self, key, destination, embed):
+        message = self.messages.get(key)
+        try:
+            if message is not None:
+                try:
+                    await message.edit(embed=embed)
+                    metrics.inc('player_message_writes_total', kind='edit')
+                    return
+                except discord.NotFound:
+                    pass  # Deleted by someone: post a new one
+            self.messages[key] = await destination.send(embed=embed)
+            metrics.inc('player_message_writes_total', kind='send')
+        except Exception as e:
+            print(f"Failed to update message {key}: {e}")
 
 class GuildState:
     def __init__(self, guild_id: int):
         self.guild_id = guild_id
-        self.queue = deque()  # Using deque for more efficient queue operations
-        self.waiting_urls = deque()
+        self.queue = TrackQueue()  # Track records; stream URLs are resolved just before playback
         self.currently_playing = None
         self.is_playing_audio = False
-        self.audio_lock = False
+        self.track_finished = asyncio.Event()  # Set from the voice thread when a track ends
+        self.track_ended_at = None  # perf_counter() of the last track end, for transition timing
+        self.player_task = None  # Playback actor, the only task that changes the queue or voice client
+        self.mailbox = asyncio.Queue()  # (command, args, reply future, posted at) for the actor
+        self.listener = None  # StationListener while the guild is tuned to a radio station
+        self.generation = 0  # Bumped by reset, so the actor drops work it started before
+        self.disconnect_timer = None  # TimerWheel key of a pending idle disconnect
+        self.playlist_tasks = set()  # Background playlist ingestion
+        self.prefetch_task = None
+        self.prefetching = None  # Track the prefetch stage is currently preparing
+        self.prefetched = None  # (track, WarmOpusSource) ready for queue[0]
+        self.current_source = None  # Source of currently_playing, for its position
+        self.voice_channel_id = None  # Where to reconnect after a restart
+        self.text_channel_id = None
         self.last_activity = time.time()
     
     def reset(self):
         """Reset all state for this guild."""
+        self.generation += 1
         self.queue.clear()
-        self.waiting_urls.clear()
         self.currently_playing = None
+        self.current_source = None
+        self.listener = None
         self.is_playing_audio = False
-        self.audio_lock = False
+        self.track_finished.set()  # Release a player loop waiting on the current track
+        self.cancel_disconnect_timer()
+        self.cancel_playlist_tasks()
+        self.drop_prefetched()
+    
+    def cancel_playlist_tasks(self):
+        """Stop backfilling playlists into the queue."""
+        for task in self.playlist_tasks:
+            task.cancel()
+        self.playlist_tasks.clear()
+    
+    def drop_prefetched(self):
+        """Cancel pending prefetch work and release a prepared source."""
+        if self.prefetch_task and not self.prefetch_task.done():
+            self.prefetch_task.cancel()
+        self.prefetch_task = None
+        if self.prefetched:
+            self.prefetched[1].cleanup()
+            self.prefetched = None
+    
+    def cancel_disconnect_timer(self):
+        """Cancel a pending idle disconnect, if any."""
+        if self.disconnect_timer:
+            timers.cancel(self.disconnect_timer)
+            self.disconnect_timer = None
     
     def update_activity(self):
         """Update the last activity timestamp."""
         self.last_activity = time.time()
 
+class RestoredContext:
+    """Stands in for commands.Context when playback resumes without a command"""
+    def __init__(self, guild, channel=None):
+        self.guild = guild
+        self.channel = channel
+        self.author = guild.me
+    
+    @property
+    def voice_client(self):
+        return self.guild.voice_client
+    
+    async def send(self, *args, **kwargs):
+        if self.channel is not None:
+            return await self.channel.send(*args, **kwargs)
+
 class MusicPlayer:
     def __init__(self, bot):
         self.bot = bot
         self.youtube_service = YouTubeService()
+        self.transcode_cache = TranscodeCache(TRANSCODE_CACHE_DIR) if TRANSCODE_CACHE_DIR else None
+        self.loudness = LoudnessAnalyzer(
+            PersistentCache(CACHE_DB_PATH, ttl=LOUDNESS_TTL, table='loudness') if CACHE_DB_PATH else None
+        )
+        self.soundboard = Soundboard(SOUNDBOARD_DIR, self.loudness)
+        self.ffmpeg = FFmpegBudget()
+        self.stations = {}  # Radio stations by name, see Station
+        self.snapshots = QueueSnapshots(
+            PersistentCache(CACHE_DB_PATH, ttl=QUEUE_SNAPSHOT_TTL, table='queues')
+        ) if CACHE_DB_PATH else None
+        self.snapshot_task = None
+        self.player_messages = PlayerMessages()
         self.guild_states = {}
-        self.cleanup_task = None
     
     def get_guild_state(self, guild_id: int) -> GuildState:
         """Get or create a guild state object."""
         if guild_id not in self.guild_states:
             self.guild_states[guild_id] = GuildState(guild_id)
+            timers.schedule(('evict', guild_id), GUILD_STATE_TTL, partial(self._evict_guild_state, guild_id))
         return self.guild_states[guild_id]
     
-    def sync_playback_error(self, error, ctx):
-        """Handle playback errors synchronously."""
+    def _evict_guild_state(self, guild_id):
+        """Drop a guild state idle for GUILD_STATE_TTL, or check again when it could be."""
+        state = self.guild_states.get(guild_id)
+        if state is None:
+            return
+        idle_for = time.time() - state.last_activity
+        if state.is_playing_audio or state.queue or state.listener is not None or idle_for < GUILD_STATE_TTL:
+            timers.schedule(('evict', guild_id), max(GUILD_STATE_TTL - idle_for, TIMER_TICK), partial(self._evict_guild_state, guild_id))
+            return
+        self.guild_states.pop(guild_id, None)
+        self.player_messages.forget(guild_id)
+        metrics.forget_guild(guild_id)
+    
+    def sync_track_end(self, error, ctx, loop):
+        """Called from the voice thread when a track finishes or fails."""
+        metrics.inc('tracks_finished_total', ctx.guild.id, outcome='error' if error else 'ok')
         if error:
             print(f'Error in playback for guild {ctx.guild.id}: {error}')
             # Run the error handler asynchronously
-            asyncio.run_coroutine_threadsafe(self.playback_error(error, ctx), self.bot.loop)
+            asyncio.run_coroutine_threadsafe(self.playback_error(error, ctx), loop)
+        
+        # Wake the player loop so the next track starts right away; state only changes on the loop
+        guild_state = self.guild_states.get(ctx.guild.id)
+        if guild_state is None:
+            return
+        loop.call_soon_threadsafe(self._track_ended, guild_state, time.perf_counter())
+    
+    @staticmethod
+    def _track_ended(guild_state, ended_at):
+        guild_state.track_ended_at = ended_at
+        guild_state.track_finished.set()
+    
+    def track_end_callback(self, ctx):
+        """Build the `after` callback for voice_client.play."""
+        return partial(self.sync_track_end, ctx=ctx, loop=asyncio.get_running_loop())
     
     async def playback_error(self, error, ctx):
         """Async error handler for playback issues."""
         print(f'Handling error: {error}')
         # You can add more sophisticated error handling here
     
+    def ensure_player(self, ctx: commands.Context):
+        """Start the playback actor for a guild unless one is already running."""
+        guild_state = self.get_guild_state(ctx.guild.id)
+        if guild_state.player_task is None or guild_state.player_task.done():
+            guild_state.player_task = self.bot.loop.create_task(self.player_loop(ctx))
+        return guild_state.player_task
+    
+    def post(self, ctx: commands.Context, command, *args):
+        """Hand a command to the guild's playback actor; the returned future holds its result."""
+        guild_state = self.get_guild_state(ctx.guild.id)
+        reply = asyncio.get_running_loop().create_future()
+        guild_state.mailbox.put_nowait((command, args, reply, time.perf_counter()))
+        metrics.inc('actor_commands_total', ctx.guild.id, command=command)
+        self.ensure_player(ctx)
+        return reply
+    
     async def player_loop(self, ctx: commands.Context):
-        """Main player loop that processes the queue."""
+        """Playback actor: plays the queue and handles the guild's mailbox until both are empty.
+        
+        Commands are handled between tracks and while a track is being prepared or played,
+        so no other task touches the queue or the voice client and a command never waits
+        for more than the command before it.
+        """
         guild_state = self.get_guild_state(ctx.guild.id)
+        guild_state.cancel_disconnect_timer()
         
-        while guild_state.queue and ctx.voice_client:
-            if not ctx.voice_client.is_playing():
-                next_song = guild_state.queue.popleft()  # Using deque.popleft() for O(1) performance
-                
-                try:
-                    source = discord.FFmpegOpusAudio(next_song['url'], **FFMPEG_OPTIONS)
-                    
-                    # Create a partial function to capture the context for error handling
-                    error_callback = partial(self.sync_playback_error, ctx=ctx)
-                    ctx.voice_client.play(source, after=error_callback)
-                    
-                    guild_state.is_playing_audio = True
-                    guild_state.audio_lock = True
-                    guild_state.currently_playing = next_song
-                    guild_state.update_activity()
-                    
-                    # Send now playing message
-                    await self.send_now_playing_message(ctx, next_song)
-                    
-                    # Update the timestamp for the currently playing song
-                    guild_state.currently_playing['timestamp'] = discord.utils.utcnow().timestamp()
-                except Exception as e:
-                    print(f"Error playing track: {e}")
-                    continue  # Skip this track and try the next one
+        while True:
+            await self.handle_commands(ctx, guild_state)
+            if not (guild_state.queue and ctx.voice_client):
+                if guild_state.mailbox.empty():
+                    break
+                continue
             
-            # Wait for the audio to finish playing
-            while guild_state.is_playing_audio and ctx.voice_client:
-                if ctx.voice_client.is_playing():
-                    guild_state.audio_lock = False
-                
-                if not guild_state.audio_lock and not ctx.voice_client.is_playing():
-                    guild_state.is_playing_audio = False
-                
-                await asyncio.sleep(0.5)  # Reduced sleep time for more responsive queue processing
+            next_song = guild_state.queue.popleft()
+            guild_state.track_finished.clear()
+            generation = guild_state.generation
+            
+            try:
+                source = await self.serve(ctx, guild_state, self.take_prefetched(guild_state, next_song))
+                if source is None and guild_state.generation == generation:
+                    source = await self.serve(ctx, guild_state, self.prepare_source(next_song, ctx.guild.id))
+                if guild_state.generation != generation or not ctx.voice_client:
+                    if source is not None:
+                        source.cleanup()  # Stopped while the track was being prepared
+                    continue
+                ctx.voice_client.play(source, after=self.track_end_callback(ctx))
+            except Exception as e:
+                print(f"Error playing track: {e}")
+                continue  # Skip this track and try the next one
+            
+            guild_state.is_playing_audio = True
+            guild_state.currently_playing = next_song
+            guild_state.current_source = source
+            guild_state.update_activity()
+            metrics.inc('tracks_started_total', ctx.guild.id)
+            if guild_state.track_ended_at is not None:
+                metrics.observe('track_transition_seconds', time.perf_counter() - guild_state.track_ended_at, ctx.guild.id)
+            self.schedule_prefetch(guild_state, next_song)
+            
+            # Update the timestamp for the currently playing song
+            guild_state.currently_playing['timestamp'] = discord.utils.utcnow().timestamp()
+            self.refresh_player_message(ctx)
+            
+            # Handle commands until the after callback reports the end of the track
+            await self.serve(ctx, guild_state, guild_state.track_finished.wait())
+            
+            if getattr(source, 'forbidden', False) and not next_song.get('refreshed') and guild_state.currently_playing is next_song:
+                # The stream URL died mid-track: resolve a new one and continue where it stopped
+                next_song['refreshed'] = True
+                next_song['resume_at'] = source.elapsed
+                guild_state.queue.appendleft(next_song)
+                metrics.inc('stream_url_refreshes_total', ctx.guild.id)
+        
+        guild_state.is_playing_audio = False
+        guild_state.current_source = None
+        guild_state.track_ended_at = None
+        if ctx.voice_client:
+            self.schedule_idle_disconnect(ctx)
+    
+    async def serve(self, ctx, guild_state, awaitable):
+        """Await `awaitable` while handling mailbox commands, then return its result.
+        
+        Returns None without waiting further once a command resets the guild.
+        """
+        generation = guild_state.generation
+        task = asyncio.ensure_future(awaitable)
+        try:
+            while not task.done():
+                getter = asyncio.ensure_future(guild_state.mailbox.get())
+                done, _ = await asyncio.wait((task, getter), return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    await self.handle_command(ctx, guild_state, getter.result())
+                    if guild_state.generation != generation:
+                        return None
+                else:
+                    getter.cancel()
+        finally:
+            if not task.done():
+                task.cancel()
+        return task.result()
+    
+    async def handle_commands(self, ctx, guild_state):
+        """Handle every command waiting in the mailbox."""
+        while not guild_state.mailbox.empty():
+            await self.handle_command(ctx, guild_state, guild_state.mailbox.get_nowait())
+    
+    async def handle_command(self, ctx, guild_state, message):
+        command, args, reply, posted_at = message
+        metrics.observe('actor_command_wait_seconds', time.perf_counter() - posted_at, ctx.guild.id, command=command)
+        try:
+            result = await getattr(self, f'do_{command}')(ctx, guild_state, *args)
+        except Exception as e:
+            if not reply.done():
+                reply.set_exception(e)
+        else:
+            if not reply.done():
+                reply.set_result(result)
+    
+    async def do_enqueue(self, ctx, guild_state, tracks, front=False):
+        """Queue tracks (at the front with `front`) and return the queue length."""
+        if guild_state.listener and ctx.voice_client:
+            # The guild's own queue takes over from the radio station
+            guild_state.listener = None
+            ctx.voice_client.stop()
+        if front:
+            for track in reversed(tracks):
+                guild_state.queue.appendleft(track)
+        else:
+            guild_state.queue.extend(tracks)
+        self.refresh_player_message(ctx)
+        return len(guild_state.queue)
+    
+    async def do_skip(self, ctx, guild_state):
+        """Stop the current track so the next one starts; return the skipped track, if any."""
+        if not (ctx.voice_client and ctx.voice_client.is_playing()):
+            return None
+        current_song = guild_state.currently_playing
+        ctx.voice_client.stop()
+        return current_song or {}
+    
+    async def do_stop(self, ctx, guild_state, only_if_idle=False):
+        """Stop playback, leave the voice channel and forget the queue."""
+        voice_client = ctx.voice_client
+        if only_if_idle and (voice_client is None or voice_client.is_playing() or guild_state.queue):
+            return False
+        if voice_client:
+            if voice_client.is_playing():
+                voice_client.stop()
+            await voice_client.disconnect()
+        guild_state.reset()
+        self.player_messages.forget(ctx.guild.id)
+        return True
+    
+    async def do_clear(self, ctx, guild_state):
+        """Empty the queue and stop playlist backfills; return how many songs were dropped."""
+        cleared = len(guild_state.queue)
+        guild_state.cancel_playlist_tasks()
+        guild_state.queue.clear()
+        self.refresh_player_message(ctx)
+        return cleared
+    
+    async def do_remove(self, ctx, guild_state, index):
+        if not 0 <= index < len(guild_state.queue):
+            return None
+        track = guild_state.queue.pop(index)
+        self.refresh_player_message(ctx)
+        return track
+    
+    async def do_move(self, ctx, guild_state, source, target):
+        total = len(guild_state.queue)
+        if not (0 <= source < total and 0 <= target < total):
+            return None
+        track = guild_state.queue[source]
+        guild_state.queue.move(source, target)
+        self.refresh_player_message(ctx)
+        return track
+    
+    async def do_shuffle(self, ctx, guild_state):
+        if len(guild_state.queue) < 2:
+            return 0
+        guild_state.queue.shuffle()
+        self.refresh_player_message(ctx)
+        return len(guild_state.queue)
+    
+    async def do_interject(self, ctx, guild_state, name, finished):
+        """Play a soundboard clip: mixed over the track, before the rest of it, or on its own."""
+        voice_client = ctx.voice_client
+        current = voice_client.source if voice_client.is_playing() or voice_client.is_paused() else None
+        paused = voice_client.is_paused()
+        if isinstance(current, (WarmOpusSource, StationListener)) and not paused and name in self.soundboard.clips:
+            current.overlay(self.soundboard.clips[name], after=finished)
+        elif isinstance(current, StationListener) or guild_state.listener is not None:
+            # The station cannot wait for one guild's clip, and the voice client is taken
+            finished()
+            await ctx.send("Only short clips can be played while tuned to a radio station!")
+        elif isinstance(current, WarmOpusSource):
+            # Nothing to mix with: the track waits in memory and resumes from the same frame
+            after = finished
+            if paused:
+                loop = asyncio.get_running_loop()
+                voice_client.resume()
+                after = lambda *_: (finished(), loop.call_soon_threadsafe(self.post, ctx, 'pause'))
+            current.interject(await self.clip_source(ctx, name), after=after)
+        else:
+            voice_client.play(await self.clip_source(ctx, name), after=finished)
+    
+    async def clip_source(self, ctx, name):
+        """Soundboard source; a clip that is not in memory counts against the FFmpeg budget."""
+        source = await self.soundboard.source(name)
+        if isinstance(source, discord.FFmpegAudio):
+            self.ffmpeg.reserve('encode', ctx.guild.id).attach(source)
+        return source
+    
+    async def do_tune(self, ctx, guild_state, station):
+        """Replace the guild's own playback with a radio station's stream."""
+        voice_client = ctx.voice_client
+        if voice_client is None or station.closed:
+            return False
+        guild_state.cancel_playlist_tasks()
+        guild_state.queue.clear()
+        guild_state.drop_prefetched()
+        if voice_client.is_playing() or voice_client.is_paused():
+            voice_client.stop()
+        
+        listener = guild_state.listener = station.subscribe()
+        loop = asyncio.get_running_loop()
+        voice_client.play(listener, after=lambda error: loop.call_soon_threadsafe(self.station_ended, ctx, listener))
+        self.player_messages.forget(ctx.guild.id)
+        return True
+    
+    def station_ended(self, ctx, listener):
+        guild_state = self.get_guild_state(ctx.guild.id)
+        if guild_state.listener is listener:
+            guild_state.listener = None
+            self.schedule_idle_disconnect(ctx)
+    
+    async def do_rewind(self, ctx, guild_state, seconds):
+        """Seek the current track back from memory; return the seconds rewound, or None if nothing plays."""
+        source = ctx.voice_client.source if ctx.voice_client else None
+        if not isinstance(source, WarmOpusSource):
+            return None
+        return source.seek_back(seconds)
+    
+    async def do_pause(self, ctx, guild_state):
+        if ctx.voice_client and ctx.voice_client.is_playing():
+            ctx.voice_client.pause()
+    
+    async def prepare_source(self, track, guild_id=None):
+        """Resolve the stream URL just in time unless a local rendition exists, then spawn the pipeline
+        once the FFmpeg budget admits it."""
+        local = self.transcode_cache and self.transcode_cache.contains(track.get('id'))
+        if not local:
+            await self.youtube_service.resolve_stream_url(track, guild_id, refresh=bool(track.get('refreshed')))
+            if not track['url']:
+                raise ValueError(f"No stream URL for {track.get('webpage_url')}")
+        if track.get('gain_db') is None:
+            track['gain_db'] = self.loudness.gain_for(track.get('id'))
+        
+        pipelines = [('copy', None)] if local else fallback_pipelines(track)
+        lease, pipeline, options = await self.ffmpeg.admit(pipelines, guild_id)
+        try:
+            source = self.create_source(track, guild_id, None if local else (pipeline, options))
+        except BaseException:
+            lease.release()
+            raise
+        lease.attach(source)
+        return source
+    
+    def create_source(self, track, guild_id=None, pipeline=None):
+        """Spawn the FFmpeg pipeline for a track, from the local Opus cache when possible.
+        
+        `pipeline` is a (name, options) pair admitted by FFmpegBudget, ffmpeg_pipeline(track) by default.
+        """
+        # A track restored from a snapshot continues where the last run stopped
+        start = track.pop('resume_at', None)
+        seek = f"-ss {start:.2f} " if start else ""
+        
+        local_path = self.transcode_cache.lookup(track.get('id')) if self.transcode_cache else None
+        if local_path:
+            # Already normalized and Opus encoded: remux only
+            return WarmOpusSource(discord.FFmpegOpusAudio(local_path, codec='copy', before_options=seek or None), guild_id, offset=start or 0)
+        
+        if track.get('gain_db') is None:
+            # First play: measure in the background so later plays get a static gain
+            self.loudness.schedule(track.get('id'), track['url'])
+        elif self.transcode_cache:
+            self.transcode_cache.record_play(track.get('id'), track['url'], ffmpeg_pipeline(track, 'normalize')[1]['options'])
+        pipeline, options = pipeline or ffmpeg_pipeline(track)
+        metrics.inc('ffmpeg_pipelines_total', pipeline=pipeline)
+        options = dict(options, before_options=seek + options['before_options'])
+        log = FFmpegLog()
+        return WarmOpusSource(discord.FFmpegOpusAudio(track['url'], stderr=log, **options), guild_id, log=log, offset=start or 0)
+    
+    def schedule_prefetch(self, guild_state, current_track):
+        """Prepare queue[0] shortly before the current track ends."""
+        guild_state.drop_prefetched()
+        delay = max(0, (current_track.get('duration') or 0) - PREFETCH_LEAD_TIME)
+        guild_state.prefetch_task = asyncio.get_running_loop().create_task(self.prefetch_next(guild_state, delay))
+    
+    async def prefetch_next(self, guild_state, delay):
+        """Re-validate the next stream URL and start its FFmpeg process ahead of time."""
+        await asyncio.sleep(delay)
+        if not guild_state.queue:
+            return
+        
+        track = guild_state.queue[0]
+        guild_state.prefetching = track
+        try:
+            source = await self.prepare_source(track, guild_state.guild_id)
+            try:
+                await asyncio.get_running_loop().run_in_executor(thread_pool, source.warm)
+            except BaseException:
+                source.cleanup()
+                raise
+            guild_state.prefetched = (track, source)
+        except Exception as e:
+            # Best effort: the player prepares the track itself, and a dropped task must not hide the error
+            print(f"Prefetch error: {e}")
+        finally:
+            guild_state.prefetching = None
+    
+    async def take_prefetched(self, guild_state, track):
+        """Return the warmed source for `track` if the prefetch stage prepared it."""
+        task = guild_state.prefetch_task
+        if task and not task.done():
+            if guild_state.prefetching is track:
+                # FFmpeg is already starting for this track, finishing is faster than starting over
+                await asyncio.wait((task,))  # A /stop may cancel it meanwhile
+            else:
+                task.cancel()
         
-        # Disconnect after a timeout if nothing else is playing
-        await asyncio.sleep(TIMEOUT_DELAY)
-        # Refresh guild state before checking
+        prefetched = guild_state.prefetched
+        guild_state.prefetched = None
+        guild_state.prefetch_task = None
+        if prefetched and prefetched[0] is track:
+            return prefetched[1]
+        if prefetched:
+            prefetched[1].cleanup()
+        return None
+    
+    def schedule_idle_disconnect(self, ctx: commands.Context):
+        """Disconnect after TIMEOUT_DELAY unless playback resumes in the meantime."""
+        guild_state = self.get_guild_state(ctx.guild.id)
+        guild_state.disconnect_timer = timers.schedule(
+            ('disconnect', ctx.guild.id), TIMEOUT_DELAY, lambda: asyncio.create_task(self._idle_disconnect(ctx))
+        )
+    
+    async def _idle_disconnect(self, ctx: commands.Context):
+        """Leave the voice channel if nothing was queued since the timer was set."""
+        self.get_guild_state(ctx.guild.id).disconnect_timer = None
+        await self.post(ctx, 'stop', True)
+    
+    def refresh_player_message(self, ctx):
+        """Schedule an update of the guild's player message; never waits on Discord."""
         guild_state = self.get_guild_state(ctx.guild.id)
-        if ctx.voice_client and not ctx.voice_client.is_playing() and not guild_state.queue and not guild_state.waiting_urls:
-            await ctx.voice_client.disconnect()
-            guild_state.reset()
+        if guild_state.currently_playing:
+            self.player_messages.update(ctx.guild.id, ctx, self.now_playing_embed(guild_state))
     
-    async def send_now_playing_message(self, ctx, song):
-        """Send a message showing what's currently playing."""
+    def now_playing_embed(self, guild_state):
+        """Build the player message: the current song, what comes next and the queue length."""
+        song = guild_state.currently_playing
         embed = discord.Embed(
             title="Now Playing",
-            description=f"[{song['title']}]({song['url']})",
+            description=f"[{song['title']}]({song.get('webpage_url') or song['url']})",
             color=discord.Color.blue()
         )
         
         embed.set_thumbnail(url=song.get('thumbnail', ''))
         embed.add_field(name="Duration", value=f"{song.get('duration', 0)} seconds", inline=True)
         embed.add_field(name="Uploader", value=song.get('uploader', 'Unknown Uploader'), inline=True)
-        
-        await ctx.send(embed=embed)
-    
-    async def extract_playlist_urls(self, ctx: commands.Context):
-        """Process waiting URLs and add them to the queue - optimized version."""
-        guild_state = self.get_guild_state(ctx.guild.id)
-        
-        # Process URLs in batches for better efficiency
-        while guild_state.waiting_urls and ctx.voice_client:
-            if len(guild_state.queue) > QUEUE_LOAD_LIMIT:
-                await asyncio.sleep(1)
-                continue
-            
-            # Process multiple URLs concurrently (up to 5 at a time)
-            batch_size = min(MAX_CONCURRENT_EXTRACTIONS, len(guild_state.waiting_urls))
-            batch_urls = []
-            
-            for _ in range(batch_size):
-                if guild_state.waiting_urls:
-                    batch_urls.append(guild_state.waiting_urls.popleft()['url'])
-            
-            # Extract info concurrently
-            results = await self.youtube_service.extract_multiple_urls(batch_urls)
-            
-            for i, info in enumerate(results):
-                if isinstance(info, Exception):
-                    print(f"Error extracting info: {info}")
-                    continue
-                    
-                if ctx.voice_client and info:
-                    track = self.youtube_service.format_track_data(info)
-                    if track:
-                        guild_state.queue.append(track)
-            
-            # Start playing if not already playing
-            if not ctx.voice_client.is_playing() and guild_state.queue:
-                self.bot.loop.create_task(self.player_loop(ctx))
-        
-        await asyncio.sleep(0.5)
+        if guild_state.queue:
+            up_next = guild_state.queue[0]
+            embed.add_field(name="Up Next", value=up_next.get('title') or up_next.get('webpage_url') or up_next['url'], inline=False)
+        embed.set_footer(text=f"{len(guild_state.queue)} songs in queue")
+        return embed
     
+    @timed_command('play')
     async def play(self, ctx: commands.Context, search: str):
         """Play a song or playlist."""
         if not ctx.author.voice:
@@ -305,50 +3124,90 @@ class MusicPlayer:
         
         guild_state = self.get_guild_state(ctx.guild.id)
         guild_state.update_activity()
+        guild_state.voice_channel_id = ctx.author.voice.channel.id
+        guild_state.text_channel_id = ctx.channel.id
         
-        # Check if the search query is a playlist URL
-        if "list=" in search:
+        # Check if the search query is a radio station or a playlist URL
+        if search.startswith("radio:"):
+            await self.tune(ctx, search[len("radio:"):])
+        elif "list=" in search:
             await self.handle_playlist(ctx, search, guild_state)
         else:
             await self.handle_single_song(ctx, search, guild_state)
-        
-        await self.extract_playlist_urls(ctx)
     
     async def handle_playlist(self, ctx, url, guild_state):
-        """Handle playlist processing."""
-        info = await self.youtube_service.extract_info(url, playlist=True)
-        if not info or 'entries' not in info:
+        """Queue the first page of a playlist right away and stream the rest in the background."""
+        pages = self.youtube_service.iter_playlist(url, guild_id=ctx.guild.id)
+        first_page = await anext(pages, None)
+        if not first_page:
+            await pages.aclose()
             return await ctx.send("Couldn't retrieve playlist info.")
         
-        # Queue all playlist entries
-        for entry in info['entries']:
+        loaded = self.queue_playlist_entries(ctx, first_page)
+        message = await ctx.send(embed=self.playlist_embed(ctx, url, loaded, done=False))
+        
+        task = self.bot.loop.create_task(self.backfill_playlist(ctx, url, pages, loaded, message))
+        guild_state.playlist_tasks.add(task)
+        task.add_done_callback(guild_state.playlist_tasks.discard)
+    
+    def queue_playlist_entries(self, ctx, entries):
+        """Queue flat playlist entries as they are and return how many were usable."""
+        tracks = []
+        for entry in entries:
             if entry is None or 'url' not in entry:
                 continue
             
             if "youtube.com/watch" in entry['url']:
-                guild_state.waiting_urls.append({'url': entry['url']})
+                tracks.append(self.youtube_service.format_track_data(entry))
+        if tracks:
+            self.post(ctx, 'enqueue', tracks)
+        return len(tracks)
+    
+    async def backfill_playlist(self, ctx, url, pages, loaded, message):
+        """Keep pulling playlist pages into the queue and report progress."""
+        try:
+            async for page in pages:
+                if not ctx.voice_client:
+                    break
+                loaded += self.queue_playlist_entries(ctx, page)
+                self.player_messages.update(('playlist', message.id), ctx, self.playlist_embed(ctx, url, loaded, done=False), message)
+        finally:
+            await pages.aclose()
         
+        self.player_messages.update(('playlist', message.id), ctx, self.playlist_embed(ctx, url, loaded, done=True), message, last=True)
+    
+    def playlist_embed(self, ctx, url, loaded, done):
+        """Build the embed reporting playlist ingestion progress."""
+        description = f"{loaded} songs found in the playlist." if done else f"Loading playlist... {loaded} songs queued so far."
         embed = discord.Embed(
             title="Playlist Added to Queue",
-            description=f"{len(info['entries'])} songs found in the playlist.",
+            description=description,
             color=discord.Color.green()
         )
         
         embed.add_field(name="Playlist URL", value=f"[Click Here]({url})", inline=False)
         embed.add_field(name="Requested by", value=ctx.author.mention, inline=True)
-        await ctx.send(embed=embed)
+        return embed
     
-    async def handle_single_song(self, ctx, search, guild_state):
-        """Handle single song processing."""
+    async def find_song(self, ctx, search):
+        """Extract a watch URL or search YouTube; tell the user and return None when nothing is found."""
         if "youtube.com/watch" in search:
-            guild_state.waiting_urls.append({'url': search})
-            info = await self.youtube_service.extract_info(search)
+            info = await self.youtube_service.extract_info(search, guild_id=ctx.guild.id)
+            if not info:
+                await ctx.send("Couldn't retrieve that song!")
         else:
-            info = await self.youtube_service.search_youtube(search)
+            info = await self.youtube_service.search_youtube(search, guild_id=ctx.guild.id)
             if not info:
-                return await ctx.send("No results found!")
-            
-            guild_state.waiting_urls.append({'url': info['url']})
+                await ctx.send("No results found!")
+        return info
+    
+    async def handle_single_song(self, ctx, search, guild_state):
+        """Handle single song processing."""
+        info = await self.find_song(ctx, search)
+        if not info:
+            return
+        
+        position = await self.post(ctx, 'enqueue', [self.youtube_service.format_track_data(info)])
         
         if info:
             print(f"Adding {info['url']} to the queue in {ctx.guild.id} guild.")
@@ -363,32 +3222,74 @@ class MusicPlayer:
             embed.set_thumbnail(url=info.get('thumbnail', ''))
             embed.add_field(name="Duration", value=f"{info.get('duration', 0)} seconds", inline=True)
             embed.add_field(name="Uploader", value=info.get('uploader', 'Unknown Uploader'), inline=True)
-            embed.add_field(name="Position in Queue", value=len(guild_state.waiting_urls), inline=True)
+            embed.add_field(name="Position in Queue", value=position, inline=True)
             embed.add_field(name="Requested by", value=ctx.author.mention, inline=True)
             
             await ctx.send(embed=embed)
     
+    @timed_command('radio')
+    async def radio(self, ctx: commands.Context, name: str, search: str):
+        """Queue a song on a radio station, creating it and tuning this channel in if needed."""
+        if not ctx.author.voice:
+            return await ctx.send("You need to be in a voice channel!")
+        
+        name = name.strip().lower()
+        info = await self.find_song(ctx, search)
+        if not info:
+            return
+        
+        station = self.stations.get(name)
+        if station is None or station.closed:
+            station = self.stations[name] = Station(name)
+        station.enqueue(self.youtube_service.format_track_data(info))
+        
+        guild_state = self.get_guild_state(ctx.guild.id)
+        if guild_state.listener is None or guild_state.listener.station is not station:
+            await self.tune(ctx, name, announce=False)
+        station.start(self.prepare_source, self.station_closed)  # One FFmpeg per track, whatever the listeners
+        
+        embed = discord.Embed(
+            title=f"Radio {name}",
+            description=f"[{info['title']}]({info.get('webpage_url') or info['url']}) added to the station.",
+            color=discord.Color.green()
+        )
+        embed.add_field(name="Listeners", value=len(station.listeners), inline=True)
+        embed.add_field(name="Up Next", value=len(station.queue), inline=True)
+        embed.set_footer(text=f"Other servers can tune in with /play radio:{name}")
+        await ctx.send(embed=embed)
+    
+    async def tune(self, ctx, name, announce=True):
+        """Tune the caller's voice channel in to a radio station."""
+        station = self.stations.get(name.strip().lower())
+        if station is None or station.closed:
+            return await ctx.send(f"There is no radio station called {name}!")
+        
+        if not ctx.voice_client:
+            await ctx.author.voice.channel.connect()
+        if await self.post(ctx, 'tune', station) and announce:
+            playing = station.currently_playing
+            await ctx.send(f"Tuned in to radio {station.name}" + (f", now playing {playing['title']}." if playing else "."))
+    
+    def station_closed(self, station):
+        if self.stations.get(station.name) is station:
+            del self.stations[station.name]
+    
+    @timed_command('stop')
     async def stop(self, ctx: commands.Context):
         """Stop playback and disconnect."""
         if ctx.voice_client:
-            if ctx.voice_client.is_playing():
-                ctx.voice_client.stop()
-            
-            await ctx.voice_client.disconnect()
-            self.get_guild_state(ctx.guild.id).reset()
+            await self.post(ctx, 'stop')
             await ctx.send("Playback stopped and disconnected.")
         else:
             await ctx.send("Not in a voice channel!")
     
+    @timed_command('skip')
     async def skip(self, ctx: commands.Context):
         """Skip the currently playing song."""
-        guild_state = self.get_guild_state(ctx.guild.id)
-        
         if ctx.voice_client:
-            if ctx.voice_client.is_playing():
-                current_song = guild_state.currently_playing
-                ctx.voice_client.stop()
-                if current_song and 'title' in current_song:
+            current_song = await self.post(ctx, 'skip')
+            if current_song is not None:
+                if 'title' in current_song:
                     await ctx.send(f"Skipping {current_song['title']}...")
                 else:
                     await ctx.send("Skipping current song...")
@@ -397,15 +3298,20 @@ class MusicPlayer:
         else:
             await ctx.send("Not in a voice channel!")
     
-    async def queue(self, ctx: commands.Context):
-        """Display the current queue."""
+    @timed_command('queue')
+    async def queue(self, ctx: commands.Context, page: int = 1):
+        """Display one page of the current queue."""
         guild_state = self.get_guild_state(ctx.guild.id)
+        total = len(guild_state.queue)
         
-        if guild_state.queue:
-            queue_string = "\n".join([f"{i}. {song['title']}" for i, song in enumerate(guild_state.queue[:QUEUE_EMBEDDING_SONG_LIMIT], start=1)])
-            
-            if len(guild_state.queue) > QUEUE_EMBEDDING_SONG_LIMIT:
-                queue_string += f"\n...and {len(guild_state.queue) - QUEUE_EMBEDDING_SONG_LIMIT} more!"
+        if total:
+            pages = -(-total // QUEUE_EMBEDDING_SONG_LIMIT)
+            page = max(1, min(page, pages))
+            start = (page - 1) * QUEUE_EMBEDDING_SONG_LIMIT
+            queue_string = "\n".join(
+                f"{i}. {song.get('title') or song.get('webpage_url') or song['url']}"
+                for i, song in enumerate(guild_state.queue.page(start, QUEUE_EMBEDDING_SONG_LIMIT), start=start + 1)
+            )
             
             embed = discord.Embed(title="Current Queue", description=queue_string, color=discord.Color.blue())
             
@@ -417,8 +3323,8 @@ class MusicPlayer:
                     inline=False
                 )
             
-            embed.set_footer(text="Use !skip to skip the current song.")
-            embed.add_field(name="Total Songs", value=len(guild_state.queue), inline=True)
+            embed.set_footer(text=f"Page {page}/{pages} · Use /queue page:<n> to browse, /skip to skip the current song.")
+            embed.add_field(name="Total Songs", value=total, inline=True)
             
             await ctx.send(embed=embed)
         else:
@@ -438,56 +3344,244 @@ class MusicPlayer:
             
             await ctx.send(embed=embed)
     
+    @timed_command('remove')
+    async def remove(self, ctx: commands.Context, position: int):
+        """Remove the song at a queue position (1 is the next song)."""
+        track = await self.post(ctx, 'remove', position - 1)
+        if track is None:
+            return await ctx.send(f"There is no song at position {position}!")
+        
+        await ctx.send(f"Removed {track.get('title') or track.get('webpage_url') or track['url']} from the queue.")
+    
+    @timed_command('move')
+    async def move(self, ctx: commands.Context, source: int, target: int):
+        """Move a song from one queue position to another."""
+        track = await self.post(ctx, 'move', source - 1, target - 1)
+        if track is None:
+            total = len(self.get_guild_state(ctx.guild.id).queue)
+            return await ctx.send(f"Positions must be between 1 and {total}!")
+        
+        await ctx.send(f"Moved {track.get('title') or track.get('webpage_url') or track['url']} to position {target}.")
+    
+    @timed_command('shuffle')
+    async def shuffle(self, ctx: commands.Context):
+        """Shuffle the upcoming songs."""
+        shuffled = await self.post(ctx, 'shuffle')
+        if not shuffled:
+            return await ctx.send("Not enough songs in the queue to shuffle!")
+        
+        await ctx.send(f"Shuffled {shuffled} songs.")
+    
+    @timed_command('clear')
     async def clear(self, ctx: commands.Context):
         """Clear the current queue."""
-        guild_state = self.get_guild_state(ctx.guild.id)
-        
-        if guild_state.queue or guild_state.waiting_urls:
-            guild_state.queue = []
-            guild_state.waiting_urls = []
+        if await self.post(ctx, 'clear'):
             await ctx.send("Queue has been cleared!")
         else:
             await ctx.send("Queue is already empty!")
     
-    async def start_cleanup_task(self):
-        """Start a background task to clean up inactive guilds and expired cache."""
-        self.cleanup_task = self.bot.loop.create_task(self._cleanup_loop())
+    @timed_command('soundboard')
+    async def play_clip(self, ctx: commands.Context, name: str):
+        """Play a soundboard clip over the music without interrupting it."""
+        if not ctx.author.voice:
+            return await ctx.send("You need to be in a voice channel!")
+        if name not in self.soundboard.paths:
+            available = ", ".join(self.soundboard.names()) or "none"
+            return await ctx.send(f"Unknown clip! Available clips: {available}")
+        
+        if ctx.voice_client is None:
+            await ctx.author.voice.channel.connect()
+        
+        # The clip is done when it runs dry, reported from the voice thread
+        loop = asyncio.get_running_loop()
+        done = asyncio.Event()
+        finished = lambda *_: loop.call_soon_threadsafe(done.set)
+        
+        await self.post(ctx, 'interject', name, finished)
+        await done.wait()
+    
+    @timed_command('rewind')
+    async def rewind(self, ctx: commands.Context, seconds: int = 10):
+        """Replay the last seconds of the current track from memory."""
+        rewound = await self.post(ctx, 'rewind', seconds) if ctx.voice_client else None
+        if rewound is None:
+            return await ctx.send("Nothing is playing to rewind!")
+        
+        if rewound:
+            await ctx.send(f"Rewound {rewound:g} seconds.")
+        else:
+            await ctx.send("Nothing to rewind yet!")
+    
+    @timed_command('stats')
+    async def stats(self, ctx: commands.Context):
+        """Show where request latency goes, for this guild and globally."""
+        embed = discord.Embed(title="Bot Statistics", color=discord.Color.blue())
+        
+        for title, guild_id in (("This Server", ctx.guild.id), ("All Servers", None)):
+            lines = [
+                f"{name}: p50 {self.format_seconds(h['p50'])}, p95 {self.format_seconds(h['p95'])} ({h['count']})"
+                for name, h in sorted(metrics.summary(guild_id).items())
+            ]
+            embed.add_field(name=title, value="\n".join(lines)[:1024] or "No data yet", inline=False)
+        
+        hits = metrics.counter('cache_requests_total', result='memory_hit') + metrics.counter('cache_requests_total', result='disk_hit')
+        misses = metrics.counter('cache_requests_total', result='miss')
+        hit_rate = f"{hits / (hits + misses):.0%}" if hits + misses else "n/a"
+        embed.add_field(name="Cache Hit Rate", value=hit_rate, inline=True)
+        
+        limiter = self.youtube_service.limiter.stats()
+        embed.add_field(
+            name="Extraction Limiter",
+            value=f"limit {limiter['limit']}, rate {limiter['rate']}/s, in flight {limiter['in_flight']}, waiting {limiter['waiting']}",
+            inline=True
+        )
+        embed.add_field(name="Active Servers", value=len(self.guild_states), inline=True)
+        
+        await ctx.send(embed=embed)
+    
+    @staticmethod
+    def format_seconds(value):
+        if value is None:
+            return "n/a"
+        if value == float('inf'):
+            return f">{LATENCY_BUCKETS[-1]:g}s"
+        return f"≤{value:g}s"
+    
+    def start_snapshot_task(self):
+        """Start snapshotting guild queues so a restart can resume them."""
+        if self.snapshots and self.snapshot_task is None:
+            self.snapshot_task = asyncio.get_running_loop().create_task(self._snapshot_loop())
+    
+    async def _snapshot_loop(self):
+        while True:
+            await asyncio.sleep(QUEUE_SNAPSHOT_INTERVAL)
+            try:
+                changes = self.snapshots.collect(self.guild_states)
+                if changes:
+                    writes = await asyncio.get_running_loop().run_in_executor(thread_pool, self.snapshots.write, changes)
+                    metrics.inc('queue_snapshot_writes_total', amount=writes)
+            except (sqlite3.Error, TypeError, ValueError) as e:
+                print(f"Queue snapshot error: {e}")
+    
+    async def restore_queues(self):
+        """Bring back the queues of the last run: metadata now, stream URLs as each track plays."""
+        if not self.snapshots:
+            return
+        try:
+            snapshots = self.snapshots.load()
+        except sqlite3.Error as e:
+            print(f"Queue snapshot read error: {e}")
+            return
+        
+        for guild_id, data in snapshots.items():
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                continue  # Served by another shard
+            
+            voice_channel = guild.get_channel(data['voice_channel'])
+            if voice_channel is None or not any(not member.bot for member in voice_channel.members):
+                self.snapshots.discard(guild_id)  # Nobody left to listen
+                continue
+            
+            # Filled before the guild's playback actor first starts, so nothing else can hold the queue
+            guild_state = self.get_guild_state(guild_id)
+            guild_state.queue.extend(Track.from_dict(track) for track in data['queue'])
+            if data['current']:
+                guild_state.queue.appendleft(Track.from_dict(data['current']))
+            guild_state.voice_channel_id = voice_channel.id
+            guild_state.text_channel_id = data['text_channel']
+            
+            ctx = RestoredContext(guild, guild.get_channel(data['text_channel']))
+            try:
+                if ctx.voice_client is None:
+                    await voice_channel.connect()
+            except (discord.ClientException, asyncio.TimeoutError) as e:
+                print(f"Failed to rejoin voice in guild {guild_id}: {e}")
+                continue
+            self.ensure_player(ctx)
+            metrics.inc('queues_restored_total', guild_id)
+
+# Initialize the bot with appropriate intents
+def parse_shard_ids(value):
+    return [int(shard_id) for shard_id in value.split(',') if shard_id.strip()]
+
+def shard_ranges(shard_count, processes):
+    """Split shard IDs into contiguous ranges, one per worker process."""
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+    ranges, start = [], 0
+    for index in range(processes):
+        end = start + size + (1 if index < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+class ShardSupervisor:
+    """Runs one bot process per shard range and restarts workers that exit.
+    
+    Workers share the SQLite metadata cache and the Opus cache directory, so a
+    track extracted by one shard is a cache hit for the others.
+    """
+    def __init__(self, shard_count, processes=SHARD_PROCESSES, restart_delay=SHARD_RESTART_DELAY):
+        self.shard_count = shard_count
+        self.ranges = shard_ranges(shard_count, processes)
+        self.restart_delay = restart_delay
+        self.workers = {}  # index -> Popen
+        self.restart_at = {}  # index -> time.monotonic() of the next start
+    
+    def worker_env(self, index):
+        env = dict(os.environ, SHARD_COUNT=str(self.shard_count), SHARD_IDS=",".join(map(str, self.ranges[index])))
+        if METRICS_PORT:
+            env['METRICS_PORT'] = str(METRICS_PORT + index)  # One endpoint per worker
+        return env
+    
+    def spawn(self, index):
+        print(f"Starting shard worker {index} with shards {self.ranges[index]}")
+        self.workers[index] = subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=self.worker_env(index))
+    
+    def poll(self):
+        """Schedule restarts for exited workers and start the ones that are due."""
+        now = time.monotonic()
+        for index, process in list(self.workers.items()):
+            if process.poll() is not None:
+                print(f"Shard worker {index} exited with code {process.returncode}, restarting in {self.restart_delay}s")
+                del self.workers[index]
+                self.restart_at[index] = now + self.restart_delay
+        for index, due in list(self.restart_at.items()):
+            if due <= now:
+                del self.restart_at[index]
+                self.spawn(index)
     
-    async def _cleanup_loop(self):
-        """Periodically clean up inactive guilds and expired cache."""
+    def run(self):
+        for index in range(len(self.ranges)):
+            self.spawn(index)
         try:
             while True:
-                # Clean up expired cache entries
-                self.youtube_service.cache.clear_expired()
-                
-                # Clean up inactive guild states
-                current_time = time.time()
-                inactive_guilds = []
-                
-                for guild_id, state in self.guild_states.items():
-                    # If inactive for more than 15 minutes and not playing
-                    if (current_time - state.last_activity > 900 and 
-                        not state.is_playing_audio and 
-                        not state.queue and 
-                        not state.waiting_urls):
-                        inactive_guilds.append(guild_id)
-                
-                for guild_id in inactive_guilds:
-                    self.guild_states.pop(guild_id, None)
-                
-                await asyncio.sleep(300)  # Run cleanup every 5 minutes
-        except asyncio.CancelledError:
+                time.sleep(1)
+                self.poll()
+        except KeyboardInterrupt:
             pass
-        except Exception as e:
-            print(f"Error in cleanup loop: {e}")
-            # Restart the task
-            self.cleanup_task = self.bot.loop.create_task(self._cleanup_loop())
+        finally:
+            self.stop()
+    
+    def stop(self):
+        for process in self.workers.values():
+            process.terminate()
+        for process in self.workers.values():
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.workers.clear()
 
-# Initialize the bot with appropriate intents
 intents = discord.Intents.default()
 intents.voice_states = True
 intents.message_content = True
-bot = commands.Bot(command_prefix="!", intents=intents)
+if SHARD_IDS:
+    # Worker process of a sharded deployment, see ShardSupervisor
+    bot = commands.AutoShardedBot(command_prefix="!", intents=intents, shard_ids=parse_shard_ids(SHARD_IDS), shard_count=SHARD_COUNT)
+else:
+    bot = commands.Bot(command_prefix="!", intents=intents)
 
 # Create our music player instance
 music_player = MusicPlayer(bot)
@@ -501,6 +3595,15 @@ try:
         await interaction.response.defer()
         await music_player.play(ctx, search)
 
+    @play_slash.autocomplete('search')
+    async def play_autocomplete(interaction: discord.Interaction, current: str):
+        """Suggest tracks the bot has already resolved, without asking YouTube."""
+        with metrics.timer('autocomplete_seconds'):
+            return [
+                discord.app_commands.Choice(name=track['title'][:100], value=track['webpage_url'][:100])
+                for track in music_player.youtube_service.index.search(current, AUTOCOMPLETE_LIMIT)
+            ]
+
     @bot.tree.command(name="stop")
     async def stop_slash(interaction: discord.Interaction):
         """Stop playback and disconnect."""
@@ -516,11 +3619,32 @@ try:
         await music_player.skip(ctx)
 
     @bot.tree.command(name="queue")
-    async def queue_slash(interaction: discord.Interaction):
+    async def queue_slash(interaction: discord.Interaction, page: int = 1):
         """Display the current queue."""
         ctx = await bot.get_context(interaction)
         await interaction.response.defer()
-        await music_player.queue(ctx)
+        await music_player.queue(ctx, page)
+
+    @bot.tree.command(name="remove")
+    async def remove_slash(interaction: discord.Interaction, position: int):
+        """Remove a song from the queue."""
+        ctx = await bot.get_context(interaction)
+        await interaction.response.defer()
+        await music_player.remove(ctx, position)
+
+    @bot.tree.command(name="move")
+    async def move_slash(interaction: discord.Interaction, position: int, to: int):
+        """Move a song to another position in the queue."""
+        ctx = await bot.get_context(interaction)
+        await interaction.response.defer()
+        await music_player.move(ctx, position, to)
+
+    @bot.tree.command(name="shuffle")
+    async def shuffle_slash(interaction: discord.Interaction):
+        """Shuffle the queue."""
+        ctx = await bot.get_context(interaction)
+        await interaction.response.defer()
+        await music_player.shuffle(ctx)
         
     @bot.tree.command(name="pause")
     async def pause_slash(interaction: discord.Interaction):
@@ -544,6 +3668,27 @@ try:
         else:
             await interaction.followup.send("Nothing is paused to resume!")
 
+    @bot.tree.command(name="soundboard")
+    async def soundboard_slash(interaction: discord.Interaction, clip: str):
+        """Play a soundboard clip over the current song."""
+        ctx = await bot.get_context(interaction)
+        await interaction.response.defer()
+        await music_player.play_clip(ctx, clip)
+
+    @bot.tree.command(name="rewind")
+    async def rewind_slash(interaction: discord.Interaction, seconds: int = 10):
+        """Replay the last seconds of the current song."""
+        ctx = await bot.get_context(interaction)
+        await interaction.response.defer()
+        await music_player.rewind(ctx, seconds)
+
+    @bot.tree.command(name="radio")
+    async def radio_slash(interaction: discord.Interaction, station: str, search: str):
+        """Queue a song on a radio station shared with other servers."""
+        ctx = await bot.get_context(interaction)
+        await interaction.response.defer()
+        await music_player.radio(ctx, station, search)
+
     @bot.tree.command(name="clear")
     async def clear_slash(interaction: discord.Interaction):
         """Clear the current queue without stopping playback."""
@@ -551,6 +3696,13 @@ try:
         await interaction.response.defer()
         await music_player.clear(ctx)
 
+    @bot.tree.command(name="stats")
+    async def stats_slash(interaction: discord.Interaction):
+        """Show latency and cache statistics."""
+        ctx = await bot.get_context(interaction)
+        await interaction.response.defer()
+        await music_player.stats(ctx)
+
     # Set flag for slash commands availability
     has_slash_commands = True
 except (ImportError, AttributeError) as e:
@@ -561,35 +3713,13 @@ except (ImportError, AttributeError) as e:
     
 @bot.command()
 async def okul(ctx: commands.Context):
-    """Pause the current music, play the Okul meme, and resume."""
-    if not ctx.author.voice:
-        return await ctx.send("You need to be in a voice channel!")
-    
-    if ctx.voice_client is None:
-        await ctx.author.voice.channel.connect()
-    
-    time_point = discord.utils.utcnow().timestamp()
-    playing = ctx.voice_client.is_playing()
-    if playing:
-        ctx.voice_client.pause()
-    
-    okul_path = os.path.join(os.path.dirname(__file__), "..\\", os.getenv("OKUL_MEME_PATH"))
-    if os.path.exists(okul_path):
-        ctx.voice_client.play(discord.FFmpegOpusAudio(okul_path, options="-vn -af dynaudnorm=f=200:g=3:n=0:p=0.95"))
-    else:
-        await ctx.send("Okul meme file not found!")
+    """Play the Okul meme over the current music."""
+    await music_player.play_clip(ctx, OKUL_CLIP)
 
-    # Wait for the Okul meme to finish
-    while ctx.voice_client.is_playing():
-        await asyncio.sleep(1)
-
-    # Replay the previous music from where it left off
-    guild_state = music_player.get_guild_state(ctx.guild.id)
-    
-    if playing and guild_state.currently_playing:
-        guild_state.currently_playing['timestamp'] += discord.utils.utcnow().timestamp() - time_point
-        previous_track = guild_state.currently_playing
-        ctx.voice_client.play(discord.FFmpegOpusAudio(previous_track['url'], options=f"-ss {discord.utils.utcnow().timestamp() - int(guild_state.currently_playing['timestamp'])} {FFMPEG_OPTIONS['options']}"))
+@bot.command(name="sb")
+async def soundboard(ctx: commands.Context, name: str):
+    """Play a soundboard clip over the current music."""
+    await music_player.play_clip(ctx, name)
 
 @bot.event
 async def on_voice_state_update(member, before, after):
@@ -597,19 +3727,42 @@ async def on_voice_state_update(member, before, after):
     if member == bot.user and before.channel and not after.channel:
         if member.guild.id in music_player.guild_states:
             music_player.guild_states[member.guild.id].reset()
+            music_player.player_messages.forget(member.guild.id)
 
 @bot.event
 async def on_ready():
     print(f"Application Started: {bot.user}")
     # Sync commands with Discord only if slash commands are available
     if has_slash_commands:
-        try:
-            synced = await bot.tree.sync()
-            print(f"Synced {len(synced)} command(s)")
-        except Exception as e:
-            print(f"Failed to sync commands: {e}")
+        # Commands are global, so only the worker holding shard 0 syncs them
+        if not SHARD_IDS or 0 in bot.shard_ids:
+            try:
+                synced = await bot.tree.sync()
+                print(f"Synced {len(synced)} command(s)")
+            except Exception as e:
+                print(f"Failed to sync commands: {e}")
     else:
         print("Using prefix commands only. Prefix: '!'")
+    
+    if not music_player.soundboard.paths:
+        await music_player.soundboard.load()
+    
+    music_player.youtube_service.index.load()
+    if music_player.transcode_cache:
+        await music_player.transcode_cache.load()
+    
+    if music_player.snapshots and music_player.snapshot_task is None:
+        await music_player.restore_queues()
+        music_player.start_snapshot_task()
+    
+    if METRICS_PORT and metrics.server is None:
+        try:
+            await metrics.start_server()
+        except OSError as e:
+            print(f"Failed to start metrics endpoint: {e}")
 
 if __name__ == "__main__":
-    bot.run(os.getenv("DISCORD_BOT_TOKEN"))
+    if SHARD_COUNT and not SHARD_IDS:
+        ShardSupervisor(SHARD_COUNT).run()
+    else:
+        bot.run(os.getenv("DISCORD_BOT_TOKEN"))
@@ -0,0 +1,204 @@
+import unittest
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+# Add the src directory to the path so we can import main
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from main import PersistentCache, YouTubeCache, TranscodeCache, QueueSnapshots, GuildState
+
+class TestYouTubeCache(unittest.TestCase):
+    """Test cases for the two-tier metadata cache"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, 'metadata.sqlite3')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_persistent_tier_survives_restart(self):
+        """A fresh cache reads entries written by a previous process"""
+        YouTubeCache(persistent=PersistentCache(self.db_path)).set('info:a:False', {'title': 'A'})
+
+        cache = YouTubeCache(persistent=PersistentCache(self.db_path))
+        self.assertEqual(cache.get('info:a:False'), {'title': 'A'})
+        # Promoted into memory on the first read
+        self.assertIn('info:a:False', cache.cache)
+
+    def test_memory_layer_is_lru_bounded(self):
+        """The in-memory layer keeps only the most recently used entries"""
+        cache = YouTubeCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(list(cache.cache), ['a', 'c'])
+
+    def test_disk_eviction_by_entries(self):
+        """Least recently used entries are evicted once max_entries is exceeded"""
+        disk = PersistentCache(self.db_path, max_entries=3)
+        for key in 'abcd':
+            disk.set(key, key)
+            time.sleep(0.001)
+        self.assertIsNone(disk.get('a'))
+        self.assertEqual(disk.get('d')[0], 'd')
+        self.assertLessEqual(disk.total_entries, 3)
+
+    def test_disk_eviction_by_bytes(self):
+        """Entries are evicted to stay under the byte budget"""
+        disk = PersistentCache(self.db_path, max_bytes=2000)
+        for i in range(20):
+            disk.set(f'k{i}', os.urandom(200).hex())
+        self.assertLessEqual(disk.total_bytes, 2000)
+        self.assertIsNotNone(disk.get('k19'))
+
+    def test_disk_totals_are_kept_without_rescanning(self):
+        """Replacing, deleting and prefix deletes keep the totals equal to the table's"""
+        disk = PersistentCache(self.db_path)
+        disk.set('a', 'x' * 100)
+        disk.set('a', 'y')
+        for key in ('1:queue', '1:log:000000', '12:queue', '2'):
+            disk.set(key, key)
+        disk.delete_prefix('1:')
+        disk.delete('2')
+        self.assertEqual(sorted(key for key, _ in disk.items()), ['12:queue', 'a'])
+
+        entries, size = disk.total_entries, disk.total_bytes
+        disk._refresh_totals()
+        self.assertEqual((entries, size), (disk.total_entries, disk.total_bytes))
+        self.assertEqual(entries, 2)
+
+    def test_disk_ttl(self):
+        """Expired entries are not returned and are removed by clear_expired"""
+        disk = PersistentCache(self.db_path, ttl=60)
+        disk.set('old', 1, timestamp=time.time() - 120)
+        disk.set('new', 2)
+        self.assertIsNone(disk.get('old'))
+        disk.clear_expired()
+        self.assertEqual(disk.total_entries, 1)
+        self.assertEqual(disk.total_bytes, disk.conn.execute("SELECT SUM(size) FROM entries").fetchone()[0])
+
+class TestQueueSnapshots(unittest.TestCase):
+    """Test cases for guild queue snapshots"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = PersistentCache(os.path.join(self.tmpdir.name, 'metadata.sqlite3'), table='queues')
+        self.snapshots = QueueSnapshots(self.store)
+        self.state = GuildState(1)
+        self.state.voice_channel_id = 10
+        self.state.text_channel_id = 20
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_only_changed_guilds_are_written(self):
+        """An unchanged queue is not written again"""
+        self.state.queue.append({'url': 'https://stream/1', 'title': 'One'})
+        self.assertEqual(self.snapshots.save({1: self.state}), 1)
+        self.assertEqual(self.snapshots.save({1: self.state}), 0)
+
+        self.state.queue.append({'webpage_url': 'https://www.youtube.com/watch?v=b'})
+        self.assertEqual(self.snapshots.save({1: self.state}), 1)
+
+        restored = QueueSnapshots(PersistentCache(self.store.path, table='queues')).load()
+        self.assertEqual(restored[1]['queue'], [
+            {'url': 'https://stream/1', 'title': 'One'}, {'webpage_url': 'https://www.youtube.com/watch?v=b'},
+        ])
+        self.assertEqual(restored[1]['voice_channel'], 10)
+
+    def test_changes_are_logged_instead_of_rewriting_the_queue(self):
+        """Only the changes since the last snapshot are written, and replay to the same queue"""
+        self.state.queue.extend({'url': f'https://stream/{i}'} for i in range(100))
+        self.snapshots.save({1: self.state})
+        self.assertEqual(self.snapshots.collect({1: self.state}), {})
+
+        self.state.queue.popleft()
+        self.state.queue.append({'url': 'https://stream/new'})
+        self.state.queue.move(5, 0)
+        changes = self.snapshots.collect({1: self.state})
+        self.assertEqual([write[1] for write in changes[1]], ['1:log:000000'])
+        self.snapshots.write(changes)
+
+        restored = QueueSnapshots(PersistentCache(self.store.path, table='queues')).load()
+        self.assertEqual(restored[1]['queue'], [dict(track) for track in self.state.queue])
+
+    def test_shuffle_rewrites_the_queue(self):
+        """A shuffle writes a fresh base copy and drops the change log"""
+        self.state.queue.extend({'url': f'https://stream/{i}'} for i in range(10))
+        self.snapshots.save({1: self.state})
+        self.state.queue.popleft()
+        self.snapshots.save({1: self.state})
+
+        self.state.queue.shuffle()
+        self.snapshots.save({1: self.state})
+        self.assertEqual(sorted(key for key, _ in self.store.items()), ['1', '1:queue'])
+        self.assertEqual(self.snapshots.load()[1]['queue'], [dict(track) for track in self.state.queue])
+
+    def test_idle_guild_snapshot_is_dropped(self):
+        """Once a queue is empty its snapshot is deleted"""
+        self.state.queue.append({'url': 'https://stream/1'})
+        self.snapshots.save({1: self.state})
+        self.state.queue.clear()
+        self.assertEqual(self.snapshots.save({1: self.state}), 1)
+        self.assertEqual(self.snapshots.load(), {})
+
+class TestTranscodeCache(unittest.TestCase):
+    """Test cases for the on-disk Opus rendition cache"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = TranscodeCache(self.tmpdir.name, max_bytes=250, min_plays=2)
+
+        async def fake_ffmpeg(args):
+            with open(args[-1], 'wb') as f:
+                f.write(b'x' * 100)
+            return True
+
+        self.cache._run_ffmpeg = fake_ffmpeg
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_transcodes_after_repeated_plays(self):
+        """A track is transcoded once it has been played min_plays times"""
+        async def scenario():
+            await self.cache.load()
+            self.assertIsNone(self.cache.record_play('abc', 'https://stream'))
+            task = self.cache.record_play('abc', 'https://stream')
+            path = await task
+            self.assertEqual(path, self.cache.path('abc'))
+            self.assertEqual(self.cache.lookup('abc'), path)
+            self.assertIsNone(self.cache.lookup('other'))
+
+        asyncio.run(scenario())
+
+    def test_evicts_least_recently_played(self):
+        """Renditions are evicted in LRU order to respect the disk budget"""
+        async def scenario():
+            for video_id in ('a', 'b', 'c'):
+                await self.cache.transcode(video_id, 'https://stream')
+                if video_id == 'b':
+                    self.cache.lookup('a')
+            self.assertIsNotNone(self.cache.lookup('a'))
+            self.assertIsNone(self.cache.lookup('b'))
+
+        asyncio.run(scenario())
+        self.assertLessEqual(self.cache.total_bytes, 250)
+        self.assertFalse(os.path.exists(self.cache.path('b')))
+
+    def test_index_is_rebuilt_from_disk(self):
+        """Renditions written by a previous process are found after a restart"""
+        asyncio.run(self.cache.transcode('abc', 'https://stream'))
+        restarted = TranscodeCache(self.tmpdir.name)
+        self.assertFalse(restarted.contains('abc'))  # Not scanned yet, plays stream meanwhile
+        asyncio.run(restarted.load())
+        self.assertTrue(restarted.contains('abc'))
+        self.assertFalse(restarted.contains('../etc/passwd'))
+
+if __name__ == "__main__":
+    unittest.main()
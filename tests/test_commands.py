@@ -142,7 +142,7 @@ class TestSlashCommands(unittest.TestCase):
         
         # Assertions
         self.interaction.response.defer.assert_called_once()
-        music_player.queue.assert_called_once_with(self.ctx)
+        music_player.queue.assert_called_once_with(self.ctx, 1)
         
     def test_pause_slash_when_playing(self):
         """Test pause slash command when music is playing"""
@@ -216,5 +216,19 @@ class TestSlashCommands(unittest.TestCase):
         self.interaction.response.defer.assert_called_once()
         music_player.clear.assert_called_once_with(self.ctx)
 
+    def test_stats_slash(self):
+        """Test stats slash command"""
+        # Mock music_player.stats
+        music_player.stats = AsyncMock()
+        
+        # Run the test
+        asyncio.run(self._run_test(
+            bot.tree.get_command("stats").callback(self.interaction)
+        ))
+        
+        # Assertions
+        self.interaction.response.defer.assert_called_once()
+        music_player.stats.assert_called_once_with(self.ctx)
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+import os
+import sys
+
+# Add the benchmarks directory to the path so we can import the harness
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+
+import load_test
+
+class TestLoadTest(unittest.TestCase):
+    """Smoke test for the offline benchmark harness"""
+
+    def test_small_run_reports_all_metrics(self):
+        """A tiny simulation produces every section of the report"""
+        report = load_test.main(['--guilds', '3', '--duration', '0.5', '--latency', '0.01', '--jitter', '0',
+                                 '--error-rate', '0', '--spawn-delay', '0', '--track-seconds', '1',
+                                 '--time-scale', '0.05', '--think-time', '0.1', '--output', os.devnull])
+        results = report['results']
+        self.assertGreater(results['time_to_first_audio']['count'], 0)
+        self.assertGreater(results['extraction']['completed'], 0)
+        self.assertIn('event_loop_lag', results)
+        self.assertIn('peak_rss_bytes', results['memory'])
+
+    def test_playlists_run_without_background_errors(self):
+        """Playlist backfills complete without any task failing unnoticed"""
+        report = load_test.main(['--guilds', '3', '--duration', '1', '--latency', '0.01', '--jitter', '0',
+                                 '--error-rate', '0', '--spawn-delay', '0', '--track-seconds', '1',
+                                 '--time-scale', '0.05', '--think-time', '0.05', '--play-ratio', '0',
+                                 '--playlist-ratio', '1', '--skip-ratio', '0', '--playlist-size', '60',
+                                 '--output', os.devnull])
+        results = report['results']
+        self.assertGreater(results['tracks_started'], 0)
+        self.assertEqual(results['command_errors'], {})
+        self.assertEqual(results['background_errors'], {})
+
+if __name__ == "__main__":
+    unittest.main()
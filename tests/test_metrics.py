@@ -0,0 +1,60 @@
+import unittest
+import os
+import sys
+
+# Add the src directory to the path so we can import main
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from main import Metrics, Histogram
+
+class TestMetrics(unittest.TestCase):
+    """Test cases for the metrics registry"""
+
+    def test_histogram_quantiles(self):
+        """Quantiles report the upper bound of the matching bucket"""
+        histogram = Histogram(buckets=(0.1, 1.0))
+        for value in (0.05, 0.05, 0.5, 5.0):
+            histogram.observe(value)
+        self.assertEqual(histogram.quantile(0.5), 0.1)
+        self.assertEqual(histogram.quantile(0.75), 1.0)
+        self.assertEqual(histogram.quantile(1.0), float('inf'))
+
+    def test_records_global_and_per_guild(self):
+        """Every sample lands in the global series and in the guild's series"""
+        registry = Metrics()
+        registry.inc('commands_total', 42, command='play')
+        registry.inc('commands_total', 7, command='play')
+        with registry.timer('command_duration_seconds', 42, command='play'):
+            pass
+
+        self.assertEqual(registry.counter('commands_total', command='play'), 2)
+        self.assertEqual(registry.counter('commands_total', 42, command='play'), 1)
+        self.assertIn('command_duration_seconds[command=play]', registry.summary(42))
+        self.assertEqual(registry.summary(7), {})
+
+    def test_render_prometheus_text(self):
+        """The exposition format has counters, cumulative buckets, sum and count"""
+        registry = Metrics()
+        registry.inc('cache_requests_total', result='miss')
+        registry.observe('extraction_duration_seconds', 0.2, kind='search')
+        text = registry.render()
+
+        self.assertIn('jonkler_cache_requests_total{result="miss"} 1', text)
+        self.assertIn('jonkler_extraction_duration_seconds_bucket{kind="search",le="0.25"} 1', text)
+        self.assertIn('jonkler_extraction_duration_seconds_bucket{kind="search",le="+Inf"} 1', text)
+        self.assertIn('jonkler_extraction_duration_seconds_count{kind="search"} 1', text)
+
+    def test_guild_series_stay_out_of_the_exposition(self):
+        """Per-guild series serve /stats only and go away with the guild; label values are escaped"""
+        registry = Metrics()
+        registry.inc('commands_total', 42, command='say "hi"\\\n')
+        text = registry.render()
+
+        self.assertNotIn('guild=', text)
+        self.assertIn('jonkler_commands_total{command="say \\"hi\\"\\\\\\n"} 1', text)
+        registry.forget_guild(42)
+        self.assertEqual(registry.counter('commands_total', 42, command='say "hi"\\\n'), 0)
+        self.assertEqual(registry.counter('commands_total', command='say "hi"\\\n'), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,776 @@
+import unittest
+import asyncio
+import os
+import sys
+import subprocess
+import numpy as np
+import discord
+from unittest.mock import AsyncMock, MagicMock, patch
+
+# Add the src directory to the path so we can import main
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from main import MusicPlayer, PlayerMessages, Station, StationListener, OPUS_SILENCE, STATION_JOIN_FRAMES, FFmpegBudget, fallback_pipelines, process_usage, WarmOpusSource, PCMMixer, PCM_FRAME_SAMPLES, LoudnessAnalyzer, ffmpeg_pipeline, gain_for_loudness, parse_integrated_loudness, timers, metrics
+
+def make_player():
+    """MusicPlayer whose caches stay in memory instead of opening the real cache database"""
+    with patch('main.CACHE_DB_PATH', ''), patch('main.TRANSCODE_CACHE_DIR', ''):
+        return MusicPlayer(MagicMock())
+
+class CallbackVoiceClient:
+    """Voice client mock that keeps the `after` callback so tests can end tracks"""
+    def __init__(self):
+        self.played = []
+        self.after = None
+        self.playing = False
+
+    def is_playing(self):
+        return self.playing
+
+    def is_paused(self):
+        return False
+
+    def play(self, source, after=None):
+        self.played.append(source)
+        self.after = after
+        self.playing = True
+
+    def finish_track(self, error=None):
+        """Simulate the voice thread reaching the end of the source"""
+        self.playing = False
+        self.after(error)
+
+    def stop(self):
+        if self.playing:
+            self.finish_track()
+
+    async def disconnect(self):
+        self.playing = False
+
+class MockContext:
+    """Mock for commands.Context"""
+    def __init__(self, voice_client=None):
+        self.voice_client = voice_client
+        self.guild = MagicMock()
+        self.guild.id = 1234
+        self.author = MagicMock()
+        self.send = AsyncMock()
+
+class FakeSource:
+    """Stands in for the FFmpeg-backed source"""
+    def __init__(self, track, guild_id=None, pipeline=None):
+        self.url = track['url']
+        self.cleaned_up = False
+
+    def warm(self):
+        pass
+
+    def cleanup(self):
+        self.cleaned_up = True
+
+def make_track(n):
+    return {'url': f'https://stream/{n}', 'title': f'Track {n}', 'duration': 10}
+
+class TestPlayerLoop(unittest.TestCase):
+    """Test cases for the event-driven player loop"""
+
+    def setUp(self):
+        self.player = make_player()
+        self.voice_client = CallbackVoiceClient()
+        self.ctx = MockContext(self.voice_client)
+
+    def test_track_end_of_evicted_guild_changes_nothing(self):
+        """The voice thread's callback neither recreates a dropped guild state nor touches it off the loop"""
+        async def scenario():
+            callback = self.player.track_end_callback(self.ctx)
+            callback(None)
+            self.assertNotIn(self.ctx.guild.id, self.player.guild_states)
+
+            state = self.player.get_guild_state(self.ctx.guild.id)
+            await asyncio.get_running_loop().run_in_executor(None, callback, None)
+            await asyncio.sleep(0)
+            self.assertIsNotNone(state.track_ended_at)
+            self.assertTrue(state.track_finished.is_set())
+            self.player.guild_states.pop(self.ctx.guild.id)
+            timers.cancel(('evict', self.ctx.guild.id))
+
+        asyncio.run(scenario())
+
+    def test_tracks_advance_on_after_callback(self):
+        """The next track starts as soon as the after callback fires"""
+        async def scenario():
+            self.player.create_source = FakeSource
+            state = self.player.get_guild_state(self.ctx.guild.id)
+            state.queue.extend([make_track(1), make_track(2)])
+            task = asyncio.create_task(self.player.player_loop(self.ctx))
+
+            await asyncio.sleep(0.01)
+            self.assertEqual([s.url for s in self.voice_client.played], ['https://stream/1'])
+
+            self.voice_client.finish_track()
+            await asyncio.sleep(0.01)
+            self.assertEqual([s.url for s in self.voice_client.played], ['https://stream/1', 'https://stream/2'])
+
+            self.voice_client.finish_track()
+            await asyncio.wait_for(task, 1)
+            self.assertFalse(state.is_playing_audio)
+            self.assertIsNotNone(state.disconnect_timer)
+            state.cancel_disconnect_timer()
+
+        asyncio.run(scenario())
+
+    def test_next_track_is_prefetched(self):
+        """queue[0] gets its source spawned and warmed while the current track plays"""
+        async def scenario():
+            self.player.create_source = MagicMock(side_effect=FakeSource)
+            state = self.player.get_guild_state(self.ctx.guild.id)
+            first, second = make_track(1), make_track(2)
+            first['duration'] = second['duration'] = 0
+            state.queue.extend([first, second])
+            task = asyncio.create_task(self.player.player_loop(self.ctx))
+
+            await asyncio.sleep(0.05)
+            self.assertIs(state.prefetched[0], second)
+            prefetched_source = state.prefetched[1]
+
+            self.voice_client.finish_track()
+            await asyncio.sleep(0.01)
+            self.assertIs(self.voice_client.played[-1], prefetched_source)
+            self.assertEqual(self.player.create_source.call_count, 2)
+
+            self.voice_client.finish_track()
+            await asyncio.wait_for(task, 1)
+            state.cancel_disconnect_timer()
+
+        asyncio.run(scenario())
+
+    def test_forbidden_stream_is_resumed_with_a_fresh_url(self):
+        """A track whose stream URL is refused mid-play is re-resolved and resumed"""
+        async def scenario():
+            sources = []
+
+            def create_source(track, guild_id=None, pipeline=None):
+                source = FakeSource(track)
+                source.resume_at = track.pop('resume_at', None)
+                source.forbidden = not sources
+                source.elapsed = 12.5
+                sources.append(source)
+                return source
+
+            self.player.create_source = create_source
+            self.player.youtube_service.resolve_stream_url = AsyncMock()
+            state = self.player.get_guild_state(self.ctx.guild.id)
+            state.queue.append(make_track(1))
+            task = asyncio.create_task(self.player.player_loop(self.ctx))
+
+            await asyncio.sleep(0.01)
+            self.voice_client.finish_track()
+            await asyncio.sleep(0.01)
+            self.assertEqual(len(sources), 2)
+            self.assertEqual(sources[1].resume_at, 12.5)
+            self.player.youtube_service.resolve_stream_url.assert_awaited_with(state.currently_playing, self.ctx.guild.id, refresh=True)
+
+            self.voice_client.finish_track()
+            await asyncio.wait_for(task, 1)
+            state.cancel_disconnect_timer()
+
+        asyncio.run(scenario())
+
+    def test_playlist_is_queued_page_by_page(self):
+        """The first page is queued before the rest of the playlist is fetched"""
+        async def scenario():
+            self.player.bot.loop = asyncio.get_running_loop()
+            release = asyncio.Event()
+
+            async def pages(url, guild_id=None):
+                yield [{'url': f'https://www.youtube.com/watch?v={i}'} for i in range(3)]
+                await release.wait()
+                yield [{'url': f'https://www.youtube.com/watch?v={i}'} for i in range(3, 5)]
+
+            async def prepare_source(track, guild_id=None):
+                return FakeSource(track)
+
+            self.player.youtube_service.iter_playlist = pages
+            self.player.prepare_source = prepare_source
+            state = self.player.get_guild_state(self.ctx.guild.id)
+
+            await self.player.handle_playlist(self.ctx, 'https://youtube.com/playlist?list=x', state)
+            await asyncio.sleep(0.01)
+            self.assertEqual(len(self.voice_client.played), 1)
+            self.assertEqual(len(state.queue), 2)
+            self.assertIsNone(state.queue[0]['url'])  # Resolved just before it plays
+            self.ctx.send.assert_awaited_once()
+
+            release.set()
+            await asyncio.gather(*state.playlist_tasks)
+            await asyncio.sleep(0.01)
+            self.assertEqual(len(state.queue), 4)
+            self.assertFalse(state.player_task.done())
+
+            await self.player.post(self.ctx, 'stop')
+            await asyncio.wait_for(state.player_task, 1)
+            self.player.player_messages.forget(self.ctx.guild.id)
+
+        asyncio.run(scenario())
+
+    def test_commands_are_handled_while_a_track_is_prepared(self):
+        """The actor answers its mailbox while the next stream is still being resolved"""
+        async def scenario():
+            self.player.bot.loop = asyncio.get_running_loop()
+            resolving = asyncio.Event()
+
+            async def slow_prepare(track, guild_id=None):
+                resolving.set()
+                await asyncio.sleep(10)
+
+            self.player.prepare_source = slow_prepare
+            state = self.player.get_guild_state(self.ctx.guild.id)
+            await self.player.post(self.ctx, 'enqueue', [make_track(1), make_track(2), make_track(3)])
+            await resolving.wait()
+
+            removed = await asyncio.wait_for(self.player.post(self.ctx, 'remove', 1), 0.1)
+            self.assertEqual(removed['url'], 'https://stream/3')
+            self.assertEqual(await self.player.post(self.ctx, 'enqueue', [make_track(4)], True), 2)
+            self.assertEqual([track['url'] for track in state.queue], ['https://stream/4', 'https://stream/2'])
+
+            self.assertTrue(await asyncio.wait_for(self.player.post(self.ctx, 'stop'), 0.1))
+            await asyncio.wait_for(state.player_task, 1)
+            self.assertEqual(len(state.queue), 0)
+            self.assertEqual(self.voice_client.played, [])
+
+        asyncio.run(scenario())
+
+    def test_failed_prefetch_is_reported_not_raised(self):
+        """A prefetch that cannot prepare its track leaves nothing behind for the loop to trip over"""
+        async def scenario():
+            state = self.player.get_guild_state(self.ctx.guild.id)
+            state.queue.append(make_track(1))
+            self.player.prepare_source = AsyncMock(side_effect=ValueError('No stream URL'))
+            await self.player.prefetch_next(state, 0)
+            self.assertIsNone(state.prefetched)
+            self.assertIsNone(state.prefetching)
+            self.player.guild_states.pop(self.ctx.guild.id)
+            timers.cancel(('evict', self.ctx.guild.id))
+
+        asyncio.run(scenario())
+
+    def test_rewind_goes_through_the_actor(self):
+        """Rewind is a mailbox command, so only the actor touches the playing source"""
+        async def scenario():
+            self.player.bot.loop = asyncio.get_running_loop()
+            source = WarmOpusSource(PacketSource([b'%d' % i for i in range(10)]))
+            for _ in range(6):
+                source.read()
+            voice_client = MagicMock(source=source)
+            voice_client.is_playing.return_value = True
+            ctx = MockContext(voice_client)
+            state = self.player.get_guild_state(ctx.guild.id)
+
+            await self.player.rewind(ctx, 0.04)
+            ctx.send.assert_awaited_once_with("Rewound 0.04 seconds.")
+            self.assertEqual(source.position, 4)
+            self.assertEqual(metrics.counter('actor_commands_total', ctx.guild.id, command='rewind'), 1)
+            await asyncio.wait_for(state.player_task, 1)
+            state.cancel_disconnect_timer()
+
+        asyncio.run(scenario())
+
+    def test_ensure_player_starts_one_loop(self):
+        """Repeated calls reuse the running player task"""
+        async def scenario():
+            self.player.bot.loop = asyncio.get_running_loop()
+            async def fake_loop(ctx):
+                await asyncio.sleep(0.01)
+            self.player.player_loop = AsyncMock(side_effect=fake_loop)
+            first = self.player.ensure_player(self.ctx)
+            second = self.player.ensure_player(self.ctx)
+            self.assertIs(first, second)
+            await first
+            self.player.player_loop.assert_called_once_with(self.ctx)
+
+        asyncio.run(scenario())
+
+class TestRestoreQueues(unittest.TestCase):
+    """Test cases for resuming queues after a restart"""
+
+    def test_snapshot_is_restored_and_played(self):
+        """The interrupted track goes first and playback starts without a command"""
+        async def scenario():
+            player = make_player()
+            player.snapshots = MagicMock()
+            player.snapshots.load.return_value = {1234: {
+                'voice_channel': 10, 'text_channel': 20,
+                'current': dict(make_track(1), resume_at=42.0),
+                'queue': [make_track(2)],
+            }}
+            voice_channel = MagicMock(id=10, members=[MagicMock(bot=False)])
+            voice_channel.connect = AsyncMock()
+            guild = MagicMock(id=1234, voice_client=None)
+            guild.get_channel.side_effect = lambda channel_id: voice_channel if channel_id == 10 else MagicMock()
+            player.bot.get_guild.return_value = guild
+            player.ensure_player = MagicMock()
+
+            await player.restore_queues()
+
+            state = player.get_guild_state(1234)
+            self.assertEqual([track['url'] for track in state.queue], ['https://stream/1', 'https://stream/2'])
+            self.assertEqual(state.queue[0]['resume_at'], 42.0)
+            voice_channel.connect.assert_awaited_once()
+            player.ensure_player.assert_called_once()
+
+        asyncio.run(scenario())
+
+class TestPlayerMessages(unittest.TestCase):
+    """Test cases for the coalesced, edited-in-place player message"""
+
+    def setUp(self):
+        self.messages = PlayerMessages(debounce=0.01)
+        self.message = MagicMock()
+        self.message.edit = AsyncMock()
+        self.destination = MagicMock()
+        self.destination.send = AsyncMock(return_value=self.message)
+
+    def test_burst_is_coalesced_into_one_send(self):
+        """Only the newest embed of a burst is written, later ones edit it"""
+        async def scenario():
+            for n in range(5):
+                self.messages.update(1, self.destination, f'embed {n}')
+            await asyncio.sleep(0.05)
+            self.destination.send.assert_awaited_once_with(embed='embed 4')
+
+            self.messages.update(1, self.destination, 'embed 5')
+            await asyncio.sleep(0.05)
+            self.message.edit.assert_awaited_once_with(embed='embed 5')
+            self.assertEqual(self.destination.send.await_count, 1)
+            self.assertEqual(self.messages.tasks, {})
+
+        asyncio.run(scenario())
+
+    def test_deleted_message_is_posted_again(self):
+        """An edit of a deleted message falls back to a new message"""
+        async def scenario():
+            self.message.edit.side_effect = discord.NotFound(MagicMock(status=404), 'Unknown Message')
+            self.messages.update(1, self.destination, 'a', message=self.message)
+            await asyncio.sleep(0.05)
+            self.destination.send.assert_awaited_once_with(embed='a')
+
+        asyncio.run(scenario())
+
+    def test_forget_drops_pending_update(self):
+        """A forgotten guild gets no late update and starts a new message next time"""
+        async def scenario():
+            self.messages.update(1, self.destination, 'a')
+            self.messages.forget(1)
+            await asyncio.sleep(0.05)
+            self.destination.send.assert_not_awaited()
+            self.assertNotIn(1, self.messages.messages)
+
+        asyncio.run(scenario())
+
+    def test_playback_does_not_wait_on_discord(self):
+        """The next track starts while the player message is still being sent"""
+        async def scenario():
+            player = make_player()
+            player.player_messages.debounce = 0
+            player.create_source = FakeSource
+            voice_client = CallbackVoiceClient()
+            ctx = MockContext(voice_client)
+            async def slow_send(**kwargs):
+                await asyncio.sleep(10)
+
+            ctx.send = AsyncMock(side_effect=slow_send)
+            state = player.get_guild_state(ctx.guild.id)
+            state.queue.extend([make_track(1), make_track(2)])
+            task = asyncio.create_task(player.player_loop(ctx))
+
+            await asyncio.sleep(0.01)
+            voice_client.finish_track()
+            await asyncio.sleep(0.01)
+            self.assertEqual(len(voice_client.played), 2)
+            ctx.send.assert_awaited_once()
+
+            voice_client.finish_track()
+            await asyncio.wait_for(task, 1)
+            state.cancel_disconnect_timer()
+            player.player_messages.forget(ctx.guild.id)
+
+        asyncio.run(scenario())
+
+class TestStation(unittest.TestCase):
+    """Test cases for radio stations shared by several voice channels"""
+
+    def packets(self, n):
+        return [bytes([i]) for i in range(n)]
+
+    def test_one_pump_feeds_every_listener(self):
+        """Every listener gets the same packets from a single read of the source"""
+        station = Station('lofi')
+        first, second = station.subscribe(), station.subscribe()
+        source = PacketSource(self.packets(5))
+        station.pump(source, lambda: None)
+        self.assertTrue(source.cleaned_up)
+        self.assertEqual([first.read() for _ in range(5)], self.packets(5))
+        self.assertEqual([second.read() for _ in range(5)], self.packets(5))
+
+    def test_slow_listener_skips_to_the_live_edge(self):
+        """A listener that fell out of the bounded ring rejoins near the newest frame"""
+        station = Station('lofi', buffer_frames=20)
+        listener = station.subscribe()
+        with station.cond:
+            for packet in self.packets(50):
+                station.ring.append(packet)
+                station.head += 1
+        self.assertEqual(listener.read(), bytes([40]))
+        self.assertEqual(listener.dropped, 40)
+
+    def test_silence_until_closed(self):
+        """A caught-up listener hears silence, and the stream ends once the station closes"""
+        station = Station('lofi')
+        listener = station.subscribe()
+        self.assertEqual(listener.read(), OPUS_SILENCE)
+        listener.cleanup()
+        self.assertTrue(station.closed)
+        self.assertEqual(listener.read(), b'')
+
+    def test_clip_is_mixed_for_one_listener(self):
+        """A clip overlaid on a listener reaches only that guild, then Opus passes through again"""
+        station = Station('lofi')
+        first, second = station.subscribe(), station.subscribe()
+        with station.cond:
+            for packet in self.packets(STATION_JOIN_FRAMES + 3):
+                station.ring.append(packet)
+                station.head += 1
+        after = MagicMock()
+        first.overlay(np.full(PCM_FRAME_SAMPLES, 100, dtype=np.int16), after=after)
+        first.mixer.decoder = ConstantDecoder(1000)
+
+        self.assertTrue((np.frombuffer(first.read(), dtype=np.int16) == 1100).all())
+        self.assertFalse(first.is_opus())
+        after.assert_called_once_with()
+        self.assertEqual(second.read(), bytes([0]))
+        self.assertEqual(first.read(), second.read())
+        self.assertTrue(first.is_opus())
+
+    def test_clips_while_tuned_in(self):
+        """A tuned guild gets short clips mixed in and a reply for the rest, never a second play()"""
+        async def scenario():
+            player = make_player()
+            listener = Station('lofi').subscribe()
+            voice_client = MagicMock(source=listener)
+            voice_client.is_playing.return_value = True
+            voice_client.is_paused.return_value = False
+            ctx = MockContext(voice_client)
+            state = player.get_guild_state(ctx.guild.id)
+            state.listener = listener
+            player.soundboard.clips['okul'] = np.zeros(10, dtype=np.int16)
+            finished = MagicMock()
+
+            await player.do_interject(ctx, state, 'okul', finished)
+            self.assertTrue(listener.mixer.active)
+            finished.assert_not_called()
+
+            await player.do_interject(ctx, state, 'long', finished)
+            finished.assert_called_once_with()
+            ctx.send.assert_awaited_once()
+            voice_client.play.assert_not_called()
+
+        asyncio.run(scenario())
+
+    def test_drained_station_waits_for_tracks(self):
+        """Listeners stay on a station whose queue ran dry until more tracks arrive"""
+        async def scenario():
+            station = Station('lofi')
+            listener = station.subscribe()
+            prepare_source = AsyncMock(side_effect=lambda track: PacketSource(self.packets(2)))
+            station.enqueue(make_track(1))
+            task = station.start(prepare_source)
+            while prepare_source.await_count < 1 or station.queue:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.05)
+            self.assertFalse(task.done())
+
+            station.enqueue(make_track(2))
+            await asyncio.sleep(0.05)
+            self.assertEqual(prepare_source.await_count, 2)
+            self.assertFalse(station.closed)
+
+            listener.cleanup()
+            await asyncio.wait_for(task, 1)
+            self.assertTrue(station.closed)
+
+        asyncio.run(scenario())
+
+    def test_guilds_tune_in_to_one_pipeline(self):
+        """Two guilds share a station: one source per track, one listener each"""
+        async def scenario():
+            player = make_player()
+            player.bot.loop = asyncio.get_running_loop()
+            station = player.stations['lofi'] = Station('lofi', idle_timeout=0.05)
+            station.queue.extend([make_track(1), make_track(2)])
+            contexts = [MockContext(CallbackVoiceClient()) for _ in range(2)]
+            for guild_id, ctx in enumerate(contexts):
+                ctx.guild.id = guild_id
+                await player.tune(ctx, 'lofi')
+                self.assertIsInstance(ctx.voice_client.played[-1], StationListener)
+                ctx.send.assert_awaited_once()
+
+            prepare_source = AsyncMock(side_effect=lambda track, guild_id=None: PacketSource(self.packets(3)))
+            await asyncio.wait_for(station.start(prepare_source, player.station_closed), 1)
+            self.assertEqual(prepare_source.await_count, 2)
+            self.assertNotIn('lofi', player.stations)
+
+            await player.post(contexts[0], 'enqueue', [])
+            self.assertIsNone(player.get_guild_state(0).listener)
+            self.assertIsNotNone(player.get_guild_state(1).listener)
+
+        asyncio.run(scenario())
+
+class PacketSource:
+    """Opus source backed by a list of packets"""
+    def __init__(self, packets):
+        self.packets = list(packets)
+        self.cleaned_up = False
+
+    def read(self):
+        return self.packets.pop(0) if self.packets else b''
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        self.cleaned_up = True
+
+class ConstantDecoder:
+    """Opus decoder stand-in that turns every packet into a constant frame"""
+    def __init__(self, value):
+        self.frame = np.full(PCM_FRAME_SAMPLES, value, dtype=np.int16).tobytes()
+
+    def decode(self, packet):
+        return self.frame
+
+class TestWarmOpusSource(unittest.TestCase):
+    """Test cases for the ring-buffered Opus source"""
+
+    def setUp(self):
+        self.source = WarmOpusSource(PacketSource([b'%d' % i for i in range(10)]), history_frames=4)
+
+    def read(self, count):
+        return [self.source.read() for _ in range(count)]
+
+    def test_interjection_resumes_at_same_frame(self):
+        """The track continues with the frame after the one played before the interjection"""
+        after = MagicMock()
+        self.source.warm(frames=5)
+        self.assertEqual(self.read(2), [b'0', b'1'])
+
+        clip = PacketSource([b'a', b'b'])
+        self.source.interject(clip, after=after)
+        self.assertEqual(self.read(4), [b'a', b'b', b'2', b'3'])
+        self.assertTrue(clip.cleaned_up)
+        after.assert_called_once_with()
+        self.assertEqual(self.source.position, 4)
+
+    def test_seek_back_replays_from_memory(self):
+        """Rewinding replays played frames without reading the source again"""
+        self.read(6)
+        self.assertEqual(self.source.seek_back(0.04), 0.04)
+        self.assertEqual(self.source.position, 4)
+        self.assertEqual(self.read(3), [b'4', b'5', b'6'])
+
+    def test_seek_back_is_bounded_by_history(self):
+        """Only the frames kept in the ring can be rewound"""
+        self.read(6)
+        self.assertAlmostEqual(self.source.seek_back(10), 0.08)
+        self.assertEqual(self.read(4), [b'2', b'3', b'4', b'5'])
+
+    def test_overlay_switches_to_pcm_while_mixing(self):
+        """Frames are decoded and mixed only while a clip plays, then Opus passes through again"""
+        after = MagicMock()
+        self.source.overlay(np.full(PCM_FRAME_SAMPLES + 10, 100, dtype=np.int16), after=after)
+        self.source.mixer.decoder = ConstantDecoder(1000)
+
+        first = np.frombuffer(self.source.read(), dtype=np.int16)
+        self.assertFalse(self.source.is_opus())
+        self.assertTrue((first == 1100).all())
+
+        second = np.frombuffer(self.source.read(), dtype=np.int16)
+        self.assertEqual(list(second[:11]), [1100] * 10 + [1000])
+        after.assert_called_once_with()
+
+        self.assertEqual(self.source.read(), b'2')
+        self.assertTrue(self.source.is_opus())
+        self.assertEqual(self.source.position, 3)
+
+    def test_elapsed_counts_from_resume_offset(self):
+        """A source started at a resume offset reports its position within the whole track"""
+        source = WarmOpusSource(PacketSource([b'%d' % i for i in range(10)]), offset=42.0)
+        for _ in range(5):
+            source.read()
+        self.assertAlmostEqual(source.elapsed, 42.1)
+
+class TestPCMMixer(unittest.TestCase):
+    """Test cases for the soundboard mixer"""
+
+    def test_sum_is_clipped(self):
+        """Overlapping loud clips saturate instead of wrapping around"""
+        mixer = PCMMixer()
+        mixer.add(np.full(PCM_FRAME_SAMPLES, 30000, dtype=np.int16))
+        mixer.add(np.full(PCM_FRAME_SAMPLES, 30000, dtype=np.int16))
+        frame = np.frombuffer(mixer.mix(ConstantDecoder(-1000).frame), dtype=np.int16)
+        self.assertTrue((frame == 32767).all())
+        self.assertFalse(mixer.active)
+
+    def test_clip_plays_over_silence(self):
+        """Without music the clip is mixed onto silence"""
+        mixer = PCMMixer()
+        mixer.add(np.full(4, -5, dtype=np.int16))
+        frame = np.frombuffer(mixer.mix(), dtype=np.int16)
+        self.assertEqual(len(frame), PCM_FRAME_SAMPLES)
+        self.assertEqual(list(frame[:6]), [-5, -5, -5, -5, 0, 0])
+
+class TestFFmpegPipeline(unittest.TestCase):
+    """Test cases for choosing the FFmpeg pipeline of a track"""
+
+    def test_normalize_mode_falls_back_to_dynaudnorm(self):
+        """Tracks that were never measured still get dynaudnorm"""
+        name, options = ffmpeg_pipeline({'acodec': 'opus'}, mode='normalize')
+        self.assertEqual(name, 'dynaudnorm')
+        self.assertIn('dynaudnorm', options['options'])
+
+    def test_normalize_mode_uses_measured_gain(self):
+        """Measured tracks get a static volume instead of the adaptive filter"""
+        name, options = ffmpeg_pipeline({'acodec': 'opus', 'gain_db': 3.0}, mode='normalize')
+        self.assertEqual(name, 'gain')
+        self.assertEqual(options['options'], '-vn -af volume=3.00dB')
+
+    def test_opus_is_copied_in_passthrough(self):
+        """Opus sources with a small gain correction are remuxed untouched"""
+        name, options = ffmpeg_pipeline({'acodec': 'opus', 'asr': 48000, 'gain_db': -1.0}, mode='passthrough')
+        self.assertEqual(name, 'copy')
+        self.assertEqual(options['codec'], 'copy')
+        self.assertNotIn('-af', options['options'])
+
+    def test_large_gain_is_applied_as_volume(self):
+        """A large correction is applied as a static volume instead of a filter chain"""
+        name, options = ffmpeg_pipeline({'acodec': 'opus', 'gain_db': -6.5}, mode='passthrough')
+        self.assertEqual(name, 'gain')
+        self.assertIn('volume=-6.50dB', options['options'])
+
+    def test_other_codecs_are_encoded_without_filter(self):
+        """Non-Opus sources are encoded, but without dynaudnorm"""
+        name, options = ffmpeg_pipeline({'acodec': 'mp4a.40.2'}, mode='passthrough')
+        self.assertEqual(name, 'encode')
+        self.assertNotIn('codec', options)
+
+class TestFFmpegBudget(unittest.TestCase):
+    """Test cases for FFmpeg admission control"""
+
+    def test_fallbacks_go_from_configured_to_cheapest(self):
+        """An Opus source can fall back all the way to a remux"""
+        names = [name for name, _ in fallback_pipelines({'acodec': 'opus', 'asr': 48000})]
+        self.assertEqual(names[-2:], ['encode', 'copy'])
+        self.assertNotIn('copy', [name for name, _ in fallback_pipelines({'acodec': 'mp4a.40.2'})])
+
+    def test_start_over_budget_is_degraded(self):
+        """Without room for the configured pipeline a cheaper one is chosen"""
+        async def scenario():
+            budget = FFmpegBudget(budget=1.2, timeout=0)
+            pipelines = fallback_pipelines({'acodec': 'opus', 'asr': 48000})
+            first = await budget.admit(pipelines)
+            second = await budget.admit(pipelines)
+            self.assertEqual(first[1], 'dynaudnorm')
+            self.assertEqual(second[1], 'copy')
+            self.assertAlmostEqual(budget.used, 1.05)
+
+        asyncio.run(scenario())
+
+    def test_start_waits_for_a_release(self):
+        """A start that fits no pipeline is queued until a process exits"""
+        async def scenario():
+            budget = FFmpegBudget(budget=1.0, timeout=1)
+            pipelines = fallback_pipelines({'acodec': 'mp4a.40.2'})
+            lease, _, _ = await budget.admit(pipelines)
+            waiting = asyncio.create_task(budget.admit(pipelines))
+            await asyncio.sleep(0.01)
+            self.assertFalse(waiting.done())
+
+            lease.release()
+            _, name, _ = await asyncio.wait_for(waiting, 0.1)
+            self.assertEqual(name, 'dynaudnorm')
+            self.assertEqual(len(budget.leases), 1)
+
+        asyncio.run(scenario())
+
+    def test_start_runs_cheapest_after_timeout(self):
+        """Waiting is bounded: the cheapest pipeline starts anyway"""
+        async def scenario():
+            budget = FFmpegBudget(budget=0, timeout=0.01)
+            _, name, _ = await budget.admit(fallback_pipelines({'acodec': 'mp4a.40.2'}))
+            self.assertEqual(name, 'encode')
+
+        asyncio.run(scenario())
+
+    def test_start_over_cpu_limit_runs_cheapest_at_once(self):
+        """CPU pressure degrades a start straight to the cheapest pipeline without waiting"""
+        async def scenario():
+            budget = FFmpegBudget(cpu_limit=0.5, timeout=5)
+            budget.cpu = budget.cpu_limit + 1
+            _, name, _ = await asyncio.wait_for(budget.admit(fallback_pipelines({'acodec': 'opus', 'asr': 48000})), 0.1)
+            self.assertEqual(name, 'copy')
+
+        asyncio.run(scenario())
+
+    def test_sample_measures_and_reaps_processes(self):
+        """Live processes are measured; exited ones give their budget back"""
+        async def scenario():
+            budget = FFmpegBudget()
+            process = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(5)'])
+            try:
+                lease = budget.reserve('encode')
+                lease.attach(MagicMock(_process=process))
+                budget.sample()
+                self.assertIsNotNone(lease.sample)
+                self.assertGreater(process_usage(process.pid)[1], 0)
+            finally:
+                process.kill()
+                process.wait()
+            budget.sample()
+            self.assertEqual(budget.leases, set())
+            self.assertEqual(budget.used, 0)
+
+        asyncio.run(scenario())
+
+class TestLoudnessAnalyzer(unittest.TestCase):
+    """Test cases for the loudness analysis subsystem"""
+
+    def test_parse_ebur128_summary(self):
+        """The integrated loudness is read from the filter summary"""
+        output = """[Parsed_ebur128_0 @ 0x1] Summary:
+
+  Integrated loudness:
+    I:         -9.3 LUFS
+    Threshold: -19.6 LUFS"""
+        self.assertEqual(parse_integrated_loudness(output), -9.3)
+        self.assertIsNone(parse_integrated_loudness('    I:         -70.0 LUFS'))
+        self.assertIsNone(parse_integrated_loudness('no summary'))
+
+    def test_gain_is_clamped(self):
+        """Loud tracks are cut and quiet tracks are boosted within limits"""
+        self.assertEqual(gain_for_loudness(-9.0), -5.0)
+        self.assertEqual(gain_for_loudness(-40.0), 6.0)
+
+    def test_measures_once_and_remembers(self):
+        """A track is analyzed once, later lookups come from memory"""
+        analyzer = LoudnessAnalyzer()
+        analyzer.measure = AsyncMock(return_value=-10.0)
+
+        async def scenario():
+            await analyzer.schedule('abc', 'https://stream')
+            self.assertIsNone(analyzer.schedule('abc', 'https://stream'))
+
+        asyncio.run(scenario())
+        self.assertEqual(analyzer.gain_for('abc'), -4.0)
+        analyzer.measure.assert_awaited_once_with('https://stream')
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+import unittest
+import os
+import random
+import sys
+
+# Add the src directory to the path so we can import main
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import asyncio
+import time
+from unittest.mock import AsyncMock, MagicMock
+
+from main import FFmpegLog, QueueSnapshots, Track, TrackIndex, TrackQueue, YouTubeCache, YouTubeService, STREAM_URL_MIN_TTL, stream_cache_ttl
+
+class TestTrackQueue(unittest.TestCase):
+    """Test cases for the indexed queue"""
+
+    def test_matches_list_semantics(self):
+        """Random positional operations agree with a plain list"""
+        rng = random.Random(7)
+        queue, model = TrackQueue(range(50)), list(range(50))
+        for step in range(2000):
+            operation = rng.choice(('append', 'appendleft', 'insert', 'pop', 'popleft', 'move'))
+            if operation == 'append':
+                queue.append(step)
+                model.append(step)
+            elif operation == 'appendleft':
+                queue.appendleft(step)
+                model.insert(0, step)
+            elif operation == 'insert':
+                index = rng.randint(0, len(model))
+                queue.insert(index, step)
+                model.insert(index, step)
+            elif not model:
+                continue
+            elif operation == 'pop':
+                index = rng.randrange(len(model))
+                self.assertEqual(queue.pop(index), model.pop(index))
+            elif operation == 'popleft':
+                self.assertEqual(queue.popleft(), model.pop(0))
+            else:
+                source, target = rng.randrange(len(model)), rng.randrange(len(model))
+                queue.move(source, target)
+                model.insert(target, model.pop(source))
+        self.assertEqual(list(queue), model)
+        self.assertEqual(len(queue), len(model))
+        self.assertEqual(queue[len(model) // 2], model[len(model) // 2])
+        self.assertEqual(queue[-1], model[-1])
+
+    def test_journal_replays_changes(self):
+        """Replaying the journal onto the previous contents gives the current queue"""
+        rng = random.Random(11)
+        queue = TrackQueue(range(20))
+        shadow = list(queue)
+        queue.take_journal()
+        for step in range(200):
+            operation = rng.choice(('append', 'appendleft', 'insert', 'pop', 'move'))
+            if operation == 'append':
+                queue.append(step)
+            elif operation == 'appendleft':
+                queue.appendleft(step)
+            elif operation == 'insert':
+                queue.insert(rng.randint(-5, len(queue) + 5), step)
+            elif operation == 'pop':
+                queue.pop(rng.randrange(-len(queue), len(queue)))
+            else:
+                queue.move(rng.randrange(len(queue)), rng.randrange(len(queue)))
+            if step % 50 == 49:
+                QueueSnapshots._replay(shadow, queue.take_journal())
+                self.assertEqual(shadow, list(queue))
+
+        queue.shuffle()
+        queue.append('x')
+        self.assertEqual(queue.take_journal(), [('reset',)])
+
+    def test_pages_and_slices(self):
+        """Pages start at any position without walking the items before it"""
+        queue = TrackQueue(range(10000))
+        self.assertEqual(queue.page(9995, 10), [9995, 9996, 9997, 9998, 9999])
+        self.assertEqual(queue[:3], [0, 1, 2])
+        self.assertEqual(queue[4000:4003], [4000, 4001, 4002])
+
+    def test_shuffle_keeps_items(self):
+        queue = TrackQueue(range(1000))
+        queue.shuffle()
+        self.assertEqual(sorted(queue), list(range(1000)))
+        self.assertEqual(len(queue), 1000)
+
+    def test_empty_queue(self):
+        queue = TrackQueue()
+        self.assertFalse(queue)
+        with self.assertRaises(IndexError):
+            queue.popleft()
+        with self.assertRaises(IndexError):
+            queue[0]
+
+class TestTrack(unittest.TestCase):
+    """Test cases for the compact track record"""
+
+    def test_reads_like_a_dict(self):
+        """Unset fields behave like missing keys"""
+        track = Track('https://stream/1', title='One', duration=10)
+        self.assertEqual(track['title'], 'One')
+        self.assertIn('title', track)
+        self.assertNotIn('gain_db', track)
+        self.assertEqual(track.get('gain_db', 0), 0)
+        track['resume_at'] = 5.0
+        self.assertEqual(track.pop('resume_at'), 5.0)
+        self.assertIsNone(track.get('resume_at'))
+        self.assertEqual(dict(track), {'url': 'https://stream/1', 'title': 'One', 'duration': 10})
+        self.assertEqual(Track.from_dict(dict(track, unknown=1)).title, 'One')
+        with self.assertRaises(KeyError):
+            track['unknown'] = 1
+
+class TestJustInTimeStreams(unittest.TestCase):
+    """Test cases for metadata-only tracks that get a stream URL before playing"""
+
+    def setUp(self):
+        self.service = YouTubeService(MagicMock())
+        self.service.cache = YouTubeCache()
+        self.service.index = TrackIndex()
+
+    def stream(self, expires_in):
+        return f'https://rr1.googlevideo.com/videoplayback?expire={int(time.time() + expires_in)}&id=a'
+
+    def test_flat_entry_has_no_stream(self):
+        """A playlist entry keeps its watch page and waits for a stream URL"""
+        track = self.service.format_track_data({'url': 'https://www.youtube.com/watch?v=a', 'title': 'A'})
+        self.assertIsNone(track['url'])
+        self.assertEqual(track['webpage_url'], 'https://www.youtube.com/watch?v=a')
+        self.assertEqual(track['title'], 'A')
+
+    def test_resolves_only_missing_or_expiring_urls(self):
+        """Extraction runs for a flat track or one whose URL is about to expire"""
+        fresh = self.stream(3600)
+        self.service.extract_info = AsyncMock(return_value={'url': fresh, 'acodec': 'opus'})
+
+        flat = Track(webpage_url='https://www.youtube.com/watch?v=a', title='A')
+        self.assertEqual(asyncio.run(self.service.resolve_stream_url(flat)), fresh)
+        self.assertEqual(flat['acodec'], 'opus')
+
+        asyncio.run(self.service.resolve_stream_url(flat))
+        self.assertEqual(self.service.extract_info.await_count, 1)
+
+        expiring = Track(self.stream(STREAM_URL_MIN_TTL / 2), webpage_url='https://www.youtube.com/watch?v=a')
+        self.assertEqual(asyncio.run(self.service.resolve_stream_url(expiring)), fresh)
+        asyncio.run(self.service.resolve_stream_url(flat, refresh=True))
+        self.service.extract_info.assert_awaited_with('https://www.youtube.com/watch?v=a', refresh=True, guild_id=None)
+
+    def test_cache_ttl_follows_stream_expiry(self):
+        """Extracted info is cached until shortly before its stream URL expires"""
+        self.assertAlmostEqual(stream_cache_ttl({'url': self.stream(3600)}), 3600 - STREAM_URL_MIN_TTL, delta=2)
+        self.assertIsNone(stream_cache_ttl({'url': 'https://example.com/a.mp3'}))
+
+        self.service.cache.set('info:a', {'title': 'A'}, ttl=-1)
+        self.assertIsNone(self.service.cache.get('info:a'))
+
+    def test_ffmpeg_log_detects_forbidden_stream(self):
+        """A 403 from the CDN is noticed even when split across writes"""
+        log = FFmpegLog()
+        log.write(b'[https @ 0x1] HTTP error 4')
+        self.assertFalse(log.forbidden)
+        log.write(b'03 Forbidden\n')
+        self.assertTrue(log.forbidden)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+import os
+import sys
+from unittest.mock import MagicMock, patch
+
+# Add the src directory to the path so we can import main
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from main import ShardSupervisor, parse_shard_ids, shard_ranges
+
+class TestSharding(unittest.TestCase):
+    """Test cases for the multi-process shard supervisor"""
+
+    def test_shards_are_split_evenly(self):
+        """Every shard is assigned to exactly one worker"""
+        self.assertEqual(shard_ranges(5, 2), [[0, 1, 2], [3, 4]])
+        self.assertEqual(shard_ranges(2, 8), [[0], [1]])
+        self.assertEqual(parse_shard_ids("3,4"), [3, 4])
+
+    def test_worker_env(self):
+        """Workers get their shard range and their own metrics port"""
+        supervisor = ShardSupervisor(4, processes=2)
+        with patch('main.METRICS_PORT', 9100):
+            env = supervisor.worker_env(1)
+        self.assertEqual(env['SHARD_IDS'], '2,3')
+        self.assertEqual(env['SHARD_COUNT'], '4')
+        self.assertEqual(env['METRICS_PORT'], '9101')
+
+    def test_exited_worker_is_restarted(self):
+        """A crashed worker is started again once the restart delay has passed"""
+        supervisor = ShardSupervisor(2, processes=2, restart_delay=0)
+        crashed = MagicMock(returncode=1)
+        crashed.poll.return_value = 1
+        running = MagicMock()
+        running.poll.return_value = None
+        supervisor.workers = {0: crashed, 1: running}
+
+        with patch('main.subprocess.Popen') as popen:
+            supervisor.poll()
+        popen.assert_called_once()
+        self.assertEqual(popen.call_args.kwargs['env']['SHARD_IDS'], '0')
+        self.assertIs(supervisor.workers[1], running)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+import asyncio
+import os
+import sys
+import time
+from unittest.mock import MagicMock, patch
+
+# Add the src directory to the path so we can import main
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from main import TimerWheel, YouTubeCache, MusicPlayer, GUILD_STATE_TTL, timers
+
+class TestTimerWheel(unittest.TestCase):
+    """Test cases for the timing wheel that owns every deadline"""
+
+    def setUp(self):
+        self.wheel = TimerWheel(tick=1.0, slots=8)
+        self.fired = []
+
+    def test_fires_only_due_timers(self):
+        """A timer fires once its tick is reached, and only then"""
+        start = self.wheel.current
+        self.wheel.schedule('a', 2, lambda: self.fired.append('a'))
+        self.wheel.schedule('b', 5, lambda: self.fired.append('b'))
+        self.assertEqual(self.wheel.advance(start + 1), 0)
+        self.wheel.advance(start + 3)
+        self.assertEqual(self.fired, ['a'])
+        self.wheel.advance(start + 6)
+        self.assertEqual(self.fired, ['a', 'b'])
+        self.assertEqual(len(self.wheel), 0)
+        self.assertEqual(self.wheel.slots, {})
+
+    def test_reschedule_and_cancel(self):
+        """Scheduling a key again moves its deadline; cancelled timers never fire"""
+        start = self.wheel.current
+        self.wheel.schedule('a', 2, lambda: self.fired.append('a'))
+        self.wheel.schedule('a', 4, lambda: self.fired.append('a2'))
+        self.wheel.schedule('b', 2, lambda: self.fired.append('b'))
+        self.wheel.cancel('b')
+        self.wheel.advance(start + 3)
+        self.assertEqual(self.fired, [])
+        self.wheel.advance(start + 5)
+        self.assertEqual(self.fired, ['a2'])
+
+    def test_deadline_beyond_one_turn(self):
+        """A deadline several turns ahead is skipped when its slot comes round early"""
+        start = self.wheel.current
+        self.wheel.schedule('far', 20, lambda: self.fired.append('far'))
+        self.wheel.advance(start + 12)
+        self.assertEqual(self.fired, [])
+        self.wheel.advance(start + 30)
+        self.assertEqual(self.fired, ['far'])
+
+    def test_runs_on_the_event_loop(self):
+        """The wheel task fires timers by itself and stops when none are left"""
+        async def scenario():
+            wheel = TimerWheel(tick=0.01)
+            wheel.schedule('a', 0.02, lambda: self.fired.append('a'))
+            await asyncio.sleep(0.1)
+            self.assertEqual(self.fired, ['a'])
+            await asyncio.sleep(0.02)
+            self.assertTrue(wheel.task.done())
+
+        asyncio.run(scenario())
+
+class TestDeadlines(unittest.TestCase):
+    """Test cases for the deadlines the bot hands to the wheel"""
+
+    def test_cache_entry_expires_without_a_scan(self):
+        """A memory cache entry is dropped by its own timer"""
+        cache = YouTubeCache(ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2, ttl=-1)
+        self.assertIn((cache, 'entry', 'b'), timers)
+        timers.advance(timers._now() + 1)
+        self.assertEqual(list(cache.cache), ['a'])
+        timers.cancel((cache, 'entry', 'a'))
+
+    def test_lru_eviction_cancels_timer(self):
+        """An entry evicted from memory does not keep its timer"""
+        cache = YouTubeCache(max_entries=1)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertNotIn((cache, 'entry', 'a'), timers)
+        timers.cancel((cache, 'entry', 'b'))
+
+    def test_idle_guild_state_is_evicted(self):
+        """A guild state is dropped once idle, and kept while it has a queue or a station"""
+        with patch('main.CACHE_DB_PATH', ''), patch('main.TRANSCODE_CACHE_DIR', ''):
+            player = MusicPlayer(MagicMock())
+        state = player.get_guild_state(42)
+        self.assertIn(('evict', 42), timers)
+
+        state.queue.append({'url': 'https://stream/1'})
+        state.last_activity = time.time() - GUILD_STATE_TTL
+        player._evict_guild_state(42)
+        self.assertIn(42, player.guild_states)
+        self.assertIn(('evict', 42), timers)
+
+        state.queue.clear()
+        state.listener = MagicMock()  # Tuned to a radio station
+        player._evict_guild_state(42)
+        self.assertIn(42, player.guild_states)
+
+        state.listener = None
+        player._evict_guild_state(42)
+        self.assertNotIn(42, player.guild_states)
+        timers.cancel(('evict', 42))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,321 @@
+import unittest
+import asyncio
+import itertools
+import os
+import sys
+import threading
+from concurrent.futures.process import BrokenProcessPool
+from unittest.mock import AsyncMock, MagicMock
+
+# Add the src directory to the path so we can import main
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from main import (
+    YouTubeService, YouTubeCache, ThreadExtractionBackend, ProcessExtractionBackend, AdaptiveLimiter, ExtractionScheduler,
+    PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND, slim_info, TrackIndex, normalize_query,
+)
+
+class FakeBackend:
+    """Extraction backend returning canned results"""
+    def __init__(self, results, delay=0):
+        self.results = results
+        self.delay = delay
+        self.calls = []
+
+    async def extract(self, opts, url):
+        self.calls.append(url)
+        await asyncio.sleep(self.delay)
+        result = self.results[url]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+class FakePlaylistBackend(FakeBackend):
+    """Backend serving a playlist of `size` entries page by page"""
+    def __init__(self, size):
+        super().__init__({})
+        self.size = size
+        self.pages_taken = 0
+
+    def iter_playlist(self, opts, url):
+        return iter([{'url': f'https://www.youtube.com/watch?v={i}'} for i in range(self.size)])
+
+    async def take_page(self, entries, size):
+        self.pages_taken += 1
+        return list(itertools.islice(entries, size))
+
+class BlockingPlaylistBackend(ThreadExtractionBackend):
+    """Backend whose playlist generator stalls mid-page on a worker thread"""
+    def __init__(self):
+        self.fetching = threading.Event()
+        self.release = threading.Event()
+        self.closed = threading.Event()
+
+    def iter_playlist(self, opts, url):
+        def entries():
+            try:
+                self.fetching.set()
+                self.release.wait(5)
+                while True:
+                    yield {'url': 'https://www.youtube.com/watch?v=x'}
+            finally:
+                self.closed.set()
+        return entries()
+
+class TestTrackIndex(unittest.TestCase):
+    """Test cases for the local search index"""
+
+    def setUp(self):
+        self.index = TrackIndex()
+        for video_id, title, uploader in (
+            ('dQw4w9WgXcQ', 'Rick Astley - Never Gonna Give You Up (Official Music Video)', 'Rick Astley'),
+            ('fJ9rUzIMcZQ', 'Queen – Bohemian Rhapsody (Official Video Remastered)', 'Queen Official'),
+            ('hTWKbfoikeg', 'Nirvana - Smells Like Teen Spirit', 'Nirvana'),
+        ):
+            self.index.add({'id': video_id, 'title': title, 'uploader': uploader})
+
+    def test_normalize(self):
+        self.assertEqual(normalize_query('  Beyoncé —  HALO!! '), 'beyonce halo')
+
+    def test_autocomplete_ranks_by_similarity(self):
+        """Partial and misspelled queries still find the track"""
+        self.assertEqual(self.index.search('bohemian rapsody')[0]['id'], 'fJ9rUzIMcZQ')
+        self.assertEqual(self.index.search('smells like')[0]['id'], 'hTWKbfoikeg')
+        self.assertEqual(self.index.search('dQw4w9WgXcQ')[0]['id'], 'dQw4w9WgXcQ')
+        self.assertEqual(self.index.search(''), [])
+
+    def test_lookup_needs_a_confident_match(self):
+        """Full titles are answered locally, vague queries go to YouTube"""
+        self.assertEqual(self.index.lookup('nirvana smells like teen spirit')['url'], 'https://www.youtube.com/watch?v=hTWKbfoikeg')
+        self.assertIsNone(self.index.lookup('nirvana'))
+        self.assertIsNone(self.index.lookup('bohemian rhapsody live aid'))
+
+    def test_index_is_bounded(self):
+        index = TrackIndex(max_tracks=2)
+        for i in range(3):
+            index.add({'id': f'v{i}', 'title': f'Song {i}'})
+        self.assertEqual(list(index.tracks), ['v1', 'v2'])
+        self.assertNotIn('v0', index.postings.get(' so', set()))
+
+class TestYouTubeService(unittest.TestCase):
+    """Test cases for YouTubeService extraction"""
+
+    def make_service(self, results, delay=0):
+        service = YouTubeService(backend=FakeBackend(results, delay))
+        service.cache = YouTubeCache()
+        service.index = TrackIndex()
+        return service
+
+    def test_slim_info_drops_heavy_fields(self):
+        """Only the fields used by the bot survive"""
+        info = {
+            'id': 'abc', 'url': 'https://stream', 'title': 'Song', 'formats': [{}] * 50,
+            'entries': [{'url': 'https://www.youtube.com/watch?v=x', 'title': 'X', 'thumbnails': []}, None],
+        }
+        self.assertEqual(slim_info(info), {
+            'id': 'abc', 'url': 'https://stream', 'title': 'Song',
+            'entries': [{'url': 'https://www.youtube.com/watch?v=x', 'title': 'X'}, None],
+        })
+
+    def test_extract_info_uses_backend_and_cache(self):
+        """A second extraction of the same URL is served from the cache"""
+        service = self.make_service({'https://youtu.be/a': {'url': 'https://stream/a'}})
+        first = asyncio.run(service.extract_info('https://youtu.be/a'))
+        second = asyncio.run(service.extract_info('https://youtu.be/a'))
+        self.assertEqual(first, second)
+        self.assertEqual(service.backend.calls, ['https://youtu.be/a'])
+
+    def test_search_errors_return_none(self):
+        """Backend failures are reported as no result"""
+        service = self.make_service({'ytsearch:song': RuntimeError('boom')})
+        self.assertIsNone(asyncio.run(service.search_youtube('song')))
+
+    def test_concurrent_identical_requests_are_coalesced(self):
+        """Ten concurrent callers share one extraction"""
+        service = self.make_service({'https://youtu.be/a': {'url': 'https://stream/a'}}, delay=0.01)
+
+        async def scenario():
+            return await asyncio.gather(*[service.extract_info('https://youtu.be/a') for _ in range(10)])
+
+        results = asyncio.run(scenario())
+        self.assertEqual(service.backend.calls, ['https://youtu.be/a'])
+        self.assertTrue(all(r == {'url': 'https://stream/a'} for r in results))
+        self.assertEqual(service.inflight, {})
+
+    def test_cancelled_caller_does_not_cancel_shared_extraction(self):
+        """Other callers still get the result when one of them is cancelled"""
+        service = self.make_service({'ytsearch:song': {'entries': [{'url': 'https://youtu.be/s'}]}}, delay=0.01)
+
+        async def scenario():
+            first = asyncio.create_task(service.search_youtube('song'))
+            second = asyncio.create_task(service.search_youtube('song'))
+            await asyncio.sleep(0)
+            first.cancel()
+            return await second
+
+        self.assertEqual(asyncio.run(scenario()), {'url': 'https://youtu.be/s'})
+        self.assertEqual(service.backend.calls, ['ytsearch:song'])
+
+    def test_iter_playlist_yields_pages(self):
+        """Playlists stream page by page without being cached as a whole"""
+        service = YouTubeService(backend=FakePlaylistBackend(120))
+        service.cache = YouTubeCache()
+
+        async def scenario():
+            return [len(page) async for page in service.iter_playlist('https://youtube.com/playlist?list=x', page_size=50)]
+
+        self.assertEqual(asyncio.run(scenario()), [50, 50, 20])
+        self.assertEqual(service.backend.pages_taken, 3)
+        self.assertEqual(service.cache.cache, {})
+
+    def test_cancel_during_page_closes_cleanly(self):
+        """Cancelling a backfill mid-page ends it cleanly and closes the playlist afterwards"""
+        service = YouTubeService(backend=BlockingPlaylistBackend())
+        service.cache = YouTubeCache()
+        backend = service.backend
+
+        async def scenario():
+            async def consume():
+                async for _ in service.iter_playlist('https://youtube.com/playlist?list=x', page_size=50):
+                    pass
+
+            task = asyncio.create_task(consume())
+            await asyncio.get_running_loop().run_in_executor(None, backend.fetching.wait, 5)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            self.assertFalse(backend.closed.is_set())
+
+            backend.release.set()
+            await asyncio.get_running_loop().run_in_executor(None, backend.closed.wait, 5)
+            self.assertTrue(backend.closed.is_set())
+
+        asyncio.run(scenario())
+
+    def test_process_backend_falls_back_to_threads(self):
+        """A broken worker pool does not break extraction"""
+        backend = ProcessExtractionBackend(workers=1)
+        pool = MagicMock()
+        pool.submit.side_effect = BrokenProcessPool('worker died')
+        backend.pool = pool
+        backend.fallback.extract = AsyncMock(return_value={'url': 'https://stream'})
+
+        result = asyncio.run(backend.extract({}, 'https://youtu.be/a'))
+
+        self.assertEqual(result, {'url': 'https://stream'})
+        self.assertIsNone(backend.pool)
+
+    def test_process_backend_keeps_error_message(self):
+        """An extraction error comes back from a real worker with its message intact"""
+        backend = ProcessExtractionBackend(workers=1)
+
+        async def scenario():
+            try:
+                return await backend.extract({'quiet': True, 'no_warnings': True}, 'not a url')
+            finally:
+                backend.pool.shutdown()
+
+        with self.assertRaises(RuntimeError) as caught:
+            asyncio.run(scenario())
+        self.assertIn('is not a valid URL', str(caught.exception))
+
+class TestLocalSearch(unittest.TestCase):
+    """Test cases for answering repeat searches from the index"""
+
+    def test_repeat_search_is_answered_locally(self):
+        """A differently typed repeat of a search does not reach YouTube"""
+        entry = {'id': 'abc', 'url': 'https://www.youtube.com/watch?v=abc', 'title': 'Daft Punk - Around the World'}
+        service = YouTubeService(backend=FakeBackend({'ytsearch:Around the World': {'entries': [entry]}}))
+        service.cache = YouTubeCache()
+        service.index = TrackIndex()
+
+        first = asyncio.run(service.search_youtube('Around the World'))
+        second = asyncio.run(service.search_youtube('around   the world!'))
+        self.assertEqual(first['id'], 'abc')
+        self.assertEqual(second['url'], 'https://www.youtube.com/watch?v=abc')
+        self.assertEqual(service.backend.calls, ['ytsearch:Around the World'])
+
+class TestAdaptiveLimiter(unittest.TestCase):
+    """Test cases for the AIMD extraction limiter"""
+
+    def test_limit_grows_on_success(self):
+        """Successful extractions ramp concurrency and rate up"""
+        limiter = AdaptiveLimiter(limit=2, rate=1000)
+
+        async def scenario():
+            for _ in range(10):
+                async with limiter.slot():
+                    pass
+
+        asyncio.run(scenario())
+        self.assertGreater(limiter.limit, 2)
+        self.assertEqual(limiter.stats()['success'], 10)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_throttling_halves_limits(self):
+        """An HTTP 429 backs concurrency and rate off sharply"""
+        limiter = AdaptiveLimiter(limit=8, rate=10)
+
+        async def scenario():
+            async with limiter.slot() as slot:
+                slot.failed(Exception('HTTP Error 429: Too Many Requests'))
+            async with limiter.slot() as slot:
+                slot.failed(Exception('HTTP Error 429: Too Many Requests'))
+
+        asyncio.run(scenario())
+        # Both failures land inside one cooldown window and count as one backoff
+        self.assertEqual(limiter.limit, 4)
+        self.assertLess(limiter.rate, 10)
+        self.assertEqual(limiter.stats()['throttled'], 2)
+
+    def test_concurrency_is_capped(self):
+        """No more than `limit` extractions run at once"""
+        limiter = AdaptiveLimiter(limit=2, max_limit=2, rate=1000)
+        peak = 0
+
+        async def job():
+            nonlocal peak
+            async with limiter.slot():
+                peak = max(peak, limiter.in_flight)
+                await asyncio.sleep(0.01)
+
+        async def scenario():
+            await asyncio.gather(*[job() for _ in range(6)])
+
+        asyncio.run(scenario())
+        self.assertEqual(peak, 2)
+        self.assertEqual(limiter.in_flight, 0)
+
+class TestExtractionScheduler(unittest.TestCase):
+    """Test cases for fair cross-guild scheduling"""
+
+    def run_jobs(self, jobs):
+        """Run (guild_id, priority) jobs one at a time and return the order they were served in"""
+        scheduler = ExtractionScheduler(AdaptiveLimiter(limit=1, max_limit=1, rate=1000, max_rate=1000))
+        served = []
+
+        async def job(guild_id, priority):
+            async with scheduler.slot(guild_id, priority):
+                served.append((guild_id, priority))
+                await asyncio.sleep(0)
+
+        async def scenario():
+            await asyncio.gather(*[job(*j) for j in jobs])
+
+        asyncio.run(scenario())
+        return served
+
+    def test_interactive_jumps_background_backfill(self):
+        """A single /play is not stuck behind another guild's playlist"""
+        jobs = [('A', PRIORITY_BACKGROUND)] * 10 + [('B', PRIORITY_INTERACTIVE)]
+        served = self.run_jobs(jobs)
+        self.assertLessEqual(served.index(('B', PRIORITY_INTERACTIVE)), 1)
+
+    def test_background_work_is_round_robin(self):
+        """Two guilds backfilling playlists take turns"""
+        jobs = [('A', PRIORITY_BACKGROUND)] * 6 + [('B', PRIORITY_BACKGROUND)] * 3
+        served = [guild for guild, _ in self.run_jobs(jobs)]
+        self.assertEqual(served[:6].count('B'), 3)
+
+if __name__ == "__main__":
+    unittest.main()